@@ -4,7 +4,8 @@
 Unified OSM Surface Statistics Analyzer
 Downloads countries, modifies ways, and analyzes surface tag coverage
 
-Usage: ./analyze_countries.py [directory] [--skip-download] [--skip-modify]
+Usage: ./analyze_countries.py [directory] [--skip-download] [--skip-modify] [--stream]
+                              [--from-extract continent.osm.pbf ...] [--length] [--grid [DEG]] [--export]
 
 Arguments:
   directory         Directory for .pbf files and output CSV (default: current directory)
@@ -13,29 +14,94 @@ Arguments:
 
 This script:
 1. Downloads OSM PBF files for specified countries to [directory]
+   (parallel range requests, resumable, MD5-checked, see pbf_download.py)
 2. Analyzes surface statistics for original files
-3. Runs com.autoroute.osm.ModifyOsmWays Java app to add surface tags (if heygit_ids.txt exists)
+3. Adds surface tags with modify_osm_ways.py in this process (if heygit_ids.txt
+   exists), using one warm worker pool that keeps the surface map loaded
 4. Analyzes surface statistics for modified files
-5. Generates surface_stats.csv in [directory]
-
-Output file:
-  - surface_stats.csv - Combined statistics with both original and modified data
-    For each country, contains 2 rows:
+5. Stores the results in [directory]/surface_stats.sqlite after every country
+   and exports surface_stats.csv from it at the end
+
+With --stream, countries are analyzed straight from the HTTP stream while
+they download. Countries that are only analyzed (--skip-modify, or modified
+results already stored) are never written to disk and the transfer stops
+after the last way block; the others are saved at the same time and handed
+to the modify stage.
+
+With --from-extract PBF (repeatable), all listed countries that lie inside a
+continent or planet extract (e.g. the ones downloaded for the OSRM build) are
+counted in one parallel pass over it, assigning ways to countries with the
+Geofabrik .poly boundaries (cached in [directory]/.poly_cache, see
+country_stats.py). Countries outside every extract are processed as usual.
+
+With --length, the km per highway class are summed as well, so a 20 m service
+stub weighs less than a 40 km secondary road (surface_stats_km.csv). Way
+lengths come from a memory-mapped node location index next to each PBF
+(<file>.nodes, see node_index.py), built on first use and reused while the
+file is unchanged. The modifier counts ways only, so with --length the
+modified file is analyzed as well, with the index of the original.
+
+With --grid [DEG], the coverage is also binned into tiles of DEG degrees
+(default 0.1) by the first node of every way, for the original and the
+modified file: [directory]/surface_grids/<file>.grid.npy, see surface_grid.py,
+whose diff command shows the tiles where the modifier added surfaces.
+
+Downloaded and modified PBFs are kept for later runs. With --pbf-cache-gb N
+they are limited to N GB: the least recently used files (and their node
+index and rewrite stats) are deleted when room is needed, never while a
+running country uses them (see pbf_cache.py, index in [directory]/.pbf_cache.json).
+
+Statistics are cached in [directory]/.stats_cache by PBF content (header
+replication timestamp plus a fingerprint), so unchanged files are only
+scanned once, even if the results are deleted or regenerated.
+
+When a country is modified, the statistics for the original and the modified
+file are counted by the modifier in the same pass that writes the
+modified file, so neither file is read again for step 2 and 4.
+
+Output files:
+  - surface_stats.sqlite - Results store (see results_store.py), one result per
+    country, variant (original/modified) and extract replication timestamp.
+    Countries already in it are skipped. A surface_stats.csv of an older
+    version is imported into a new store once.
+  - surface_stats.csv - Combined statistics with both original and modified data,
+    exported from the newest results. For each country, contains 2 rows:
     * Country name (original statistics)
     * Country name-modified (modified statistics)
+  - surface_stats_km.csv - Same layout with km instead of way counts, for the
+    results counted with --length
+  - surface_stats_comparison.csv - Before/after per country, written by --export
+    (which only exports the store and exits)
 """
 
 import sys
 import os
-import subprocess
 import csv
+import json
 import time
 import argparse
-from collections import defaultdict
+import shutil
+import multiprocessing
 import osmium
-from urllib.request import urlretrieve
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from urllib.request import urlopen, Request
 from urllib.error import URLError
 
+from pbf_download import DownloadError, StreamDownload, download_file
+from surface_stats import HIGHWAY_TYPES, MAIN_ROAD_TYPES, highway_class, count_way, has_lengths, \
+    collect_stats_parallel, stream_stats
+from node_index import ensure_node_index
+from surface_grid import DEFAULT_TILE_SIZE, ensure_surface_grid, grid_path
+from stats_cache import StatsCache
+from results_store import ResultsStore
+from pbf_cache import PbfCache
+from country_stats import CountryIndex, collect_country_stats, load_poly, poly_bbox
+from pbf_blocks import read_header
+from modify_osm_ways import ModifierPool, write_stats_json, save_rules_fingerprint
+
+
+MODIFY_WORKERS = os.cpu_count() or 1
+
 
 # ============================================================================
 # COUNTRY CONFIGURATION
@@ -267,9 +333,29 @@ COUNTRIES = [
 # SURFACE STATISTICS COLLECTOR (from file_surface_stats.py)
 # ============================================================================
 
-def collect_surface_stats(pbf_file):
+def collect_surface_stats(pbf_file, show_progress=True, workers=None, node_index_file=None):
+    """
+    Collect surface statistics for highway ways.
+    Way blocks are decoded by `workers` processes (default: all cores, see
+    surface_stats.collect_stats_parallel()). With a node_index_file, km per
+    highway class are summed too. Files with a blob compression pbf_blocks
+    cannot decode are read with osmium instead (without lengths).
+    """
+    def progress(done, total, way_count, highway_way_count):
+        if show_progress:
+            print(f"    Ranges {done}/{total}: {way_count:,} highway ways ({highway_way_count:,} relevant highway ways)...",
+                  end='\r', flush=True)
+
+    try:
+        return collect_stats_parallel(pbf_file, workers, progress, node_index_file)
+    except ValueError as e:
+        print(f"    ⚠ Block decoding failed ({e}), reading with osmium")
+        return collect_surface_stats_osmium(pbf_file, show_progress)
+
+
+def collect_surface_stats_osmium(pbf_file, show_progress=True):
     """Collect surface statistics for highway ways using optimized FileProcessor"""
-    stats = defaultdict(lambda: {'with_surface': 0, 'total': 0})
+    stats = {}
     way_count = 0
     highway_way_count = 0
 
@@ -282,23 +368,12 @@ def collect_surface_stats(pbf_file):
         way_count += 1
 
         # Direct tag access (optimized)
-        highway = o.tags.get('highway')
-        has_surface = 'surface' in o.tags
-
-        if highway:
-            highway_normalized = highway
-            if highway.endswith('_link'):
-                highway_normalized = highway[:-5]
-
-            if highway_normalized in ['primary', 'trunk', 'secondary', 'tertiary',
-                                     'residential', 'unclassified', 'service', 'track', 'cycleway']:
-                highway_way_count += 1
-                stats[highway_normalized]['total'] += 1
+        highway_type = highway_class(o.tags.get('highway'))
+        if highway_type:
+            highway_way_count += 1
+            count_way(stats, highway_type, 'surface' in o.tags)
 
-                if has_surface:
-                    stats[highway_normalized]['with_surface'] += 1
-
-        if way_count % 10000 == 0:
+        if show_progress and way_count % 10000 == 0:
             print(f"    Processed {way_count:,} highway ways ({highway_way_count:,} relevant highway ways)...",
                   end='\r', flush=True)
 
@@ -307,11 +382,10 @@ def collect_surface_stats(pbf_file):
 
 def calculate_percentage_without_surface(stats):
     """Calculate average percentage of important roads WITHOUT surface tag"""
-    main_road_types = ['secondary', 'tertiary', 'unclassified', 'cycleway']
     total_main_roads = 0
     total_without_surface = 0
 
-    for highway_type in main_road_types:
+    for highway_type in MAIN_ROAD_TYPES:
         if highway_type in stats:
             total = stats[highway_type]['total']
             with_surface = stats[highway_type]['with_surface']
@@ -326,8 +400,33 @@ def calculate_percentage_without_surface(stats):
     return round(percentage, 1)
 
 
-def analyze_pbf(pbf_file, country_name):
-    """Analyze a PBF file and return statistics"""
+def stats_result(country_name, stats, pbf_file, extract_timestamp=None):
+    """
+    Wrap stats in the result format of analyze_pbf(). extract_timestamp is
+    only given where pbf_file cannot be read for it, e.g. a streamed URL.
+    """
+    result = {
+        'country': country_name.capitalize(),
+        'stats': stats,
+        'filename': pbf_file
+    }
+    if extract_timestamp:
+        result['extract_timestamp'] = extract_timestamp
+    return result
+
+
+def analyze_pbf(pbf_file, country_name, show_progress=True, cache_dir=None, workers=None, node_file=None,
+                grid_file=None, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Analyze a PBF file and return statistics.
+    With a cache_dir, stats of a file with unchanged content are taken from
+    the cache (see stats_cache.py) instead of scanning the file.
+    With a node_file, way lengths are summed using the node location index
+    of that PBF (see node_index.py; built on first use). A modified file can
+    use the index of its original, the nodes are the same.
+    With a grid_file, the coverage per tile of tile_size degrees is written
+    to it as well, unless it is current (see surface_grid.py).
+    """
     print(f"    Analyzing: {pbf_file}")
 
     if not os.path.isfile(pbf_file):
@@ -335,14 +434,27 @@ def analyze_pbf(pbf_file, country_name):
         return None
 
     try:
-        stats, way_count, highway_way_count = collect_surface_stats(pbf_file)
+        if grid_file:
+            os.makedirs(os.path.dirname(grid_file), exist_ok=True)
+            ensure_surface_grid(pbf_file, grid_file, tile_size, workers)
+            print(f"    ✓ Tile grid: {grid_file}")
+
+        cache = StatsCache(cache_dir) if cache_dir else None
+        if cache:
+            key = cache.key(pbf_file)
+            entry = cache.get(key)
+            if entry and (not node_file or has_lengths(entry['stats'])):
+                print(f"    ✓ Cached: {entry.get('highway_way_count', 0):,} relevant highway ways ({key})")
+                return stats_result(country_name, entry['stats'], pbf_file)
+
+        node_index_file = ensure_node_index(node_file, workers) if node_file else None
+        stats, way_count, highway_way_count = collect_surface_stats(pbf_file, show_progress, workers,
+                                                                    node_index_file)
         print(f"\r    ✓ Analyzed {way_count:,} highway ways ({highway_way_count:,} relevant highway ways)" + " " * 20)
 
-        return {
-            'country': country_name.capitalize(),
-            'stats': stats,
-            'filename': pbf_file
-        }
+        if cache:
+            cache.put(key, pbf_file, stats, way_count=way_count, highway_way_count=highway_way_count)
+        return stats_result(country_name, stats, pbf_file)
     except Exception as e:
         print(f"    ✗ Error: {e}")
         return None
@@ -352,7 +464,7 @@ def analyze_pbf(pbf_file, country_name):
 # DOWNLOAD AND FILE MANAGEMENT
 # ============================================================================
 
-def download_country(country_name, url, data_dir, skip_download=False):
+def download_country(country_name, url, data_dir, skip_download=False, show_progress=True):
     """Download country PBF file if it doesn't exist"""
     filename = f"{country_name}-latest.osm.pbf"
     filepath = os.path.join(data_dir, filename)
@@ -370,23 +482,28 @@ def download_country(country_name, url, data_dir, skip_download=False):
     print(f"  Saving to: {filepath}")
 
     try:
-        def progress_hook(block_num, block_size, total_size):
-            downloaded = block_num * block_size
-            if total_size > 0:
+        last_report = [0.0]
+
+        def progress_hook(downloaded, total_size):
+            now = time.time()
+            if show_progress and total_size > 0 and now - last_report[0] >= 0.5:
+                last_report[0] = now
                 percent = min(downloaded * 100 / total_size, 100)
                 mb_downloaded = downloaded / (1024 * 1024)
                 mb_total = total_size / (1024 * 1024)
                 print(f"    Progress: {percent:.1f}% ({mb_downloaded:.1f}/{mb_total:.1f} MB)",
                       end='\r', flush=True)
 
-        urlretrieve(url, filepath, reporthook=progress_hook)
-        print()  # New line after progress
+        # Parallel range requests, resumes <file>.part, verifies size and MD5
+        download_file(url, filepath, progress_callback=progress_hook)
+        if show_progress:
+            print()  # New line after progress
 
         size_mb = os.path.getsize(filepath) / (1024 * 1024)
         print(f"  ✓ Downloaded: {filepath} ({size_mb:.2f} MB)")
         return filepath
 
-    except URLError as e:
+    except DownloadError as e:
         print(f"  ✗ Download failed: {e}")
         return None
     except Exception as e:
@@ -394,175 +511,239 @@ def download_country(country_name, url, data_dir, skip_download=False):
         return None
 
 
-def run_modify_osm_ways(pbf_file, ids_file, skip_modify=False):
-    """Run com.autoroute.osm.ModifyOsmWays Java app on the PBF file"""
+def stream_analyze_country(country_name, url, pool=None, save_path=None):
+    """
+    Analyze a country straight from the HTTP stream (see surface_stats.stream_stats()),
+    decoding blocks in the worker pool while the download continues.
+    Without save_path nothing is written to disk and the download stops
+    after the last way block. With save_path the file is also saved
+    (verified and renamed like download_country()) for later steps.
+    Returns the analysis result like analyze_pbf(), or None on failure.
+    """
+    print(f"  Streaming: {url}")
+    start = time.time()
+    try:
+        with StreamDownload(url, save_path) as stream:
+            stats, way_count, highway_way_count, extract_timestamp = stream_stats(
+                stream, pool, stop_after_ways=save_path is None)
+            if save_path:
+                stream.finish()
+            transferred_mb = stream.downloaded / (1024 * 1024)
+        print(f"  ✓ Streamed {country_name}: {way_count:,} highway ways ({highway_way_count:,} relevant), "
+              f"{transferred_mb:.1f} MB in {time.time() - start:.1f}s")
+        return stats_result(country_name, stats, save_path or url, extract_timestamp)
+    except (DownloadError, ValueError) as e:
+        print(f"  ✗ Streaming {country_name} failed: {e}")
+        return None
+
+
+def rewrite_stats_path(modified_file):
+    """Path of the coverage stats written by modify_osm_ways.py next to a modified file"""
+    return modified_file + '.stats.json'
+
+
+def load_rewrite_stats(modified_file):
+    """Load the stats of a previous rewrite, or None if there are none"""
+    stats_file = rewrite_stats_path(modified_file)
+    if not os.path.exists(stats_file):
+        return None
+    try:
+        with open(stats_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"  ⚠ Warning: Could not read {stats_file}: {e}")
+        return None
+
+
+def modified_path(pbf_file):
+    """Path of the modified output of a PBF file"""
+    if pbf_file.endswith('.osm.pbf'):
+        return pbf_file[:-8] + '-modified.osm.pbf'
+    return pbf_file + '-modified.osm.pbf'
+
+
+def run_modify_osm_ways(pbf_file, ids_file, skip_modify=False, modifier=None):
+    """
+    Add surface tags to the PBF file with modify_osm_ways.SurfaceUpdater,
+    in this process. modifier is a ModifierPool that keeps the surface map
+    loaded across countries; without one, a pool is started for this file.
+    Returns (modified_file, rewrite_stats), where rewrite_stats holds the
+    'original' and 'modified' coverage counted during the rewrite, or
+    (None, None) if no modified file was created.
+    """
     if skip_modify:
         print(f"  ⊘ Skipping modification (--skip-modify enabled)")
-        return None
+        return None, None
 
     if not os.path.exists(ids_file):
         print(f"  ⊘ Skipping modification (no {ids_file} found)")
-        return None
+        return None, None
 
-    # Generate output filename
-    if pbf_file.endswith('.osm.pbf'):
-        output_file = pbf_file[:-8] + '-modified.osm.pbf'
-    else:
-        output_file = pbf_file + '-modified.osm.pbf'
+    output_file = modified_path(pbf_file)
+    stats_file = rewrite_stats_path(output_file)
 
     # Check if already modified
     if os.path.exists(output_file):
         print(f"  ✓ Already modified: {output_file}")
-        return output_file
+        return output_file, load_rewrite_stats(output_file)
 
-    # AutoRoute project path
-    autoroute_path = os.path.expanduser('~/disk/AutoRoute')
-    if not os.path.exists(autoroute_path):
-        print(f"  ✗ AutoRoute project not found at: {autoroute_path}")
-        return None
-
-    print(f"  Running com.autoroute.osm.ModifyOsmWays...")
+    print(f"  Modifying {os.path.basename(pbf_file)}...")
 
+    # Write to a temporary name, so a failed run never counts as already modified
+    tmp_file = output_file + '.tmp'
+    own_modifier = modifier is None
     try:
-        result = subprocess.run(
-            f'cd {autoroute_path} && mvn compile -q && '
-            f'MAVEN_OPTS="-XX:+UseParallelGC" mvn exec:java -q '
-            f'-Dexec.mainClass="com.autoroute.osm.ModifyOsmWays" '
-            f'-Dexec.args="{pbf_file} {ids_file}"',
-            shell=True,
-            check=True,
-            capture_output=False
-        )
-
-        if os.path.exists(output_file):
-            print(f"  ✓ Modified file created: {output_file}")
-            return output_file
-        else:
-            print(f"  ✗ Modification failed: output file not created")
-            return None
+        if own_modifier:
+            modifier = ModifierPool(ids_file, MODIFY_WORKERS)
+        counts = modifier.rewrite(pbf_file, tmp_file)
+        os.replace(tmp_file, output_file)
+        save_rules_fingerprint(output_file, modifier.ids_file, modifier.rules_file)
+        write_stats_json(stats_file, pbf_file, output_file, counts)
+
+        print(f"  ✓ Modified file created: {output_file} ({counts['modified_count']:,} from list, "
+              f"{counts['inferred_count']:,} inferred)")
+        return output_file, {'original': counts['stats']['original'], 'modified': counts['stats']['modified']}
 
-    except subprocess.CalledProcessError as e:
-        print(f"  ✗ Modification failed: {e}")
-        return None
     except Exception as e:
-        print(f"  ✗ Error running ModifyOsmWays: {e}")
-        return None
+        print(f"  ✗ Modification failed: {e}")
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        return None, None
+    finally:
+        if own_modifier and modifier is not None:
+            modifier.close()
 
 
 # ============================================================================
-# CSV OUTPUT
+# RESULTS STORE AND CSV OUTPUT
 # ============================================================================
 
-def load_existing_csv_countries(csv_file):
-    """Load list of countries already processed in existing CSV file
-    Returns a dict with:
-    - 'original': set of country names with original analysis done (lowercase)
-    - 'modified': set of country names with modified analysis done (lowercase)
-    """
-    existing = {'original': set(), 'modified': set()}
+# Results database inside the data directory (see results_store.py)
+RESULTS_DB = 'surface_stats.sqlite'
+
+CSV_FIELDS = ['country'] + HIGHWAY_TYPES + ['average % for main roads WITHOUT suffer']
+
+
+def pbf_timestamp(pbf_file):
+    """Replication timestamp from the PBF header, 0 if unknown (or not a local file)"""
+    try:
+        return read_header(pbf_file)['replication_timestamp'] or 0
+    except (OSError, ValueError, TypeError):
+        return 0
 
-    if not os.path.exists(csv_file):
-        return existing
 
+def import_existing_csv(store, csv_file):
+    """
+    Load the rows of a CSV written by an older version into an empty results
+    store ("with/total" strings become numbers), so those countries are not
+    processed again. Returns the number of imported rows.
+    """
+    if not os.path.exists(csv_file) or not store.is_empty():
+        return 0
+
+    imported = 0
     try:
         with open(csv_file, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
+            for row in csv.DictReader(f):
                 country_name = row['country']
+                variant = 'original'
                 if country_name.endswith('-modified'):
-                    # Extract base country name and normalize to lowercase
-                    base_name = country_name[:-9].lower()  # Remove '-modified' and lowercase
-                    existing['modified'].add(base_name)
-                else:
-                    # Normalize to lowercase for case-insensitive comparison
-                    existing['original'].add(country_name.lower())
-
-        print(f"Loaded existing CSV: {csv_file}")
-        print(f"  Countries with original analysis: {len(existing['original'])}")
-        print(f"  Countries with modified analysis: {len(existing['modified'])}")
-        if existing['original']:
-            print(f"    {', '.join(sorted(existing['original']))}")
+                    country_name = country_name[:-9]
+                    variant = 'modified'
+                stats = {}
+                for highway_type in HIGHWAY_TYPES:
+                    with_surface, total = (int(n) for n in row.get(highway_type, '0/0').split('/'))
+                    if total:
+                        stats[highway_type] = {'with_surface': with_surface, 'total': total}
+                store.put(country_name, variant, stats, filename=os.path.basename(csv_file))
+                imported += 1
+        print(f"Imported {imported} rows of existing CSV into the results store: {csv_file}")
     except Exception as e:
-        print(f"Warning: Could not read existing CSV: {e}")
+        print(f"Warning: Could not import existing CSV: {e}")
+    return imported
 
-    return existing
 
-
-def append_country_to_csv(country_result, modified_result, output_file):
-    """Append a single country's results to CSV file immediately
-    Writes original row and modified row (if exists) for one country
+def store_country_results(store, country_result, modified_result):
+    """
+    Store a country's original and modified results (either may be None).
+    Both are keyed by the replication timestamp of the analyzed extract.
     """
-    highway_types = ['primary', 'trunk', 'secondary', 'tertiary',
-                     'residential', 'unclassified', 'service', 'track', 'cycleway']
+    extract_timestamp = 0
+    for variant, result in (('original', country_result), ('modified', modified_result)):
+        if not result:
+            continue
+        extract_timestamp = (extract_timestamp or result.get('extract_timestamp')
+                             or pbf_timestamp(result['filename']))
+        store.put(result['country'], variant, result['stats'], extract_timestamp, result['filename'])
+        print(f"  → Stored {result['country']}{'-modified' if variant == 'modified' else ''}")
 
-    # Check if file exists to determine if we need header
-    file_exists = os.path.exists(output_file)
 
-    # Read existing data to avoid duplicates
-    existing_countries = set()
-    if file_exists:
-        try:
-            with open(output_file, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    existing_countries.add(row['country'])
-        except:
-            pass
-
-    # Open in append mode
-    with open(output_file, 'a', newline='') as csvfile:
-        fieldnames = ['country'] + highway_types + ['average % for main roads WITHOUT suffer']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+def csv_row(country, stats):
+    """One CSV row: "with/total" per highway class and the average % without surface"""
+    row = {'country': country}
+    for highway_type in HIGHWAY_TYPES:
+        entry = stats.get(highway_type, {'with_surface': 0, 'total': 0})
+        row[highway_type] = f"{entry['with_surface']}/{entry['total']}"
+    row['average % for main roads WITHOUT suffer'] = calculate_percentage_without_surface(stats)
+    return row
 
-        # Write header only if file is new
-        if not file_exists:
-            writer.writeheader()
 
-        country = country_result['country']
+def km_stats(stats):
+    """Length-weighted view of stats: km (0.1 km precision) in place of way counts"""
+    return {highway_type: {'with_surface': round(entry['km_with_surface'], 1), 'total': round(entry['km_total'], 1)}
+            for highway_type, entry in stats.items() if 'km_total' in entry}
 
-        # Write original row (if not already in CSV)
-        if country not in existing_countries:
-            row = {'country': country}
-            stats = country_result['stats']
-
-            for highway_type in highway_types:
-                if highway_type in stats:
-                    total = stats[highway_type]['total']
-                    with_surface = stats[highway_type]['with_surface']
-                    row[highway_type] = f"{with_surface}/{total}"
-                else:
-                    row[highway_type] = "0/0"
-
-            avg_pct = calculate_percentage_without_surface(stats)
-            row['average % for main roads WITHOUT suffer'] = avg_pct
-            writer.writerow(row)
-            print(f"  → Added {country} to CSV")
-
-        # Write modified row (if exists and not already in CSV)
-        if modified_result:
-            modified_country = f"{country}-modified"
-            if modified_country not in existing_countries:
-                row = {'country': modified_country}
-                stats = modified_result['stats']
-
-                for highway_type in highway_types:
-                    if highway_type in stats:
-                        total = stats[highway_type]['total']
-                        with_surface = stats[highway_type]['with_surface']
-                        row[highway_type] = f"{with_surface}/{total}"
-                    else:
-                        row[highway_type] = "0/0"
 
-                avg_pct = calculate_percentage_without_surface(stats)
-                row['average % for main roads WITHOUT suffer'] = avg_pct
-                writer.writerow(row)
-                print(f"  → Added {modified_country} to CSV")
+def write_csv_rows(output_file, rows):
+    """Write (country, stats) rows, replacing output_file atomically"""
+    tmp_file = output_file + '.tmp'
+    with open(tmp_file, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for country, stats in rows:
+            writer.writerow(csv_row(country, stats))
+    os.replace(tmp_file, output_file)
+    print(f"✓ CSV written: {output_file}")
+
+
+def export_csv(store, output_file, km_file=None):
+    """
+    Write the newest results of every country from the store to a CSV file:
+    the original row and, if there is one, the -modified row per country.
+    With a km_file, the results counted with way lengths (--length) are also
+    written there in the same layout, with km instead of way counts.
+    """
+    original = store.latest('original')
+    modified = {result['country']: result for result in store.latest('modified')}
+
+    rows = []
+    for result in original:
+        country = result['country'].capitalize()
+        rows.append((country, result['stats']))
+        if result['country'] in modified:
+            rows.append((f"{country}-modified", modified.pop(result['country'])['stats']))
+    # Modified results without an original row
+    for country, result in sorted(modified.items()):
+        rows.append((f"{country.capitalize()}-modified", result['stats']))
+
+    write_csv_rows(output_file, rows)
+    km_rows = [(country, km_stats(stats)) for country, stats in rows if stats and has_lengths(stats)]
+    if km_file and km_rows:
+        write_csv_rows(km_file, km_rows)
+
+
+def export_comparison_csv(store, output_file):
+    """Write the before/after comparison of the newest results in the store"""
+    def results(variant):
+        return [{'country': result['country'].capitalize(), 'stats': result['stats']}
+                for result in store.latest(variant)]
+
+    write_comparison_csv(results('original'), results('modified'), output_file)
 
 
 def write_comparison_csv(original_results, modified_results, output_file):
     """Write comparison CSV showing before/after side by side"""
-    highway_types = ['primary', 'trunk', 'secondary', 'tertiary',
-                     'residential', 'unclassified', 'service', 'track', 'cycleway']
+    highway_types = HIGHWAY_TYPES
 
     # Create a mapping of country to results
     original_map = {r['country']: r for r in original_results}
@@ -610,33 +791,434 @@ def write_comparison_csv(original_results, modified_results, output_file):
 
 
 # ============================================================================
-# FILE CLEANUP
+# ONE-PASS ANALYSIS OF CONTINENT EXTRACTS
 # ============================================================================
 
-def cleanup_pbf_files(pbf_file, modified_file=None):
-    """Delete PBF files after successful CSV write to save disk space"""
-    files_deleted = []
+# Geofabrik boundary polygons, below the data directory
+POLY_DIR = '.poly_cache'
+
 
-    # Delete original file
-    if pbf_file and os.path.exists(pbf_file):
+def analyze_extracts(extract_files, jobs, data_dir, ids_file, store, args):
+    """
+    Analyze the countries of jobs from continent or planet extracts, one
+    pass per extract for all countries in it (see country_stats.py) instead
+    of one download and scan per country. A country is taken from the first
+    extract whose header bbox contains its boundary. With modification
+    enabled, the extract is rewritten once and the copy is counted the same way.
+    Returns (jobs not covered by any extract, original_results, modified_results, countries_processed).
+    """
+    modify_enabled = not args.skip_modify and os.path.exists(ids_file)
+    poly_dir = os.path.join(data_dir, POLY_DIR)
+    polygons = {}
+    for job in jobs:
         try:
-            size_mb = os.path.getsize(pbf_file) / (1024 * 1024)
-            os.remove(pbf_file)
-            files_deleted.append(f"{os.path.basename(pbf_file)} ({size_mb:.1f} MB)")
-        except Exception as e:
-            print(f"  ⚠ Warning: Could not delete {pbf_file}: {e}")
+            polygons[job.name] = load_poly(job.url, poly_dir)
+        except (DownloadError, ValueError, OSError) as e:
+            print(f"⚠ No boundary for {job.name}, it will be processed separately: {e}")
 
-    # Delete modified file
-    if modified_file and os.path.exists(modified_file):
+    remaining = list(jobs)
+    all_original_results = []
+    all_modified_results = []
+    countries_processed = 0
+
+    def progress(phase, done, total):
+        print(f"    Ranges {done}/{total} ({phase})...", end='\r', flush=True)
+
+    for extract_file in extract_files:
+        name = os.path.basename(extract_file)
         try:
-            size_mb = os.path.getsize(modified_file) / (1024 * 1024)
-            os.remove(modified_file)
-            files_deleted.append(f"{os.path.basename(modified_file)} ({size_mb:.1f} MB)")
+            bbox = read_header(extract_file)['bbox']
+        except (OSError, ValueError) as e:
+            print(f"✗ Cannot read {extract_file}: {e}")
+            continue
+
+        covered = []
+        for job in remaining:
+            if job.name not in polygons:
+                continue
+            left, bottom, right, top = poly_bbox(polygons[job.name])
+            if not bbox or (bbox[0] <= left and bbox[1] <= bottom and right <= bbox[2] and top <= bbox[3]):
+                covered.append(job)
+        if not covered:
+            print(f"⊘ {name}: none of the remaining countries lie within it")
+            continue
+
+        print(f"\n⌕ Analyzing {len(covered)} countries in one pass over {name}")
+        index = CountryIndex([(job.name, polygons[job.name]) for job in covered])
+
+        # Original stats are always counted, the CSV skips rows it already has
+        files = [('original', extract_file)]
+        if modify_enabled and any(job.need_modified for job in covered):
+            modified_file, _ = run_modify_osm_ways(extract_file, ids_file)
+            if modified_file:
+                files.append(('modified', modified_file))
+
+        for kind, pbf_file in files:
+            start = time.time()
+            try:
+                stats, way_count, highway_way_count, located = collect_country_stats(pbf_file, index,
+                                                                                      progress=progress)
+            except (OSError, ValueError) as e:
+                print(f"  ✗ Analysis of {os.path.basename(pbf_file)} failed: {e}")
+                break
+            print(f"  ✓ {kind}: {way_count:,} highway ways ({highway_way_count:,} relevant, "
+                  f"{located:,} inside a country) in {time.time() - start:.1f}s")
+            for job in covered:
+                job.results[kind] = stats_result(job.name, stats[job.name], pbf_file)
+
+        for job in covered:
+            remaining.remove(job)
+            if 'original' not in job.results:
+                continue
+            print(f"\n📝 Storing {job.name}")
+            store_country_results(store, job.results['original'], job.results.get('modified'))
+            all_original_results.append(job.results['original'])
+            if 'modified' in job.results:
+                all_modified_results.append(job.results['modified'])
+            countries_processed += 1
+
+    return remaining, all_original_results, all_modified_results, countries_processed
+
+
+# ============================================================================
+# PIPELINE SCHEDULER
+# ============================================================================
+
+# Default number of concurrent jobs per stage
+DOWNLOAD_WORKERS = 4
+MODIFY_JOBS = 2
+ANALYZE_WORKERS = max(1, (os.cpu_count() or 1) // 4)
+
+# Memory estimates per running stage, used against --max-memory-gb.
+# The surface index is memory-mapped once and shared by all modify jobs, a
+# job holds a window of decoded ranges; analysis holds one block per core.
+MODIFY_BASE_MEMORY = 512 * 1024**2
+MODIFY_MEMORY_PER_FILE_BYTE = 0.25
+ANALYZE_MEMORY = 512 * 1024**2
+
+# Stats cache directory inside the data directory (see stats_cache.py)
+STATS_CACHE_DIR = '.stats_cache'
+# Tile grids of --grid inside the data directory (see surface_grid.py)
+GRID_DIR = 'surface_grids'
+
+# Disk space that is never reserved by the scheduler
+MIN_FREE_DISK = 5 * 1024**3
+
+
+class CountryJob:
+    """State of one country while it moves through the pipeline"""
+
+    def __init__(self, name, url, need_original, need_modified):
+        self.name = name
+        self.url = url
+        self.need_original = need_original
+        self.need_modified = need_modified
+        self.size = 0
+        self.pbf_file = None
+        self.modified_file = None
+        self.results = {}
+        self.pending_analyses = 0
+
+
+class ResourceBudget:
+    """
+    Disk and memory reserved by running stages. A stage may start if its
+    reservation fits next to the running ones (disk is checked against the
+    actual free space of the data directory), or if nothing is running, so
+    a single file larger than the budget still gets processed.
+    """
+
+    def __init__(self, data_dir, max_memory, min_free_disk=MIN_FREE_DISK):
+        self.data_dir = data_dir
+        self.max_memory = max_memory
+        self.min_free_disk = min_free_disk
+        self.disk = 0
+        self.memory = 0
+
+    def fits(self, disk, memory):
+        if not self.disk and not self.memory:
+            return True
+        free_disk = shutil.disk_usage(self.data_dir).free - self.min_free_disk
+        return self.disk + disk <= free_disk and self.memory + memory <= self.max_memory
+
+    def reserve(self, disk, memory):
+        self.disk += disk
+        self.memory += memory
+
+    def release(self, disk, memory):
+        self.disk -= disk
+        self.memory -= memory
+
+
+def cache_rewrite_stats(cache_dir, pbf_file, modified_file, rewrite_stats):
+    """Store the stats counted during a rewrite in the stats cache, for both files"""
+    cache = StatsCache(cache_dir)
+    for kind, path in (('original', pbf_file), ('modified', modified_file)):
+        try:
+            key = cache.key(path)
+            if not cache.get(key):
+                stats = rewrite_stats[kind]
+                cache.put(key, path, stats, highway_way_count=sum(e['total'] for e in stats.values()))
+        except (OSError, ValueError) as e:
+            print(f"  ⚠ Warning: Could not cache stats of {path}: {e}")
+
+
+def remote_file_size(url):
+    """Size of a remote file from a HEAD request, or 0 if unknown"""
+    try:
+        with urlopen(Request(url, method='HEAD'), timeout=30) as response:
+            return int(response.headers.get('Content-Length') or 0)
+    except (URLError, OSError, ValueError):
+        return 0
+
+
+def total_memory():
+    """Physical memory in bytes"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 16 * 1024**3
+
+
+def run_pipeline(jobs, data_dir, ids_file, store, args):
+    """
+    Run download, modify and analyze stages of all jobs concurrently.
+    Every stage has its own bounded pool; queued work is started largest
+    file first whenever a slot is free and its disk and memory reservation
+    fits the budget. Results are stored as soon as a country is complete. Returns (original_results, modified_results, countries_processed).
+    """
+    modify_enabled = not args.skip_modify and os.path.exists(ids_file)
+    cache_dir = None if args.no_cache else os.path.join(data_dir, STATS_CACHE_DIR)
+    # Every analysis job splits its file over its share of the cores
+    analyze_cores = max(1, (os.cpu_count() or 1) // args.analyze_workers)
+    budget = ResourceBudget(data_dir, args.max_memory_gb * 1024**3)
+    # Extracts and modified files stay for later runs, least recently used ones are evicted
+    cache = PbfCache(data_dir, args.pbf_cache_gb * 1024**3 if args.pbf_cache_gb else None)
+
+    # Largest first: the longest jobs start early instead of ending up as the tail
+    print("Checking file sizes...")
+    with ThreadPoolExecutor(args.download_workers) as pool:
+        def job_size(job):
+            local_file = os.path.join(data_dir, f"{job.name}-latest.osm.pbf")
+            if os.path.exists(local_file):
+                return os.path.getsize(local_file)
+            return remote_file_size(job.url) if not args.skip_download else 0
+        for job, size in zip(jobs, pool.map(job_size, jobs)):
+            job.size = size
+    jobs.sort(key=lambda job: job.size, reverse=True)
+
+    # Decoder pool for streamed countries, forked before any stage thread starts
+    stream_pool = None
+    if args.stream and not args.skip_download:
+        stream_pool = multiprocessing.get_context('fork').Pool(os.cpu_count() or 1)
+
+    # One warm worker pool for all countries, forked before any stage thread starts
+    modifier = None
+    if modify_enabled:
+        try:
+            modifier = ModifierPool(ids_file, MODIFY_WORKERS)
         except Exception as e:
-            print(f"  ⚠ Warning: Could not delete {modified_file}: {e}")
+            print(f"✗ Cannot load {ids_file}, modification will be skipped: {e}")
+            modify_enabled = False
+
+    queues = {'download': list(jobs), 'modify': [], 'analyze': []}
+    limits = {'download': args.download_workers, 'modify': args.modify_jobs, 'analyze': args.analyze_workers}
+    active = dict.fromkeys(queues, 0)
+    running = {}  # future -> (stage, job, kind, disk, memory)
+    all_original_results = []
+    all_modified_results = []
+    countries_processed = 0
+
+    def streams(job):
+        """Jobs analyzing an original without a local file are analyzed straight from the download"""
+        local_file = os.path.join(data_dir, f"{job.name}-latest.osm.pbf")
+        return stream_pool is not None and job.need_original and not os.path.exists(local_file)
+
+    def saves_stream(job):
+        """A streamed file is saved too if the modify stage needs it"""
+        return job.need_modified and modify_enabled
+
+    def needs(stage, job):
+        """(disk, memory) reservation of a stage"""
+        if stage == 'download':
+            if streams(job):
+                return (job.size if saves_stream(job) else 0), ANALYZE_MEMORY
+            local_file = os.path.join(data_dir, f"{job.name}-latest.osm.pbf")
+            return (0 if os.path.exists(local_file) else job.size), 0
+        if stage == 'modify':
+            return job.size, MODIFY_BASE_MEMORY + int(job.size * MODIFY_MEMORY_PER_FILE_BYTE)
+        return 0, ANALYZE_MEMORY
+
+    def queue_analysis(job, kind, pbf_file):
+        job.pending_analyses += 1
+        queues['analyze'].append((job, kind, pbf_file))
+
+    def job_files(job):
+        local_file = os.path.join(data_dir, f"{job.name}-latest.osm.pbf")
+        return local_file, modified_path(local_file)
+
+    def make_room(disk):
+        evicted = cache.make_room(disk)
+        if evicted:
+            print(f"\n🗑  Evicted from PBF cache: {', '.join(evicted)}")
+
+    def release(job):
+        """The job's files may be evicted again"""
+        for path in job_files(job):
+            cache.touch(path)
+            cache.unpin(path)
+        make_room(0)
+
+    def finish(job):
+        nonlocal countries_processed
+        release(job)
+        if job.results:
+            print(f"\n📝 Storing {job.name}")
+            try:
+                store_country_results(store, job.results.get('original'), job.results.get('modified'))
+            except Exception as e:
+                # Keep the other countries in flight going
+                print(f"✗ {job.name}: storing results failed: {e}")
+                return
+            countries_processed += 1
+            print(f"✓ Completed: {job.name}")
+
+    def add_result(job, kind, result):
+        job.results[kind] = result
+        (all_original_results if kind == 'original' else all_modified_results).append(result)
+
+    # Analysis processes are started on demand while the stage threads and the
+    # pools' handler threads run, so they come from a fork server, not a fork
+    analyze_context = multiprocessing.get_context('forkserver')
+    try:
+        with ThreadPoolExecutor(args.download_workers) as download_pool, \
+                ThreadPoolExecutor(args.modify_jobs) as modify_pool, \
+                ProcessPoolExecutor(args.analyze_workers, mp_context=analyze_context) as analyze_pool:
+            while running or any(queues.values()):
+                # Start queued work, largest file first, while slots and budget allow
+                for stage in ('analyze', 'modify', 'download'):
+                    queue = queues[stage]
+                    queue.sort(key=lambda item: (item if stage == 'download' else item[0]).size, reverse=True)
+                    while queue and active[stage] < limits[stage]:
+                        item = queue[0]
+                        job = item if stage == 'download' else item[0]
+                        disk, memory = needs(stage, job)
+                        if disk:
+                            make_room(disk)
+                        if not budget.fits(disk, memory):
+                            break
+                        if stage == 'download':
+                            # Pinned from here until the job is finished
+                            for path in job_files(job):
+                                cache.pin(path)
+                        queue.pop(0)
+                        budget.reserve(disk, memory)
+                        active[stage] += 1
+                        if stage == 'download' and streams(job):
+                            save_path = job_files(job)[0] if saves_stream(job) else None
+                            print(f"\n⇣ Streaming {job.name} (analyzed while downloading, "
+                                  f"{'saved for modify' if save_path else 'not saved'})")
+                            future = download_pool.submit(stream_analyze_country, job.name, job.url, stream_pool,
+                                                          save_path)
+                            running[future] = (stage, job, 'stream', disk, memory)
+                        elif stage == 'download':
+                            print(f"\n⇣ Downloading {job.name}")
+                            future = download_pool.submit(download_country, job.name, job.url, data_dir,
+                                                          args.skip_download, False)
+                            running[future] = (stage, job, None, disk, memory)
+                        elif stage == 'modify':
+                            print(f"\n⚙ Modifying {job.name}")
+                            future = modify_pool.submit(run_modify_osm_ways, job.pbf_file, ids_file, False, modifier)
+                            running[future] = (stage, job, None, disk, memory)
+                        else:
+                            _, kind, pbf_file = item
+                            print(f"\n⌕ Analyzing {job.name} ({kind})")
+                            grid_file = None
+                            if args.grid:
+                                grid_file = os.path.join(data_dir, GRID_DIR, os.path.basename(grid_path(pbf_file)))
+                            future = analyze_pool.submit(analyze_pbf, pbf_file, job.name, False, cache_dir,
+                                                         analyze_cores, job.pbf_file if args.length else None,
+                                                         grid_file, args.grid)
+                            running[future] = (stage, job, kind, disk, memory)
+
+                if not running:
+                    # Cannot happen with an empty budget, but never spin
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, job, kind, disk, memory = running.pop(future)
+                    active[stage] -= 1
+                    budget.release(disk, memory)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"\n✗ {job.name}: {stage} failed: {e}")
+                        result = (None, None) if stage == 'modify' else None
+
+                    if stage == 'download' and kind == 'stream':
+                        if not result:
+                            print(f"✗ Skipping {job.name} - streaming analysis failed")
+                            release(job)
+                            continue
+                        add_result(job, 'original', result)
+                        if saves_stream(job):
+                            job.pbf_file = result['filename']
+                            cache.touch(job.pbf_file)
+                            queues['modify'].append((job,))
+                        else:
+                            finish(job)
+
+                    elif stage == 'download':
+                        if not result:
+                            print(f"✗ Skipping {job.name} - download failed")
+                            release(job)
+                            continue
+                        job.pbf_file = result
+                        cache.touch(job.pbf_file)
+                        if job.need_modified and modify_enabled:
+                            queues['modify'].append((job,))
+                        elif job.need_original:
+                            queue_analysis(job, 'original', job.pbf_file)
+                        else:
+                            finish(job)
+
+                    elif stage == 'modify':
+                        job.modified_file, rewrite_stats = result
+                        cache.touch(job.modified_file)
+                        # The rewrite counts ways only; with --length or --grid both files are analyzed
+                        if rewrite_stats and not (args.length or args.grid):
+                            # Both rows were counted during the rewrite
+                            if cache_dir:
+                                cache_rewrite_stats(cache_dir, job.pbf_file, job.modified_file, rewrite_stats)
+                            if job.need_original and 'original' not in job.results:
+                                add_result(job, 'original', stats_result(job.name, rewrite_stats['original'],
+                                                                         job.pbf_file))
+                            add_result(job, 'modified', stats_result(job.name, rewrite_stats['modified'],
+                                                                     job.modified_file))
+                            finish(job)
+                            continue
+                        # A streamed original is already analyzed
+                        if job.need_original and 'original' not in job.results:
+                            queue_analysis(job, 'original', job.pbf_file)
+                        if job.modified_file and os.path.exists(job.modified_file):
+                            queue_analysis(job, 'modified', job.modified_file)
+                        if not job.pending_analyses:
+                            finish(job)
+
+                    else:
+                        job.pending_analyses -= 1
+                        if result:
+                            add_result(job, kind, result)
+                        if not job.pending_analyses:
+                            finish(job)
+    finally:
+        if modifier:
+            modifier.close()
+        if stream_pool:
+            stream_pool.terminate()
 
-    if files_deleted:
-        print(f"  🗑  Cleaned up: {', '.join(files_deleted)}")
+    return all_original_results, all_modified_results, countries_processed
 
 
 # ============================================================================
@@ -658,22 +1240,30 @@ def process_country(country_name, url, data_dir, ids_file='heygit_ids.txt', skip
         print(f"✗ Skipping {country_name} - download failed")
         return None
 
-    # Step 2: Analyze original
-    print(f"\n[2/4] Analyze Original")
-    original_stats = analyze_pbf(pbf_file, country_name)
+    # Step 2: Modify (counts the original and modified stats in the same pass)
+    print(f"\n[2/4] Modify PBF")
+    modified_file, rewrite_stats = run_modify_osm_ways(pbf_file, ids_file, skip_modify)
+
+    # Step 3: Analyze original
+    if rewrite_stats:
+        print(f"\n[3/4] Analyze Original - counted during modification")
+        original_stats = stats_result(country_name, rewrite_stats['original'], pbf_file)
+    else:
+        print(f"\n[3/4] Analyze Original")
+        original_stats = analyze_pbf(pbf_file, country_name)
     if not original_stats:
         print(f"✗ Skipping {country_name} - analysis failed")
         return None
     results['original'] = original_stats
 
-    # Step 3: Modify
-    print(f"\n[3/4] Modify PBF")
-    modified_file = run_modify_osm_ways(pbf_file, ids_file, skip_modify)
-
     # Step 4: Analyze modified (if modification was done)
     if modified_file and os.path.exists(modified_file):
-        print(f"\n[4/4] Analyze Modified")
-        modified_stats = analyze_pbf(modified_file, country_name)
+        if rewrite_stats:
+            print(f"\n[4/4] Analyze Modified - counted during modification")
+            modified_stats = stats_result(country_name, rewrite_stats['modified'], modified_file)
+        else:
+            print(f"\n[4/4] Analyze Modified")
+            modified_stats = analyze_pbf(modified_file, country_name)
         if modified_stats:
             results['modified'] = modified_stats
     else:
@@ -702,8 +1292,36 @@ Examples:
                        help='Skip downloading files (use existing .pbf files)')
     parser.add_argument('--skip-modify', action='store_true',
                        help='Skip modification step (only analyze)')
+    parser.add_argument('--stream', action='store_true',
+                       help='Analyze countries while downloading; save them only if they are modified')
+    parser.add_argument('--from-extract', action='append', metavar='PBF',
+                       help='Count all listed countries inside this continent/planet PBF in one pass (repeatable)')
+    parser.add_argument('--export', action='store_true',
+                       help=f'Only export {RESULTS_DB} to surface_stats.csv and surface_stats_comparison.csv')
+    parser.add_argument('--length', action='store_true',
+                       help='Also sum km per highway class (length-weighted coverage, written to surface_stats_km.csv)')
+    parser.add_argument('--grid', type=float, nargs='?', const=DEFAULT_TILE_SIZE, default=None, metavar='DEG',
+                       help=f'Also write the coverage per tile of DEG degrees (default: {DEFAULT_TILE_SIZE}) '
+                            f'to {GRID_DIR}/')
+    parser.add_argument('--no-cache', action='store_true',
+                       help=f'Always rescan PBF files instead of using cached stats from {STATS_CACHE_DIR}/')
+    parser.add_argument('--download-workers', type=int, default=DOWNLOAD_WORKERS,
+                       help=f'Concurrent downloads (default: {DOWNLOAD_WORKERS})')
+    parser.add_argument('--modify-jobs', type=int, default=MODIFY_JOBS,
+                       help=f'Concurrent modify jobs, sharing one pool of {MODIFY_WORKERS} workers (default: {MODIFY_JOBS})')
+    parser.add_argument('--analyze-workers', type=int, default=ANALYZE_WORKERS,
+                       help=f'Concurrent analysis jobs, each using its share of the cores (default: {ANALYZE_WORKERS})')
+    parser.add_argument('--pbf-cache-gb', type=float, default=None,
+                       help='Keep downloaded and modified PBFs for later runs up to this size, '
+                            'evicting the least recently used ones (default: no limit)')
+    parser.add_argument('--max-memory-gb', type=float, default=round(total_memory() * 0.75 / 1024**3, 1),
+                       help='Memory budget for running modify and analyze stages (default: 75%% of RAM)')
 
     args = parser.parse_args()
+    if args.length and (args.stream or args.from_extract):
+        parser.error('--length needs the country files on disk, it cannot be combined with --stream or --from-extract')
+    if args.grid is not None and (args.stream or args.from_extract):
+        parser.error('--grid needs the country files on disk, it cannot be combined with --stream or --from-extract')
 
     # Get and validate directory
     data_dir = os.path.abspath(args.directory)
@@ -725,27 +1343,27 @@ Examples:
     print(f"Options:")
     print(f"  Skip download: {args.skip_download}")
     print(f"  Skip modify: {args.skip_modify}")
+    print(f"  Workers: {args.download_workers} download, {args.modify_jobs} modify, {args.analyze_workers} analyze")
+    print(f"  Memory budget: {args.max_memory_gb:.1f} GB")
+    print(f"  PBF cache: {f'{args.pbf_cache_gb:g} GB' if args.pbf_cache_gb else 'no limit'}")
     print()
 
-    # Check if AutoRoute project exists for modification step
-    autoroute_path = os.path.expanduser('~/disk/AutoRoute')
-    if not os.path.exists(autoroute_path):
-        print(f"Warning: AutoRoute project not found at {autoroute_path}")
-        print("Modification step will be skipped")
-        args.skip_modify = True
-
     # Load existing countries from CSV (if exists)
     output_csv = os.path.join(data_dir, 'surface_stats.csv')
-    existing_countries = load_existing_csv_countries(output_csv)
-
-    # Process each country
-    all_original_results = []
-    all_modified_results = []
-
-    start_time = time.time()
-
-    print()
-    countries_processed = 0
+    store = ResultsStore(os.path.join(data_dir, RESULTS_DB))
+    import_existing_csv(store, output_csv)
+    km_csv = os.path.join(data_dir, 'surface_stats_km.csv')
+    if args.export:
+        export_csv(store, output_csv, km_csv)
+        export_comparison_csv(store, os.path.join(data_dir, 'surface_stats_comparison.csv'))
+        return
+    existing_countries = store.existing()
+    print(f"Results store: {store.path}")
+    print(f"  Countries with original analysis: {len(existing_countries['original'])}")
+    print(f"  Countries with modified analysis: {len(existing_countries['modified'])}")
+
+    # Collect the countries that still need work
+    jobs = []
     countries_skipped = 0
 
     for country_name, url in COUNTRIES:
@@ -755,7 +1373,7 @@ Examples:
 
         # Skip entirely if both original and modified are done
         if has_original and (has_modified or args.skip_modify):
-            print(f"\n✓ Skipping {country_name} - already in CSV (original{' and modified' if has_modified else ''})")
+            print(f"✓ Skipping {country_name} - already stored (original{' and modified' if has_modified else ''})")
             countries_skipped += 1
             continue
 
@@ -764,62 +1382,32 @@ Examples:
         need_modified = not has_modified and not args.skip_modify
 
         if need_original and not need_modified:
-            print(f"\n⊙ {country_name} - will process original only (modified already in CSV)")
+            print(f"⊙ {country_name} - will process original only (modified already stored)")
         elif not need_original and need_modified:
-            print(f"\n⊙ {country_name} - will process modification only (original already in CSV)")
-
-        # Process what's needed
-        results = {}
-        pbf_file = None
-        modified_file = None
-
-        if need_original:
-            # Download and analyze original
-            print(f"\n{'-'*80}")
-            print(f"Country: {country_name.upper()}")
-            print(f"{'-'*80}")
-            print(f"\n[1/2] Download")
-            pbf_file = download_country(country_name, url, data_dir, args.skip_download)
-
-            if pbf_file:
-                print(f"\n[2/2] Analyze Original")
-                original_stats = analyze_pbf(pbf_file, country_name)
-                if original_stats:
-                    results['original'] = original_stats
-                    all_original_results.append(original_stats)
-            else:
-                print(f"✗ Skipping {country_name} - download failed")
+            print(f"⊙ {country_name} - will process modification only (original already stored)")
+            # Only modify files that are already there
+            if not os.path.exists(os.path.join(data_dir, f"{country_name}-latest.osm.pbf")):
                 continue
 
-        if need_modified and 'original' in results or not need_original:
-            # Need to get pbf_file if we didn't download in original step
-            if not need_original:
-                pbf_filename = f"{country_name}-latest.osm.pbf"
-                pbf_file = os.path.join(data_dir, pbf_filename)
-
-            # Modify and analyze modified
-            if pbf_file and os.path.exists(pbf_file):
-                print(f"\n[Modification]")
-                ids_file = 'heygit_ids.txt'
-                modified_file = run_modify_osm_ways(pbf_file, ids_file, skip_modify=False)
-
-                if modified_file and os.path.exists(modified_file):
-                    print(f"\n[Analyze Modified]")
-                    modified_stats = analyze_pbf(modified_file, country_name)
-                    if modified_stats:
-                        results['modified'] = modified_stats
-                        all_modified_results.append(modified_stats)
-
-        # Write to CSV immediately if we have new results
-        if results:
-            print(f"\n📝 Writing to CSV: {output_csv}")
-            append_country_to_csv(results.get('original'), results.get('modified'), output_csv)
-            countries_processed += 1
+        jobs.append(CountryJob(country_name, url, need_original, need_modified))
+
+    start_time = time.time()
+    print()
+
+    # Countries inside the given continent extracts are counted in one pass per extract
+    extract_original_results, extract_modified_results, extract_processed = [], [], 0
+    if args.from_extract:
+        jobs, extract_original_results, extract_modified_results, extract_processed = analyze_extracts(
+            args.from_extract, jobs, data_dir, 'heygit_ids.txt', store, args)
 
-            # Clean up .pbf files after successful CSV write
-            # // TODO: UNCOMMENT cleanup_pbf_files(pbf_file, modified_file)
+    # Download, modify and analyze concurrently
+    all_original_results, all_modified_results, countries_processed = run_pipeline(
+        jobs, data_dir, 'heygit_ids.txt', store, args)
+    all_original_results = extract_original_results + all_original_results
+    all_modified_results = extract_modified_results + all_modified_results
+    countries_processed += extract_processed
 
-            print(f"\n✓ Completed: {country_name}")
+    export_csv(store, output_csv, km_csv)
 
     # Summary
     elapsed = time.time() - start_time
@@ -828,19 +1416,21 @@ Examples:
     print(f"{'='*80}")
     print(f"Data directory: {data_dir}")
     print(f"Countries in list: {len(COUNTRIES)}")
-    print(f"Countries skipped (already in CSV): {countries_skipped}")
+    print(f"Countries skipped (already stored): {countries_skipped}")
     print(f"Countries processed (new): {countries_processed}")
     print(f"  - Original analysis: {len(all_original_results)}")
     print(f"  - Modified analysis: {len(all_modified_results)}")
     print(f"Total time: {elapsed:.1f}s ({elapsed/60:.1f} minutes)")
     print()
-    print("Output file:")
+    print("Output files:")
+    print(f"  - {store.path}")
+    print(f"    Updated after each country")
     print(f"  - {output_csv}")
-    print(f"    Written incrementally after each country")
+    print(f"    Exported from the results store")
     if countries_processed > 0:
-        print(f"    Added {countries_processed} new countries to CSV")
+        print(f"    Added {countries_processed} new countries")
     else:
-        print(f"    No new countries added (all were already in CSV)")
+        print(f"    No new countries added (all were already stored)")
     print()
     print("✓ Done!")
 
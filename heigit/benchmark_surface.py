@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark suite for the surface pipeline on synthetic PBF files.
+
+Usage: ./benchmark_surface.py [--sizes small,medium] [--work-dir bench_data] [--output-dir bench_results]
+       ./benchmark_surface.py --compare <old.json> <new.json>
+
+Generates deterministic synthetic extracts (nodes, ways with a realistic
+highway/tag mix, a few relations) plus a matching HeiGIT ids file for each
+size, then runs every stage in a fresh process and reports ways/s, MB/s,
+peak RSS and load time:
+
+  load_ids_build          compile the ids text file into the surface index
+  load_ids_mmap           open an existing surface index (load_surface_map)
+  rewrite_osmium          SurfaceUpdater single osmium pass
+  rewrite_ways_only       --ways-only block rewrite, 1 worker
+  collect_surface_stats   analyze_countries.collect_surface_stats()
+
+Results are written to <output-dir>/<timestamp>-<commit>.json so runs can be
+compared across commits with --compare. Everything runs offline; generated
+files are cached in the work dir and reused while the generator is unchanged.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pbf_blocks import (
+    MEMBER_WAY, encode_frame, encode_header_block, encode_dense_nodes_block,
+    encode_ways_block, encode_relations_block
+)
+
+
+# Bump when the generated data changes, so cached files are regenerated
+GENERATOR_VERSION = 1
+SEED = 42
+
+# Number of ways per size; nodes and relations scale with it
+SIZES = {
+    'small': 20_000,
+    'medium': 200_000,
+    'large': 1_000_000,
+}
+
+# Entities per block, as written by osmium
+BLOCK_SIZE = 8000
+
+# (highway class, weight, probability of an existing surface tag)
+HIGHWAY_MIX = [
+    ('residential', 30, 0.25), ('service', 22, 0.20), ('track', 12, 0.35),
+    ('footway', 10, 0.30), ('unclassified', 7, 0.30), ('path', 5, 0.25),
+    ('tertiary', 4, 0.55), ('secondary', 3, 0.70), ('primary', 2, 0.80),
+    ('cycleway', 2, 0.60), ('living_street', 1, 0.40), ('trunk', 1, 0.85),
+    ('tertiary_link', 0.5, 0.5), ('secondary_link', 0.5, 0.6),
+]
+# Share of ways that are not highways (buildings, landuse, ...)
+NON_HIGHWAY_SHARE = 0.45
+NON_HIGHWAY_TAGS = [{'building': 'yes'}, {'landuse': 'residential'}, {'natural': 'water'},
+                    {'building': 'house', 'addr:housenumber': '12'}, {'waterway': 'stream'}]
+SURFACES = ['asphalt', 'paved', 'unpaved', 'gravel', 'ground', 'concrete', 'compacted', 'dirt']
+# Share of highway ways without surface that are listed in the ids file
+IDS_SHARE = 0.15
+
+STAGES = ['load_ids_build', 'load_ids_mmap', 'rewrite_osmium', 'rewrite_ways_only', 'collect_surface_stats']
+
+
+# ============================================================================
+# SYNTHETIC DATA
+# ============================================================================
+
+def random_highway_tags(rng):
+    """Return the tags of a random highway way"""
+    classes = [c for c, _, _ in HIGHWAY_MIX]
+    weights = [w for _, w, _ in HIGHWAY_MIX]
+    highway = rng.choices(classes, weights)[0]
+    surface_share = next(s for c, _, s in HIGHWAY_MIX if c == highway)
+
+    tags = {'highway': highway}
+    if rng.random() < surface_share:
+        tags['surface'] = rng.choice(SURFACES)
+    if rng.random() < 0.45:
+        tags['name'] = f"Street {rng.randrange(10000)}"
+    if rng.random() < 0.15:
+        tags['maxspeed'] = rng.choice(['30', '50', '70', '90'])
+    if rng.random() < 0.10:
+        tags['lit'] = rng.choice(['yes', 'no'])
+    if rng.random() < 0.08:
+        tags['oneway'] = 'yes'
+    if rng.random() < 0.04:
+        tags['smoothness'] = rng.choice(['excellent', 'good', 'intermediate', 'bad', 'very_bad'])
+    if highway == 'track' and rng.random() < 0.5:
+        tags['tracktype'] = rng.choice(['grade1', 'grade2', 'grade3', 'grade4', 'grade5'])
+    if rng.random() < 0.02:
+        tags['tiger:cfcc'] = rng.choice(['A41', 'A45', 'A74'])
+    return tags
+
+
+def generate_dataset(size, work_dir):
+    """
+    Generate (or reuse) the synthetic PBF and ids file for a size.
+    Returns (pbf_file, ids_file).
+    """
+    name = f"synthetic-{size}-v{GENERATOR_VERSION}"
+    pbf_file = os.path.join(work_dir, name + '.osm.pbf')
+    ids_file = os.path.join(work_dir, name + '-ids.txt')
+    if os.path.exists(pbf_file) and os.path.exists(ids_file):
+        return pbf_file, ids_file
+
+    rng = random.Random(f"{SEED}-{size}")
+    way_count = SIZES[size]
+    node_count = way_count * 5
+
+    # Nodes on a jittered grid around Cyprus
+    nodes = [(node_id, 34.6 + rng.random() * 0.9, 32.3 + rng.random() * 1.9, {})
+             for node_id in range(1, node_count + 1)]
+    for node in rng.sample(nodes, node_count // 50):
+        node[3]['highway'] = rng.choice(['crossing', 'traffic_signals', 'stop'])
+
+    ways = []
+    listed = []
+    way_id = 1000
+    for _ in range(way_count):
+        way_id += rng.randint(1, 5)
+        start = rng.randrange(1, node_count - 12)
+        refs = list(range(start, start + rng.randint(2, 12)))
+        if rng.random() < NON_HIGHWAY_SHARE:
+            tags = dict(rng.choice(NON_HIGHWAY_TAGS))
+        else:
+            tags = random_highway_tags(rng)
+            if 'surface' not in tags and rng.random() < IDS_SHARE:
+                listed.append(way_id)
+        ways.append((way_id, tags, refs))
+
+    relations = []
+    for relation_id in range(1, way_count // 100 + 1):
+        members = [(MEMBER_WAY, ways[rng.randrange(way_count)][0], '') for _ in range(rng.randint(2, 20))]
+        relations.append((relation_id, {'type': 'route', 'route': 'bicycle'}, members))
+
+    os.makedirs(work_dir, exist_ok=True)
+    tmp_file = pbf_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(encode_frame(encode_header_block(bbox=(32.3, 34.6, 34.2, 35.5)), 'OSMHeader'))
+        for i in range(0, len(nodes), BLOCK_SIZE):
+            f.write(encode_frame(encode_dense_nodes_block(nodes[i:i + BLOCK_SIZE])))
+        for i in range(0, len(ways), BLOCK_SIZE):
+            f.write(encode_frame(encode_ways_block(ways[i:i + BLOCK_SIZE])))
+        for i in range(0, len(relations), BLOCK_SIZE):
+            f.write(encode_frame(encode_relations_block(relations[i:i + BLOCK_SIZE])))
+    os.replace(tmp_file, pbf_file)
+
+    # Unsorted like the real file, plus IDs that are not in the extract
+    listed += [way_id + i for i in range(1, len(listed) // 10 + 2)]
+    rng.shuffle(listed)
+    with open(ids_file, 'w') as f:
+        for listed_id in listed:
+            f.write(f"{listed_id} paved\n")
+
+    return pbf_file, ids_file
+
+
+# ============================================================================
+# STAGES (each runs in a fresh process)
+# ============================================================================
+
+def run_stage(stage, pbf_file, ids_file, work_dir):
+    """Run one benchmark stage and return its measurements"""
+    import modify_osm_ways
+    import surface_index
+
+    index_file = surface_index.index_path(ids_file)
+    ways = None
+    start = time.perf_counter()
+
+    # Keep progress output of the measured code out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        if stage == 'load_ids_build':
+            if os.path.exists(index_file):
+                os.remove(index_file)
+            start = time.perf_counter()
+            ways = len(modify_osm_ways.load_surface_map(ids_file))
+        elif stage == 'load_ids_mmap':
+            if not surface_index.is_index_current(ids_file):
+                surface_index.build_index(ids_file)
+            start = time.perf_counter()
+            ways = len(modify_osm_ways.load_surface_map(ids_file))
+        elif stage == 'rewrite_osmium':
+            import osmium
+            surface_map = modify_osm_ways.load_surface_map(ids_file)
+            output = os.path.join(work_dir, 'bench-osmium-modified.osm.pbf')
+            if os.path.exists(output):
+                os.remove(output)
+            start = time.perf_counter()
+            writer = osmium.SimpleWriter(output)
+            handler = modify_osm_ways.SurfaceUpdater(surface_map, writer, show_progress=False)
+            handler.apply_file(pbf_file)
+            writer.close()
+            ways = handler.way_count
+            os.remove(output)
+        elif stage == 'rewrite_ways_only':
+            surface_map = modify_osm_ways.load_surface_map(ids_file)
+            output = os.path.join(work_dir, 'bench-ways-only-modified.osm.pbf')
+            start = time.perf_counter()
+            counts = modify_osm_ways.process_pbf_parallel(pbf_file, output, surface_map, 1, ways_only=True)
+            ways = counts['way_count']
+            os.remove(output)
+        elif stage == 'collect_surface_stats':
+            import analyze_countries
+            start = time.perf_counter()
+            _, ways, _ = analyze_countries.collect_surface_stats(pbf_file)
+        else:
+            raise ValueError(f"Unknown stage '{stage}'")
+
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in KB on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {'seconds': seconds, 'ways': ways, 'peak_rss_mb': round(peak_rss_mb, 1)}
+
+
+def measure(stage, size, pbf_file, ids_file, work_dir):
+    """Run a stage in a fresh process and add derived throughput numbers"""
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        result = pool.submit(run_stage, stage, pbf_file, ids_file, work_dir).result()
+
+    seconds = result['seconds']
+    mb = os.path.getsize(pbf_file) / (1024 * 1024)
+    entry = {'size': size, 'stage': stage, 'seconds': round(seconds, 4), 'peak_rss_mb': result['peak_rss_mb']}
+    if stage.startswith('load_ids'):
+        entry['load_seconds'] = round(seconds, 4)
+        entry['entries'] = result['ways']
+    else:
+        entry['ways'] = result['ways']
+        entry['ways_per_s'] = round(result['ways'] / seconds) if seconds > 0 else None
+        entry['mb_per_s'] = round(mb / seconds, 2) if seconds > 0 else None
+    return entry
+
+
+# ============================================================================
+# REPORTING
+# ============================================================================
+
+def git_commit():
+    """Short commit hash of the working tree, or 'unknown'"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_entry(entry):
+    if 'load_seconds' in entry:
+        print(f"  {entry['size']:<8} {entry['stage']:<24} load {entry['load_seconds']:>9.3f}s  "
+              f"{entry['entries']:>10,} entries  RSS {entry['peak_rss_mb']:>8.1f} MB")
+    else:
+        print(f"  {entry['size']:<8} {entry['stage']:<24} {entry['ways_per_s'] or 0:>10,} ways/s  "
+              f"{entry['mb_per_s'] or 0:>8.2f} MB/s  RSS {entry['peak_rss_mb']:>8.1f} MB")
+
+
+def compare_results(old_file, new_file):
+    """Print speed and memory ratios between two result files"""
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    old_entries = {(e['size'], e['stage']): e for e in old['results']}
+
+    print(f"Comparing {old['commit']} -> {new['commit']}")
+    print(f"  {'size':<8} {'stage':<24} {'time':>10} {'peak RSS':>10}")
+    for entry in new['results']:
+        before = old_entries.get((entry['size'], entry['stage']))
+        if not before:
+            continue
+        time_ratio = entry['seconds'] / before['seconds'] if before['seconds'] else float('nan')
+        rss_ratio = entry['peak_rss_mb'] / before['peak_rss_mb'] if before['peak_rss_mb'] else float('nan')
+        print(f"  {entry['size']:<8} {entry['stage']:<24} {time_ratio:>9.2f}x {rss_ratio:>9.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the surface pipeline on synthetic PBF files')
+    parser.add_argument('--sizes', default='small,medium',
+                        help=f"Comma separated sizes ({', '.join(SIZES)}, default: small,medium)")
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='Comma separated stages (default: all)')
+    parser.add_argument('--work-dir', default='bench_data',
+                        help='Directory for generated PBF and ids files (default: bench_data)')
+    parser.add_argument('--output-dir', default='bench_results',
+                        help='Directory for JSON results (default: bench_results)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='Compare two result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+        return
+
+    sizes = [s for s in args.sizes.split(',') if s]
+    stages = [s for s in args.stages.split(',') if s]
+    for size in sizes:
+        if size not in SIZES:
+            print(f"Error: Unknown size '{size}'")
+            sys.exit(1)
+    for stage in stages:
+        if stage not in STAGES:
+            print(f"Error: Unknown stage '{stage}'")
+            sys.exit(1)
+
+    work_dir = os.path.abspath(args.work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+    commit = git_commit()
+
+    print("=" * 70)
+    print(f"Surface pipeline benchmark (commit {commit})")
+    print("=" * 70)
+
+    results = []
+    for size in sizes:
+        start = time.time()
+        pbf_file, ids_file = generate_dataset(size, work_dir)
+        print(f"\n{size}: {pbf_file} ({os.path.getsize(pbf_file) / (1024 * 1024):.1f} MB, "
+              f"ready in {time.time() - start:.1f}s)")
+        for stage in stages:
+            try:
+                entry = measure(stage, size, pbf_file, ids_file, work_dir)
+            except ImportError as e:
+                print(f"  {size:<8} {stage:<24} skipped ({e})")
+                continue
+            results.append(entry)
+            print_entry(entry)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_file = os.path.join(args.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(output_file, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'generator_version': GENERATOR_VERSION,
+            'results': results,
+        }, f, indent=2)
+    print(f"\n✓ Results written to {output_file}")
+
+
+if __name__ == '__main__':
+    main()
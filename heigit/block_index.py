@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+"""
+Block index of a PBF file, for random access by element ID and for
+splitting work into ranges without scanning the file.
+
+Every blob of a PBF is summarized once into a binary index next to it
+(<pbf_file>.blkidx):
+
+  header   magic, blob count, size and mtime of the source PBF
+  records  one per blob, in file order (RECORD_FORMAT):
+           byte offset, frame size, element types (TYPE_* bits),
+           flags (FLAG_HEADER for the OSMHeader blob), min and max element
+           ID, bbox of the nodes as int32 1e-7 degrees (empty for blocks
+           without nodes)
+
+Building it is one sequential read of the file; blocks are decompressed by
+worker processes. Mixed blocks get the ID range over all their elements, so
+lookups stay correct (they may decode a block for nothing). A lookup by ID
+bisects the records of its type and decodes a single blob in files sorted by
+type and ID, as all Geofabrik extracts are. The index is about 48 bytes per
+blob (a few MB for the planet) and reused until the PBF's size or mtime
+change, like node_index.py.
+
+Usage: ./block_index.py build country-latest.osm.pbf
+       ./block_index.py get country-latest.osm.pbf w55678093 n123 r456
+       ./block_index.py info country-latest.osm.pbf
+"""
+
+import argparse
+import multiprocessing
+import os
+import struct
+import sys
+from bisect import bisect_left
+from collections import deque, namedtuple
+
+from pbf_blocks import GROUP_WAYS, GROUP_RELATIONS, BlobInfo, Way, iter_fields, iter_stream_frames, \
+    iter_node_locations, read_element_id, decode_frame, read_frame, read_string_table, split_ranges
+
+
+INDEX_MAGIC = b'BLKIDX01'
+# magic, count, source size, source mtime_ns
+HEADER_FORMAT = '<8sQQq'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+# offset, size, types, flags, min_id, max_id, min_lon, min_lat, max_lon, max_lat
+RECORD_FORMAT = '<QIBBxxqqiiii'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+TYPE_NODE = 1
+TYPE_WAY = 2
+TYPE_RELATION = 4
+TYPE_NAMES = {'n': TYPE_NODE, 'w': TYPE_WAY, 'r': TYPE_RELATION}
+FLAG_HEADER = 1
+
+# Frames in flight while building
+WINDOW_PER_WORKER = 4
+
+BlockEntry = namedtuple('BlockEntry', ['offset', 'size', 'types', 'flags', 'min_id', 'max_id', 'bbox'])
+
+
+def index_path(pbf_file):
+    """Path of the block index belonging to a PBF file"""
+    return pbf_file + '.blkidx'
+
+
+def summarize_frame(frame):
+    """Worker: (types, min_id, max_id, bbox in 1e-7 degrees or None) of one OSMData frame"""
+    block = decode_frame(frame)
+    types = 0
+    min_id = max_id = None
+    bbox = None
+
+    def add(element_id):
+        nonlocal min_id, max_id
+        if min_id is None or element_id < min_id:
+            min_id = element_id
+        if max_id is None or element_id > max_id:
+            max_id = element_id
+
+    for ids, lons, lats in iter_node_locations(block):
+        if not ids:
+            continue
+        types |= TYPE_NODE
+        add(min(ids))
+        add(max(ids))
+        box = (round(min(lons) * 1e7), round(min(lats) * 1e7), round(max(lons) * 1e7), round(max(lats) * 1e7))
+        bbox = box if bbox is None else (min(bbox[0], box[0]), min(bbox[1], box[1]),
+                                         max(bbox[2], box[2]), max(bbox[3], box[3]))
+
+    for field_number, _, group in iter_fields(block):
+        if field_number != 2:
+            continue
+        for kind, _, item in iter_fields(group):
+            if kind == GROUP_WAYS:
+                types |= TYPE_WAY
+                add(read_element_id(item))
+            elif kind == GROUP_RELATIONS:
+                types |= TYPE_RELATION
+                add(read_element_id(item))
+    return types, min_id or 0, max_id or 0, bbox
+
+
+def build_block_index(pbf_file, output_file=None, workers=None, progress=None):
+    """
+    Summarize every blob of pbf_file into a block index, reading the file
+    once and decoding blocks with `workers` processes (default: all cores).
+    progress(bytes_read, file_size) is called after every blob.
+    Returns the number of blobs indexed.
+    """
+    output_file = output_file or index_path(pbf_file)
+    workers = max(1, workers or os.cpu_count() or 1)
+    source = os.stat(pbf_file)
+
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    count = 0
+    try:
+        with open(pbf_file, 'rb') as f, open(tmp_file, 'wb') as out:
+            out.write(b'\0' * HEADER_SIZE)
+            pending = deque()  # (offset, size, blob_type, summary or async result)
+
+            def write(offset, size, blob_type, summary):
+                nonlocal count
+                if blob_type == 'OSMData':
+                    types, min_id, max_id, bbox = summary
+                    flags = 0
+                else:
+                    types, min_id, max_id, bbox = 0, 0, 0, None
+                    flags = FLAG_HEADER if blob_type == 'OSMHeader' else 0
+                out.write(struct.pack(RECORD_FORMAT, offset, size, types, flags, min_id, max_id,
+                                      *(bbox or (1, 1, 0, 0))))
+                count += 1
+                if progress:
+                    progress(offset + size, source.st_size)
+
+            pool = multiprocessing.get_context('fork').Pool(workers) if workers > 1 else None
+            try:
+                offset = 0
+                for blob_type, frame in iter_stream_frames(f):
+                    if blob_type != 'OSMData':
+                        summary = None
+                    elif pool is None:
+                        summary = summarize_frame(frame)
+                    else:
+                        summary = pool.apply_async(summarize_frame, (frame,))
+                    pending.append((offset, len(frame), blob_type, summary))
+                    offset += len(frame)
+                    while len(pending) > (workers * WINDOW_PER_WORKER if pool else 0):
+                        entry_offset, size, entry_type, summary = pending.popleft()
+                        write(entry_offset, size, entry_type, summary.get() if pool and summary else summary)
+                while pending:
+                    entry_offset, size, entry_type, summary = pending.popleft()
+                    write(entry_offset, size, entry_type, summary.get() if pool and summary else summary)
+            finally:
+                if pool:
+                    pool.terminate()
+
+            out.seek(0)
+            out.write(struct.pack(HEADER_FORMAT, INDEX_MAGIC, count, source.st_size, source.st_mtime_ns))
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return count
+
+
+def is_index_current(pbf_file, index_file=None):
+    """Check that the index exists and was built from the current PBF file"""
+    index_file = index_file or index_path(pbf_file)
+    try:
+        with open(index_file, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+    except FileNotFoundError:
+        return False
+    if len(header) != HEADER_SIZE:
+        return False
+    magic, _, source_size, source_mtime_ns = struct.unpack(HEADER_FORMAT, header)
+    source = os.stat(pbf_file)
+    return (magic == INDEX_MAGIC and source_size == source.st_size
+            and source_mtime_ns == source.st_mtime_ns)
+
+
+class BlockIndex:
+    """Blob records of a PBF file, with lookups by element ID and bbox"""
+
+    def __init__(self, pbf_file, index_file=None):
+        self.pbf_file = pbf_file
+        index_file = index_file or index_path(pbf_file)
+        with open(index_file, 'rb') as f:
+            data = f.read()
+        magic, count, _, _ = struct.unpack_from(HEADER_FORMAT, data)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"'{index_file}' is not a block index")
+        if len(data) != HEADER_SIZE + count * RECORD_SIZE:
+            raise ValueError(f"'{index_file}' is truncated")
+
+        self.entries = []
+        for offset, size, types, flags, min_id, max_id, *box in struct.iter_unpack(RECORD_FORMAT,
+                                                                                    data[HEADER_SIZE:]):
+            bbox = tuple(v / 1e7 for v in box) if box[0] <= box[2] else None
+            self.entries.append(BlockEntry(offset, size, types, flags, min_id, max_id, bbox))
+        self._by_type = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def blobs(self, types=None, bbox=None):
+        """
+        BlobInfo of the data blobs holding any of the element types (TYPE_*
+        bits, default all), optionally only node blobs whose nodes' bbox
+        intersects bbox (left, bottom, right, top). Usable with read_frame()
+        and split_ranges().
+        """
+        blobs = []
+        for entry in self.entries:
+            if entry.flags & FLAG_HEADER or not entry.types or (types and not entry.types & types):
+                continue
+            if bbox is not None:
+                if entry.bbox is None:
+                    continue
+                left, bottom, right, top = entry.bbox
+                if left > bbox[2] or right < bbox[0] or bottom > bbox[3] or top < bbox[1]:
+                    continue
+            blobs.append(BlobInfo(entry.offset, entry.size, 'OSMData'))
+        return blobs
+
+    def split(self, parts, types=None):
+        """Split the data blobs of the element types into at most parts byte-balanced ranges"""
+        return split_ranges(self.blobs(types), parts)
+
+    def candidates(self, element_type, element_id):
+        """Entries whose ID range of element_type (one TYPE_* bit) contains element_id"""
+        if element_type not in self._by_type:
+            entries = [entry for entry in self.entries if entry.types & element_type]
+            ordered = all(a.max_id < b.min_id for a, b in zip(entries, entries[1:]))
+            self._by_type[element_type] = (entries, [entry.max_id for entry in entries] if ordered else None)
+        entries, max_ids = self._by_type[element_type]
+        if max_ids is None:
+            return [entry for entry in entries if entry.min_id <= element_id <= entry.max_id]
+        # Sorted by type and ID: the only candidate is the first block ending at or after the ID
+        i = bisect_left(max_ids, element_id)
+        return [entries[i]] if i < len(entries) and entries[i].min_id <= element_id else []
+
+    def get(self, element_type, element_id):
+        """
+        Find one element, decoding only the candidate blob(s). Returns a dict
+        with type and id plus lon/lat (nodes), tags and refs (ways) or tags
+        (relations), or None if the file does not contain it.
+        """
+        with open(self.pbf_file, 'rb') as f:
+            for entry in self.candidates(element_type, element_id):
+                block = decode_frame(read_frame(f, BlobInfo(entry.offset, entry.size, 'OSMData')))
+                element = find_in_block(block, element_type, element_id)
+                if element is not None:
+                    return element
+        return None
+
+
+def find_in_block(block, element_type, element_id):
+    """Decode one element of a block (see BlockIndex.get())"""
+    if element_type == TYPE_NODE:
+        for ids, lons, lats in iter_node_locations(block):
+            for i, node_id in enumerate(ids):
+                if node_id == element_id:
+                    return {'type': 'node', 'id': node_id, 'lon': lons[i], 'lat': lats[i]}
+        return None
+
+    kind = GROUP_WAYS if element_type == TYPE_WAY else GROUP_RELATIONS
+    strings = None
+    for field_number, _, group in iter_fields(block):
+        if field_number != 2:
+            continue
+        for item_kind, _, item in iter_fields(group):
+            if item_kind != kind or read_element_id(item) != element_id:
+                continue
+            strings = strings or [s.decode('utf-8', 'replace') for s in read_string_table(block)]
+            # Relations share the id/keys/vals fields of ways
+            element = Way(item)
+            if kind == GROUP_WAYS:
+                return {'type': 'way', 'id': element.id, 'tags': element.tags(strings), 'refs': element.refs()}
+            return {'type': 'relation', 'id': element.id, 'tags': element.tags(strings)}
+    return None
+
+
+def ensure_block_index(pbf_file, workers=None):
+    """
+    Return the path of the block index of a PBF file, (re)building it first
+    if it is missing or older than the file.
+    """
+    index_file = index_path(pbf_file)
+    if not is_index_current(pbf_file, index_file):
+        print(f"  Building block index: {index_file}")
+        count = build_block_index(pbf_file, index_file, workers)
+        print(f"  Indexed {count:,} blobs")
+    return index_file
+
+
+def open_block_index(pbf_file, workers=None):
+    """Open the block index of a PBF file (see ensure_block_index())"""
+    return BlockIndex(pbf_file, ensure_block_index(pbf_file, workers))
+
+
+def parse_element(text):
+    """Parse 'w123' style element references into (TYPE_*, id)"""
+    if len(text) < 2 or text[0] not in TYPE_NAMES:
+        raise ValueError(f"Not an element reference (n<ID>, w<ID> or r<ID>): {text}")
+    return TYPE_NAMES[text[0]], int(text[1:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Block index of a PBF file for random access')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='(Re)build the index next to the PBF')
+    build.add_argument('pbf_file', help='Input .osm.pbf file')
+    build.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    get = commands.add_parser('get', help='Print elements by ID, e.g. w55678093 (builds the index if needed)')
+    get.add_argument('pbf_file', help='Input .osm.pbf file')
+    get.add_argument('elements', nargs='+', help='n<ID>, w<ID> or r<ID>')
+    info = commands.add_parser('info', help='Summarize the index')
+    info.add_argument('pbf_file', help='Input .osm.pbf file')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        count = build_block_index(args.pbf_file, workers=args.workers,
+                                  progress=lambda done, total: print(f"  {done / total * 100:5.1f}%", end='\r'))
+        print(f"✓ Indexed {count:,} blobs: {index_path(args.pbf_file)}")
+        return
+
+    index = open_block_index(args.pbf_file)
+    if args.command == 'info':
+        for name, element_type in (('nodes', TYPE_NODE), ('ways', TYPE_WAY), ('relations', TYPE_RELATION)):
+            entries = [entry for entry in index.entries if entry.types & element_type]
+            if entries:
+                print(f"{name:<10} {len(entries):>8,} blobs {sum(e.size for e in entries) / 1024**2:>10.1f} MB  "
+                      f"IDs {min(e.min_id for e in entries)}..{max(e.max_id for e in entries)}")
+        return
+
+    missing = False
+    for text in args.elements:
+        try:
+            element_type, element_id = parse_element(text)
+        except ValueError as e:
+            print(f"✗ {e}")
+            sys.exit(1)
+        element = index.get(element_type, element_id)
+        if element is None:
+            print(f"✗ {text} not found")
+            missing = True
+            continue
+        if element['type'] == 'node':
+            print(f"{text}: {element['lat']:.7f}, {element['lon']:.7f}")
+            continue
+        print(f"{text}:")
+        for key, value in sorted(element['tags'].items()):
+            print(f"  {key}={value}")
+        if 'refs' in element:
+            print(f"  ({len(element['refs'])} nodes: {element['refs'][0]} .. {element['refs'][-1]})"
+                  if element['refs'] else "  (no nodes)")
+    if missing:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
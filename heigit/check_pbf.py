@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+"""
+Structural sanity check of a PBF file, e.g. a modified planet part before
+hours of osrm-extract.
+
+  1. framing: every frame header is read with seek(), the frames must end
+     exactly at the end of the file (a truncated copy fails here, in seconds)
+     and be OSMHeader or OSMData frames (a damaged type would hide a block)
+  2. blocks: worker processes decompress every blob (checking raw_size) and
+     read only element IDs and node coordinates, no tags or refs
+  3. order: in a file declaring Sort.Type_then_ID, element IDs must
+     increase within every type and all nodes must come before all ways
+     before all relations; other files only get warnings for the same
+     problems
+  4. totals: node, way and relation counts, ID ranges and the bbox of the
+     nodes, compared against the input file with --input (the modifier only
+     changes tags, so they must match exactly)
+
+The summary of a checked file is kept next to it (<file>.check.json) while
+its size and mtime are unchanged, so the input is only scanned once, e.g.
+right after it is merged. Exit status 0 if the file passes, 1 otherwise.
+
+Usage: ./check_pbf.py planet-part1-modified.osm.pbf --input planet-part1.osm.pbf [--workers N]
+"""
+
+import argparse
+import json
+import lzma
+import multiprocessing
+import os
+import struct
+import sys
+import time
+import zlib
+
+from pbf_blocks import GROUP_NODES, GROUP_DENSE, GROUP_WAYS, GROUP_RELATIONS, read_blob_info, read_frame, \
+    decode_frame, parse_header_block, iter_fields, iter_node_locations, read_element_id, split_ranges
+from surface_stats import RANGES_PER_WORKER
+
+
+ELEMENT_TYPES = ('nodes', 'ways', 'relations')
+_GROUP_TYPES = {GROUP_NODES: 0, GROUP_DENSE: 0, GROUP_WAYS: 1, GROUP_RELATIONS: 2}
+
+# Problems listed per file
+MAX_PROBLEMS = 20
+SUMMARY_VERSION = 2
+
+
+def summary_path(pbf_file):
+    return pbf_file + '.check.json'
+
+
+def scan_frames(pbf_file):
+    """
+    Read all frame headers. Returns (blobs, framing error or None); on an
+    error the blobs up to it are returned.
+    """
+    file_size = os.path.getsize(pbf_file)
+    blobs = []
+    offset = 0
+    with open(pbf_file, 'rb') as f:
+        while offset < file_size:
+            try:
+                info = read_blob_info(f, offset)
+            except (ValueError, IndexError, TypeError, struct.error) as e:
+                return blobs, f"Invalid frame at offset {offset:,}: {e}"
+            if offset + info.size > file_size:
+                return blobs, (f"Frame at offset {offset:,} ends {offset + info.size - file_size:,} bytes "
+                               f"after the end of the file (truncated)")
+            blobs.append(info)
+            offset += info.size
+    return blobs, None
+
+
+def check_block(block):
+    """
+    Element counts, first and last ID per type, node bbox and problems of
+    one decoded block. Types are 0 (nodes), 1 (ways), 2 (relations).
+    """
+    counts = [0, 0, 0]
+    first = [None, None, None]
+    last = [None, None, None]
+    problems = []
+    types = []  # Element type of every group, in file order
+
+    def add(element_type, element_id):
+        if last[element_type] is not None and element_id <= last[element_type] and len(problems) < MAX_PROBLEMS:
+            problems.append(f"{ELEMENT_TYPES[element_type]} ID {element_id} after {last[element_type]}")
+        if first[element_type] is None:
+            first[element_type] = element_id
+        last[element_type] = element_id
+        counts[element_type] += 1
+
+    for field_number, _, group in iter_fields(block):
+        if field_number != 2:
+            continue
+        for kind, _, item in iter_fields(group):
+            element_type = _GROUP_TYPES.get(kind)
+            if element_type is None:
+                continue
+            if not types or types[-1] != element_type:
+                types.append(element_type)
+            if element_type:
+                add(element_type, read_element_id(item))
+
+    bbox = None
+    for ids, lons, lats in iter_node_locations(block):
+        for node_id in ids:
+            add(0, node_id)
+        if ids:
+            box = (min(lons), min(lats), max(lons), max(lats))
+            bbox = box if bbox is None else (min(bbox[0], box[0]), min(bbox[1], box[1]),
+                                             max(bbox[2], box[2]), max(bbox[3], box[3]))
+    if types != sorted(types):
+        problems.append(f"element types out of order within the block: {[ELEMENT_TYPES[t] for t in types]}")
+    return counts, first, last, bbox, types, problems
+
+
+def check_range(task):
+    """Worker: check_block() results of a range of blobs, as (offset, result or error)"""
+    pbf_file, blobs = task
+    results = []
+    with open(pbf_file, 'rb') as f:
+        for blob in blobs:
+            if blob.blob_type != 'OSMData':
+                results.append((blob.offset, None))
+                continue
+            try:
+                block = decode_frame(read_frame(f, blob))
+                results.append((blob.offset, check_block(block)))
+            except (ValueError, IndexError, zlib.error, lzma.LZMAError) as e:
+                results.append((blob.offset, f"Blob at offset {blob.offset:,} cannot be decoded: {e}"))
+    return results
+
+
+def check_pbf(pbf_file, workers=None, progress=None):
+    """
+    Check the structure of pbf_file with `workers` processes (default: all
+    cores). progress(done_ranges, total_ranges) is called after every range.
+    Returns the summary dict; its 'errors' list is empty if the file passed.
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    source = os.stat(pbf_file)
+    errors = []
+    warnings = []
+    summary = {
+        'version': SUMMARY_VERSION,
+        'file': os.path.basename(pbf_file),
+        'source_size': source.st_size,
+        'source_mtime_ns': source.st_mtime_ns,
+        'blobs': 0,
+        'counts': dict.fromkeys(ELEMENT_TYPES, 0),
+        'id_ranges': dict.fromkeys(ELEMENT_TYPES),
+        'bbox': None,
+        'header_bbox': None,
+        'sorted': False,
+        'errors': errors,
+        'warnings': warnings,
+    }
+
+    blobs, framing_error = scan_frames(pbf_file)
+    if framing_error:
+        errors.append(framing_error)
+    summary['blobs'] = len(blobs)
+    if not blobs or blobs[0].blob_type != 'OSMHeader':
+        errors.append("The file does not start with an OSMHeader blob")
+        return summary
+    try:
+        with open(pbf_file, 'rb') as f:
+            header = parse_header_block(decode_frame(read_frame(f, blobs[0])))
+    except (ValueError, IndexError, zlib.error, lzma.LZMAError) as e:
+        errors.append(f"OSMHeader cannot be decoded: {e}")
+        return summary
+    summary['header_bbox'] = header['bbox']
+    summary['sorted'] = 'Sort.Type_then_ID' in header['optional_features']
+    unknown = [feature for feature in header['required_features']
+               if feature not in ('OsmSchema-V0.6', 'DenseNodes', 'HistoricalInformation')]
+    if unknown:
+        errors.append(f"Unsupported required features: {', '.join(unknown)}")
+    for blob in blobs[1:]:
+        if blob.blob_type == 'OSMHeader':
+            errors.append(f"Second OSMHeader blob at offset {blob.offset:,}")
+        elif blob.blob_type != 'OSMData':
+            errors.append(f"Unknown blob type '{blob.blob_type}' at offset {blob.offset:,}")
+
+    tasks = [(pbf_file, blob_range) for blob_range in split_ranges(blobs[1:], workers * RANGES_PER_WORKER)]
+    if workers == 1 or len(tasks) <= 1:
+        results = map(check_range, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.get_context('fork').Pool(min(workers, len(tasks)))
+        # Ordered, so the order checks see the blocks in file order
+        results = pool.imap(check_range, tasks)
+
+    counts = [0, 0, 0]
+    first = [None, None, None]
+    last = [None, None, None]
+    bbox = None
+    highest_type = 0
+    try:
+        for done, range_results in enumerate(results, 1):
+            for offset, result in range_results:
+                if result is None:
+                    continue
+                if isinstance(result, str):
+                    errors.append(result)
+                    continue
+                block_counts, block_first, block_last, block_bbox, types, problems = result
+                # Order problems, within a block or across blocks, fail sorted files only
+                order_problems = errors if summary['sorted'] else warnings
+                order_problems.extend(f"Blob at offset {offset:,}: {problem}" for problem in problems)
+                if summary['sorted'] and types:
+                    if types[0] < highest_type:
+                        errors.append(f"Blob at offset {offset:,}: {ELEMENT_TYPES[types[0]]} after "
+                                      f"{ELEMENT_TYPES[highest_type]} in a file sorted by type")
+                    highest_type = max(highest_type, types[-1])
+                for t in range(3):
+                    if not block_counts[t]:
+                        continue
+                    if last[t] is not None and block_first[t] <= last[t]:
+                        message = (f"Blob at offset {offset:,}: {ELEMENT_TYPES[t]} ID {block_first[t]} "
+                                   f"after {last[t]}")
+                        order_problems.append(message)
+                    counts[t] += block_counts[t]
+                    first[t] = block_first[t] if first[t] is None else min(first[t], block_first[t])
+                    last[t] = block_last[t] if last[t] is None else max(last[t], block_last[t])
+                if block_bbox:
+                    bbox = block_bbox if bbox is None else (min(bbox[0], block_bbox[0]), min(bbox[1], block_bbox[1]),
+                                                            max(bbox[2], block_bbox[2]), max(bbox[3], block_bbox[3]))
+            if progress:
+                progress(done, len(tasks))
+    finally:
+        if pool:
+            pool.terminate()
+
+    for t, name in enumerate(ELEMENT_TYPES):
+        summary['counts'][name] = counts[t]
+        summary['id_ranges'][name] = [first[t], last[t]] if counts[t] else None
+    summary['bbox'] = list(bbox) if bbox else None
+    if len(errors) > MAX_PROBLEMS:
+        del errors[MAX_PROBLEMS:]
+        errors.append("... more errors not listed")
+    if len(warnings) > MAX_PROBLEMS:
+        del warnings[MAX_PROBLEMS:]
+    return summary
+
+
+def compare_with_input(summary, input_summary):
+    """Errors for every count, ID range or bbox that differs from the input's"""
+    errors = []
+    for name in ELEMENT_TYPES:
+        if summary['counts'][name] != input_summary['counts'][name]:
+            errors.append(f"{summary['counts'][name]:,} {name}, the input has {input_summary['counts'][name]:,}")
+        if summary['id_ranges'][name] != input_summary['id_ranges'][name]:
+            errors.append(f"{name} IDs {summary['id_ranges'][name]}, the input has {input_summary['id_ranges'][name]}")
+    if summary['bbox'] != input_summary['bbox']:
+        errors.append(f"Node bbox {summary['bbox']}, the input has {input_summary['bbox']}")
+    return errors
+
+
+def load_or_check(pbf_file, workers=None, progress=None):
+    """Summary of pbf_file, from its .check.json if the file is unchanged since"""
+    source = os.stat(pbf_file)
+    try:
+        with open(summary_path(pbf_file), 'r') as f:
+            summary = json.load(f)
+        if (summary.get('version') == SUMMARY_VERSION and summary.get('source_size') == source.st_size
+                and summary.get('source_mtime_ns') == source.st_mtime_ns):
+            return summary
+    except (OSError, ValueError):
+        pass
+    summary = check_pbf(pbf_file, workers, progress)
+    try:
+        tmp_file = summary_path(pbf_file) + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(summary, f, indent=2)
+        os.replace(tmp_file, summary_path(pbf_file))
+    except OSError as e:
+        print(f"⚠ Cannot save {summary_path(pbf_file)}: {e}")
+    return summary
+
+
+def print_summary(pbf_file, summary):
+    print(f"{pbf_file}: {summary['blobs']:,} blobs, {summary['source_size'] / 1024**3:.2f} GB"
+          f"{', sorted by type and ID' if summary['sorted'] else ''}")
+    for name in ELEMENT_TYPES:
+        id_range = summary['id_ranges'][name]
+        ids = f"  IDs {id_range[0]}..{id_range[1]}" if id_range else ''
+        print(f"  {name:<10} {summary['counts'][name]:>15,}{ids}")
+    if summary['bbox']:
+        left, bottom, right, top = summary['bbox']
+        print(f"  node bbox  {left:.7f},{bottom:.7f},{right:.7f},{top:.7f}")
+    for warning in summary['warnings']:
+        print(f"  ⚠ {warning}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the structure of a PBF file before using it')
+    parser.add_argument('pbf_file', help='PBF file to check')
+    parser.add_argument('--input', default=None,
+                        help='File it was derived from (e.g. by the modifier): counts, IDs and bbox must match')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    args = parser.parse_args()
+
+    def progress(done, total):
+        print(f"  {done}/{total} ranges", end='\r')
+
+    start = time.time()
+    errors = []
+    summary = load_or_check(args.pbf_file, args.workers, progress)
+    print_summary(args.pbf_file, summary)
+    errors.extend(summary['errors'])
+    if args.input:
+        input_summary = load_or_check(args.input, args.workers, progress)
+        print_summary(args.input, input_summary)
+        if input_summary['errors']:
+            errors.append(f"The input {args.input} fails the check itself")
+        errors.extend(compare_with_input(summary, input_summary))
+
+    print(f"  ({time.time() - start:.1f}s)")
+    if errors:
+        for error in errors:
+            print(f"✗ {error}")
+        sys.exit(1)
+    print(f"✓ {args.pbf_file} passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+"""
+Surface statistics of many countries from one continent or planet PBF.
+
+Instead of downloading and scanning every country extract separately, one
+large PBF (e.g. europe-latest.osm.pbf, already on disk for the OSRM build)
+is read once and every highway way is assigned to the countries whose
+boundary polygon contains its first node. The boundaries are the Geofabrik
+.poly files the country extracts are cut with, so the per-country stats
+match the extracts up to ways that only cross into a country with a later
+node.
+
+The file is read in two parallel phases over disjoint blobs:
+
+  1. way blobs: every counted highway way becomes one int64 of
+     (first node ID << CODE_BITS | class and surface code); every worker
+     returns its values sorted
+  2. node blobs: workers forked with those sorted runs look up the nodes
+     of their blocks, locate them in the CountryIndex and count the ways
+
+Every blob is decompressed once, and no node location index is built: only
+the locations of the first nodes are ever looked at.
+
+CountryIndex is a grid over the polygon bounding boxes; within a polygon the
+edges are bucketed in latitude bands, so a point-in-polygon test only looks
+at the few edges of its band.
+"""
+
+import math
+import multiprocessing
+import os
+from array import array
+from bisect import bisect_left
+
+from pbf_blocks import GROUP_WAYS, scan_blobs, find_way_blobs, find_node_blobs, read_frame, decode_frame, \
+    block_group_kinds, split_ranges, iter_node_locations
+from pbf_download import download_file
+from surface_stats import HIGHWAY_TYPES, count_way, merge_stats, iter_highway_ways, RANGES_PER_WORKER
+
+
+# Grid cell size of the country lookup, in degrees
+GRID_SIZE = 1.0
+# Height of the latitude bands polygon edges are bucketed in, in degrees
+BAND_HEIGHT = 0.05
+
+# Low bits of a packed way value: highway class index << 1 | has_surface
+CODE_BITS = 5
+CODE_MASK = (1 << CODE_BITS) - 1
+_CLASS_CODES = {highway_type: i for i, highway_type in enumerate(HIGHWAY_TYPES)}
+
+
+# ============================================================================
+# BOUNDARY POLYGONS
+# ============================================================================
+
+def poly_url(pbf_url):
+    """URL of the Geofabrik .poly boundary of an extract URL"""
+    if pbf_url.endswith('-latest.osm.pbf'):
+        return pbf_url[:-len('-latest.osm.pbf')] + '.poly'
+    raise ValueError(f"Not a Geofabrik extract URL: {pbf_url}")
+
+
+def parse_poly(text):
+    """
+    Parse an Osmosis polygon file. Returns a list of rings, each a list of
+    (lon, lat). Holes ('!' sections) are rings as well: points are tested
+    with the even-odd rule over all rings.
+    """
+    lines = [line.strip() for line in text.splitlines()]
+    rings = []
+    ring = None
+    # The first line is the name of the polygon
+    for line in lines[1:]:
+        if not line:
+            continue
+        if ring is None:
+            if line == 'END':
+                break
+            ring = []
+        elif line == 'END':
+            if len(ring) >= 3:
+                rings.append(ring)
+            ring = None
+        else:
+            lon, lat = line.split()[:2]
+            ring.append((float(lon), float(lat)))
+    if not rings:
+        raise ValueError("Polygon file without rings")
+    return rings
+
+
+def load_poly(url, poly_dir):
+    """Download (once) and parse the .poly boundary of an extract URL"""
+    url = poly_url(url)
+    path = os.path.join(poly_dir, os.path.basename(url))
+    if not os.path.exists(path):
+        os.makedirs(poly_dir, exist_ok=True)
+        download_file(url, path, connections=1, verify_md5=False)
+    with open(path, 'r') as f:
+        return parse_poly(f.read())
+
+
+def poly_bbox(rings):
+    """Bounding box (left, bottom, right, top) of a parsed polygon"""
+    points = [point for ring in rings for point in ring]
+    return (min(lon for lon, _ in points), min(lat for _, lat in points),
+            max(lon for lon, _ in points), max(lat for _, lat in points))
+
+
+class CountryIndex:
+    """Spatial index over country polygons, given as a list of (name, rings)"""
+
+    def __init__(self, polygons):
+        self.names = [name for name, _ in polygons]
+        self.bboxes = []
+        self.bands = []  # Per country: band -> [(x1, y1, x2, y2), ...]
+        self.grid = {}  # (x, y) cell -> country indices whose bbox overlaps it
+
+        for i, (_, rings) in enumerate(polygons):
+            left, bottom, right, top = poly_bbox(rings)
+            self.bboxes.append((left, bottom, right, top))
+
+            bands = {}
+            for ring in rings:
+                for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+                    if y1 == y2:
+                        continue
+                    for band in range(math.floor(min(y1, y2) / BAND_HEIGHT),
+                                      math.floor(max(y1, y2) / BAND_HEIGHT) + 1):
+                        bands.setdefault(band, []).append((x1, y1, x2, y2))
+            self.bands.append(bands)
+
+            for x in range(math.floor(left / GRID_SIZE), math.floor(right / GRID_SIZE) + 1):
+                for y in range(math.floor(bottom / GRID_SIZE), math.floor(top / GRID_SIZE) + 1):
+                    self.grid.setdefault((x, y), []).append(i)
+
+    def contains(self, i, lon, lat):
+        """Point-in-polygon test (even-odd rule) for country i"""
+        left, bottom, right, top = self.bboxes[i]
+        if not (left <= lon <= right and bottom <= lat <= top):
+            return False
+        inside = False
+        for x1, y1, x2, y2 in self.bands[i].get(math.floor(lat / BAND_HEIGHT), ()):
+            if (y1 > lat) != (y2 > lat) and lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+        return inside
+
+    def locate(self, lon, lat):
+        """Indices of all countries containing the point (borders overlap)"""
+        candidates = self.grid.get((math.floor(lon / GRID_SIZE), math.floor(lat / GRID_SIZE)), ())
+        return tuple(i for i in candidates if self.contains(i, lon, lat))
+
+
+# ============================================================================
+# ONE-PASS COUNTRY STATS ENGINE
+# ============================================================================
+
+# Set in the parent before the node phase pool is forked
+_worker_index = None
+_worker_runs = None
+
+
+def run_blob_ranges(pbf_file, function, blobs, workers, phase, progress=None):
+    """
+    Run a worker function over the blobs split into ranges, in a forked pool
+    (in this process with one worker). Yields the results as they complete,
+    calling progress(phase, done_ranges, total_ranges) after every range.
+    """
+    tasks = [(pbf_file, blob_range) for blob_range in split_ranges(blobs, workers * RANGES_PER_WORKER)]
+    if workers == 1 or len(tasks) <= 1:
+        for done, task in enumerate(tasks, 1):
+            result = function(task)
+            if progress:
+                progress(phase, done, len(tasks))
+            yield result
+        return
+    with multiprocessing.get_context('fork').Pool(min(workers, len(tasks))) as pool:
+        for done, result in enumerate(pool.imap_unordered(function, tasks), 1):
+            if progress:
+                progress(phase, done, len(tasks))
+            yield result
+
+
+def collect_way_refs(task):
+    """
+    Worker: pack the counted highway ways of a range of blobs.
+    Returns (sorted array of packed values, way_count, highway_way_count).
+    """
+    pbf_file, blobs = task
+    values = []
+    way_count = 0
+    with open(pbf_file, 'rb') as f:
+        for blob in blobs:
+            block = decode_frame(read_frame(f, blob))
+            if GROUP_WAYS not in block_group_kinds(block):
+                continue
+            for highway_type, has_surface, ref in iter_highway_ways(block, refs='first'):
+                way_count += 1
+                if highway_type and ref is not None and ref >= 0:
+                    values.append(ref << CODE_BITS | _CLASS_CODES[highway_type] << 1 | has_surface)
+    values.sort()
+    return array('q', values), way_count, len(values)
+
+
+def iter_first_node_ways(pbf_file, blobs, runs):
+    """
+    Look up the first nodes of packed way values (sorted runs of
+    collect_way_refs() results) in a range of node blobs.
+    Yields (lon, lat, codes) per first node found, codes being the
+    class and surface codes of the ways starting at it.
+    """
+    with open(pbf_file, 'rb') as f:
+        for blob in blobs:
+            for ids, lons, lats in iter_node_locations(decode_frame(read_frame(f, blob))):
+                if not ids:
+                    continue
+                low = min(ids) << CODE_BITS
+                high = (max(ids) + 1) << CODE_BITS
+                positions = None
+                for run in runs:
+                    start = bisect_left(run, low)
+                    end = bisect_left(run, high, start)
+                    if start == end:
+                        continue
+                    if positions is None:
+                        positions = {node_id: i for i, node_id in enumerate(ids)}
+                    last_node = None
+                    location = None  # (lon, lat) of last_node, None if not in this group
+                    codes = []
+                    for value in run[start:end]:
+                        node_id = value >> CODE_BITS
+                        if node_id != last_node:
+                            # Ways sharing a first node are adjacent in the run
+                            if codes:
+                                yield (*location, codes)
+                            last_node = node_id
+                            i = positions.get(node_id)
+                            location = (lons[i], lats[i]) if i is not None else None
+                            codes = []
+                        if location is not None:
+                            codes.append(value & CODE_MASK)
+                    if codes:
+                        yield (*location, codes)
+
+
+def count_node_range(task):
+    """
+    Worker: locate the first nodes found in a range of blobs and count
+    their ways per country. Returns (stats per country index, located ways).
+    """
+    pbf_file, blobs = task
+    index = _worker_index
+    stats = [{} for _ in index.names]
+    located = 0
+    for lon, lat, codes in iter_first_node_ways(pbf_file, blobs, _worker_runs):
+        countries = index.locate(lon, lat)
+        if not countries:
+            continue
+        located += len(codes)
+        for code in codes:
+            for country in countries:
+                count_way(stats[country], HIGHWAY_TYPES[code >> 1], code & 1)
+    return stats, located
+
+
+def collect_country_stats(pbf_file, index, workers=None, progress=None):
+    """
+    Count surface stats of the highway ways of pbf_file per country of
+    index (a CountryIndex), with `workers` processes (default: all cores).
+    progress(phase, done_ranges, total_ranges) is called after every range,
+    phase being 'ways' or 'nodes'.
+    Returns ({country name: stats}, way_count, highway_way_count, located),
+    located being the counted highway ways that fall into any country.
+    """
+    global _worker_index, _worker_runs
+    workers = max(1, workers or os.cpu_count() or 1)
+    blobs = scan_blobs(pbf_file)
+    way_blobs = find_way_blobs(pbf_file, blobs)
+    node_blobs = find_node_blobs(pbf_file, blobs)
+
+    runs = []
+    way_count = 0
+    highway_way_count = 0
+    for values, ways, highway_ways in run_blob_ranges(pbf_file, collect_way_refs, way_blobs, workers,
+                                                      'ways', progress):
+        if values:
+            runs.append(values)
+        way_count += ways
+        highway_way_count += highway_ways
+
+    stats = {name: {} for name in index.names}
+    located = 0
+    _worker_index, _worker_runs = index, runs
+    try:
+        for country_stats, count in run_blob_ranges(pbf_file, count_node_range, node_blobs, workers,
+                                                    'nodes', progress):
+            for i, part in enumerate(country_stats):
+                merge_stats(stats[index.names[i]], part)
+            located += count
+    finally:
+        _worker_index = _worker_runs = None
+    return stats, way_count, highway_way_count, located
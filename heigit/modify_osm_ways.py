@@ -2,30 +2,162 @@
 
 """
 Script to modify OSM PBF file and add surface tags to ways listed in ids.txt
-Usage: ./modify_osm_ways.py <input.pbf> <ids.txt>
+Usage: ./modify_osm_ways.py [--workers N] [--ways-only] [--delta] [--checkpoint] [--rules rules.json]
+                           [--stats-json stats.json] [-o output] <input.pbf> <ids.txt>
+       ./modify_osm_ways.py --changes <a.osc.gz> [--changes <b.osc.gz> ...] -o <output.pbf> <previous-modified.pbf> <ids.txt>
 Example: ./modify_osm_ways.py cyprus-latest.osm.pbf ids.txt
+         ./modify_osm_ways.py --workers 32 --ways-only planet-part1.osm.pbf ids.txt
+
+With --workers N > 1 the input is split into ranges of PBF blobs which are
+rewritten by N worker processes; the output keeps the original block order.
+
+With --ways-only only way blocks are decoded (by pbf_blocks, not osmium).
+Node and relation blobs are copied to the output as compressed bytes (in a
+Sort.Type_then_ID file without being decompressed, the way blocks are found
+by bisection), and way blocks without any surface change are copied
+unchanged as well.
 
 Format of ids.txt (each line: way_id surface_value):
 55678093 paved
 12345678 asphalt
 98765432 gravel
 
+With --changes the input is a previous -modified.osm.pbf and only the ways in
+the given replication diffs are re-run through the surface rules and the
+HeiGIT map before the diffs are applied. Every -modified.osm.pbf records the
+ids file and rules it was written with in <output>.rules.json; if they
+changed since (e.g. after the daily ids refresh), --changes refuses to run
+and the extract has to be rewritten in full.
+
+With --delta only the modified and inferred ways are written, as an osmChange
+file (<input>-surface.osc by default, gzipped if the name ends in .gz).
+
+With --checkpoint the rewrite records its progress in <output>.ckpt at block
+range boundaries (input offset, output size, counters). If the run dies, the
+same command continues from the last checkpoint instead of starting over.
+A checkpoint is ignored if the input, ids file, rules or --ways-only changed.
+
+With --stats-json FILE the surface coverage per highway class of the input
+and of the output (counted in the same pass, see surface_stats.py) is written
+to FILE, so the output does not have to be read again for statistics.
+
+With --metrics-port N per-rule counters, decode/rules/write times and live
+ways/s and MB/s are served for Prometheus at http://localhost:N/metrics
+(see surface_metrics.py for the scrape config).
+
+Surface inference rules (road classes, indicator and veto tags, smoothness,
+tracktype, tiger:cfcc) are read from surface_rules.json, see surface_rules.py.
+
+The ids file is compiled once into a memory-mapped binary index
+(<ids.txt>.idx, see surface_index.py) that is reused until the file changes.
+
 Requires: osmium library (install with: pip install osmium)
 """
 
 import sys
 import os
+import gzip
+import json
+import shutil
+import tempfile
+import argparse
+import multiprocessing
 import osmium
 import time
+from collections import deque
+from xml.sax.saxutils import quoteattr
+
+from pbf_blocks import (
+    GROUP_WAYS, PrimitiveBlock, scan_blobs, read_frame, split_ranges,
+    decode_frame, encode_frame, block_group_kinds, find_way_blobs
+)
+from surface_index import open_surface_index
+from surface_rules import SKIP, INFER, DEFAULT_RULES_FILE, load_rules
+from surface_metrics import PHASES, RewriteMetrics, start_metrics_server
+from surface_stats import highway_class, count_way, merge_stats
+
+
+# Counters reported by SurfaceUpdater (summed over workers in parallel mode)
+COUNTER_NAMES = ('way_count', 'modified_count', 'found_count', 'skipped_count', 'inferred_count')
+
+# Rule name for ways that got their surface from the HeiGIT list
+RULE_HEIGIT = 'heigit'
+
+# Number of blob ranges per worker: more ranges balance the load better,
+# fewer ranges mean less per-range startup overhead
+RANGES_PER_WORKER = 4
+
+# Target range size in --ways-only mode, where a range result is kept in memory
+WAYS_ONLY_RANGE_BYTES = 16 * 1024 * 1024
+
+# Minimum seconds between two checkpoints with --checkpoint (each one fsyncs the output)
+CHECKPOINT_INTERVAL = 60.0
+
+
+def format_osc_way(way_id, tags, refs, version=None, timestamp=None, changeset=None, uid=None, user=None):
+    """
+    Format one way as an osmChange <way> element.
+    timestamp is either epoch seconds or a datetime.
+    """
+    attrs = [f'id="{way_id}"']
+    if version:
+        attrs.append(f'version="{version}"')
+    if timestamp is not None:
+        if isinstance(timestamp, (int, float)):
+            timestamp = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+        else:
+            timestamp = timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')
+        attrs.append(f'timestamp="{timestamp}"')
+    if changeset:
+        attrs.append(f'changeset="{changeset}"')
+    if uid:
+        attrs.append(f'uid="{uid}"')
+    if user:
+        attrs.append(f'user={quoteattr(user)}')
+
+    lines = [f'    <way {" ".join(attrs)}>']
+    lines.extend(f'      <nd ref="{ref}"/>' for ref in refs)
+    lines.extend(f'      <tag k={quoteattr(k)} v={quoteattr(v)}/>' for k, v in tags.items())
+    lines.append('    </way>')
+    return '\n'.join(lines) + '\n'
+
+
+class OscWriter:
+    """
+    Writes modified ways as an osmChange file (.osc, or .osc.gz).
+    Takes osmium ways through add_way(), like osmium.SimpleWriter, and
+    already formatted <way> elements through add_fragment().
+    """
+
+    def __init__(self, filename):
+        opener = gzip.open if filename.endswith('.gz') else open
+        self.f = opener(filename, 'wt', encoding='utf-8')
+        self.f.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+        self.f.write('<osmChange version="0.6" generator="modify_osm_ways.py">\n')
+        self.f.write('  <modify>\n')
+
+    def add_way(self, w):
+        tags = w.tags if isinstance(w.tags, dict) else {tag.k: tag.v for tag in w.tags}
+        refs = [n if isinstance(n, int) else n.ref for n in w.nodes]
+        self.f.write(format_osc_way(w.id, tags, refs, w.version, w.timestamp, w.changeset, w.uid, w.user))
+
+    def add_fragment(self, text):
+        self.f.write(text)
+
+    def close(self):
+        self.f.write('  </modify>\n')
+        self.f.write('</osmChange>\n')
+        self.f.close()
 
 
 class SurfaceUpdater(osmium.SimpleHandler):
     """Handler to update surface tags for specified ways"""
 
-    def __init__(self, surface_map, writer):
+    def __init__(self, surface_map, writer, show_progress=True, rules=None, changed_only=False, metrics=None):
         super().__init__()
-        self.surface_map = surface_map  # Map of way_id -> surface_value
+        self.surface_map = surface_map  # SurfaceIndex (or dict) of way_id -> surface_value
         self.writer = writer
+        self.changed_only = changed_only  # Write only ways that get a surface (delta output)
         self.modified_count = 0
         self.found_count = 0
         self.skipped_count = 0  # Ways that already have surface tag
@@ -33,239 +165,627 @@ class SurfaceUpdater(osmium.SimpleHandler):
         self.way_count = 0
         self.last_progress_time = time.time()
         self.progress_interval = 5.0  # Print progress every 5 seconds
+        self.show_progress = show_progress
+
+        # Profiling: ways per fired rule and seconds per phase (decode/rules/write).
+        # In osmium passes, decode is the remaining time not spent in rules or write.
+        self.rule_counts = {}
+        self.phase_times = dict.fromkeys(PHASES, 0.0)
+        self.start_time = time.perf_counter()
+        self.metrics = metrics  # Optional RewriteMetrics for the /metrics endpoint
+
+        # Surface coverage per highway class before and after the rewrite
+        self.stats_original = {}
+        self.stats_modified = {}
 
-        # Highway types that indicate paved roads
-        self.paved_highway_types = {
-            'primary', 'trunk', 'secondary', 'tertiary', 'unclassified',
-            'residential', 'secondary_link', 'tertiary_link', 'living_street',
-            'service', 'pedestrian', 'busway', 'cycleway'
-        }
-
-        # Strong indicators: tag=value pairs that immediately indicate paved surface
-        # If any of these conditions are met, mark as paved without checking other tags
-        self.strong_paved_indicators = {
-            'lit': 'yes'
-        }
-
-        # Tags that indicate a well-maintained/paved road (just presence of tag)
-        self.indicator_tags = {
-            'maxspeed',           # Speed limits imply paved
-            'lanes',              # Lane markings require pavement
-            'turn:lanes',         # Turn lane markings
-            'placement',          # Lane placement info
-            'traffic_signals',    # Traffic lights
-            'traffic_calming',    # Speed bumps, etc.
-
-            'ref',                # Route numbers (US-101, I-5, etc.)
-            'int_ref',            # International references
-            'nat_ref',            # National references
-            'old_ref',
-            'name',
-            'source:name'
-
-            'sidewalk',           # Sidewalks alongside
-            'cycleway',           # Bike lanes
-            'parking:lane',       # Street parking
-            'shoulder',           # Paved shoulders
-            'shoulder:width',
-            'centre_turn_lane',   # Center turn lanes
-            'oneway',
-            'layer',
-
-            'lit',                # Street lighting
-            'operator',           # Maintained roads
-            'operator:wikidata',
-            'wikidata',
-            'expressway',
-
-            'bus',
-            'psv',
-            'hgv',
-            'public_transport',
-
-            'tiger:cfcc'
-        }
-
-        self.good_smoothness = {
-            'excellent', 'good', 'intermediate'
-        }
-
-        self.bad_smoothness = {
-            'bad', 'very_bad', 'horrible', 'very_horrible', 'impassable', 'rough', 'very_rough'
-        }
-
-        # Tracktype values that indicate unpaved surface
-        self.unpaved_tracktypes = {'grade2', 'grade3', 'grade4', 'grade5'}
-
-    def addPavedSurface(self, w):
+        # Compiled inference rules (surface_rules.json unless given)
+        self.rules = rules or load_rules()
+
+    def addSurface(self, w, surface):
         """
-        Add surface=paved tag to a way.
-        Returns the modified way with surface=paved tag added.
+        Add surface tag to an osmium way.
+        Returns the modified way with the surface tag added.
         """
         new_tags = {tag.k: tag.v for tag in w.tags}
-        new_tags['surface'] = 'paved'
+        new_tags['surface'] = surface
         return w.replace(tags=new_tags)
 
-    def updateSurfaceByTags(self, w, highway):
-        """
-        Check if a way should be marked as paved based on its tags.
-        Returns True if surface should be added, False otherwise.
-        Uses optimized direct tag access instead of iteration.
-        """
-        # Check if highway is one of the paved types
-        if highway not in self.paved_highway_types:
-            return False
-
-        # Check for explicit unpaved indicators
-        if w.tags.get('unpaved') == 'yes':
-            return False
-
-        # Check if tracktype indicates unpaved surface
-        tracktype = w.tags.get('tracktype')
-        if tracktype in self.unpaved_tracktypes:
-            return False
-
-        if highway == 'tertiary':
-            return True
-
-        tiger_cfcc = w.tags.get('tiger:cfcc')
-        if tiger_cfcc in ["A10","A11","A12","A13","A14","A15","A20","A30","A40","A41","A42","A50"]:
-            return True
-        # elif tiger:cfcc in ["A60","A61","A62","A70","A71","A72","A73","A74","A75","A76","A77","A78","A79"]:
-        #     return unpaved
-
-        for tag_name, required_value in self.strong_paved_indicators.items():
-            if w.tags.get(tag_name) == required_value:
-                return True
-
-        # Check if any regular indicator tags are present
-        has_indicator = any(tag in w.tags for tag in self.indicator_tags)
-        if not has_indicator:
-            return False
+    def counters(self):
+        """Return the processing counters, rule counts and phase times as a dict"""
+        counts = {name: getattr(self, name) for name in COUNTER_NAMES}
+        counts['rules'] = dict(self.rule_counts)
+        counts['phases'] = dict(self.phase_times)
+        counts['stats'] = {'original': self.stats_original, 'modified': self.stats_modified}
+        return counts
 
-        # All conditions met - should add surface=paved
-        return True
+    def finishOsmiumPass(self):
+        """Attribute the time not spent in rules or write to decode (osmium passes)"""
+        elapsed = time.perf_counter() - self.start_time
+        self.phase_times['decode'] = max(0.0, elapsed - self.phase_times['rules'] - self.phase_times['write'])
 
     def _print_progress(self, force=False):
-        """Print processing progress"""
+        """Print processing progress and publish live metrics"""
         current_time = time.time()
         if force or (current_time - self.last_progress_time) >= self.progress_interval:
-            print(f"  Processed: {self.way_count:,} ways, "
-                  f"| Modified: {self.modified_count:,} | Skipped: {self.skipped_count:,} | Inferred: {self.inferred_count:,}",
-                  end='\r', flush=True)
+            if self.show_progress:
+                print(f"  Processed: {self.way_count:,} ways, "
+                      f"| Modified: {self.modified_count:,} | Skipped: {self.skipped_count:,} | Inferred: {self.inferred_count:,}",
+                      end='\r', flush=True)
+            if self.metrics:
+                self.finishOsmiumPass()
+                # osmium does not report its read position, so no input bytes here
+                self.metrics.update(self.way_count, 0, self.rule_counts, self.phase_times)
             self.last_progress_time = current_time
 
-    def way(self, w):
-        """Process each way in the file - optimized with direct tag access"""
-        self.way_count += 1
-        way_id = w.id
+    def _count_rule(self, rule):
+        self.rule_counts[rule] = self.rule_counts.get(rule, 0) + 1
 
-        surface = w.tags.get('surface')
-        highway = w.tags.get('highway')
-        if surface or not highway:
-            self.writer.add_way(w)
-            self.skipped_count += 1
-            return
-        smoothness = w.tags.get('smoothness')
-        if smoothness in self.bad_smoothness:
-            self.writer.add_way(w)
+    def surfaceForWay(self, way_id, tags):
+        """
+        Decide which surface tag a way gets and update the counters and the
+        coverage stats.
+        tags can be an osmium TagList or a plain dict.
+        Returns the surface value to add, or None to keep the way unchanged.
+        """
+        self.way_count += 1
+        new_surface = self._decide_surface(way_id, tags)
+
+        highway_type = highway_class(tags.get('highway'))
+        if highway_type:
+            has_surface = 'surface' in tags
+            count_way(self.stats_original, highway_type, has_surface)
+            count_way(self.stats_modified, highway_type, has_surface or new_surface is not None)
+        return new_surface
+
+    def _decide_surface(self, way_id, tags):
+        """Apply the surface rules and the HeiGIT map to one way"""
+        action, rule = self.rules.classify(tags)
+        if action == SKIP:
             self.skipped_count += 1
-            return
-        if smoothness in self.good_smoothness:
-            modified_way = self.addPavedSurface(w)
-            self.writer.add_way(modified_way)
+            self._count_rule(rule)
+            return None
+        if action == INFER:
             self.inferred_count += 1
-            return
+            self._count_rule(rule)
+            return self.rules.paved_value
 
         # Check if this way needs to be modified
-        if way_id in self.surface_map:
+        new_surface = self.surface_map.get(way_id)
+        if new_surface is not None:
             self.found_count += 1
-            new_surface = self.surface_map[way_id]
+            self.modified_count += 1
+            self._count_rule(RULE_HEIGIT)
+            return new_surface
 
-            new_tags = {tag.k: tag.v for tag in w.tags}
-            new_tags['surface'] = new_surface
+        # Way not in surface_map - use the surface inferred from its tags, if any
+        if rule is not None:
+            self.inferred_count += 1
+            self._count_rule(rule)
+            return self.rules.paved_value
+        return None
 
-            # Create modified way
-            modified_way = w.replace(tags=new_tags)
-            self.writer.add_way(modified_way)
-            self.modified_count += 1
-            # else:
-            #     # Surface already exists, skip modification
-            #     # existing_surface = w.tags.get('surface')
-            #     # print(f"Skipping way https://www.openstreetmap.org/way/{way_id} already has surface='{existing_surface}'")
-            #     self.writer.add_way(w)
-            #     self.skipped_count += 1
-        else:
-            # Way not in surface_map but has highway tag - check if we can infer surface from tags
-            should_add_surface = self.updateSurfaceByTags(w, highway)
-            if should_add_surface:
-                # Add surface=paved tag
-                modified_way = self.addPavedSurface(w)
-                self.writer.add_way(modified_way)
-                self.inferred_count += 1
-            else:
-                # Copy way unchanged
+    def way(self, w):
+        """Process each way in the file - optimized with direct tag access"""
+        rules_start = time.perf_counter()
+        new_surface = self.surfaceForWay(w.id, w.tags)
+        write_start = time.perf_counter()
+        if new_surface is None:
+            # Copy way unchanged
+            if not self.changed_only:
                 self.writer.add_way(w)
+        else:
+            self.writer.add_way(self.addSurface(w, new_surface))
+        self.phase_times['rules'] += write_start - rules_start
+        self.phase_times['write'] += time.perf_counter() - write_start
 
         # Print progress every interval
         if self.way_count % 10000 == 0:
             self._print_progress()
 
     def node(self, n):
-        self.writer.add_node(n)
+        if not self.changed_only:
+            self.writer.add_node(n)
 
     def relation(self, r):
-        self.writer.add_relation(r)
+        if not self.changed_only:
+            self.writer.add_relation(r)
 
 def load_surface_map(ids_file):
     """
-    Load way IDs and surface values from file into a dictionary.
+    Load way IDs and surface values from file.
     Format: way_id surface_value (one per line)
-    Returns: dict mapping way_id (int) -> surface_value (str)
+    The file is compiled once into a binary index (<ids_file>.idx) that is
+    memory-mapped and rebuilt automatically when the text file changes.
+    Returns: SurfaceIndex mapping way_id (int) -> surface_value (str)
+    """
+    try:
+        return open_surface_index(ids_file)
+
+    except FileNotFoundError:
+        print(f"Error: File '{ids_file}' not found")
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error reading file '{ids_file}': {e}")
+        sys.exit(1)
+
+
+# ============================================================================
+# PARALLEL BLOCK PROCESSING
+# ============================================================================
+
+# Surface map for worker processes. Set right before the pool is forked,
+# so workers share it copy-on-write instead of receiving a pickled copy.
+_worker_surface_map = None
+_worker_rules = None
+
+
+def process_blob_range(task):
     """
-    surface_map = {}
+    Worker: rewrite one range of blobs with SurfaceUpdater.
+    The range is copied into a standalone PBF (header blob + data blobs),
+    processed by osmium, and the path of the rewritten range is returned.
+    """
+    range_index, input_pbf, header_blob, blobs, tmp_dir = task
+    range_input = os.path.join(tmp_dir, f"range-{range_index:06d}.osm.pbf")
+    range_output = os.path.join(tmp_dir, f"range-{range_index:06d}-modified.osm.pbf")
+
+    with open(input_pbf, 'rb') as src, open(range_input, 'wb') as dst:
+        dst.write(read_frame(src, header_blob))
+        for blob in blobs:
+            dst.write(read_frame(src, blob))
+
+    writer = osmium.SimpleWriter(range_output)
+    handler = SurfaceUpdater(_worker_surface_map, writer, show_progress=False, rules=_worker_rules)
+    handler.apply_file(range_input)
+    writer.close()
+    handler.finishOsmiumPass()
+    os.remove(range_input)
+
+    input_bytes = sum(blob.size for blob in blobs)
+    return range_output, handler.counters(), input_bytes
+
 
+def rewrite_way_blocks(task):
+    """
+    Worker for --ways-only mode: rewrite one range of blobs in memory.
+    Blocks without ways are returned as their original compressed frames,
+    way blocks are decoded, updated and re-encoded only if a way changed.
+    way_section is the byte range (start, end) of the way blocks of a
+    Sort.Type_then_ID file: frames outside it are copied without being
+    decompressed. Without it every block is decompressed to check for ways.
+    Returns the output frames of the range as one bytes object, or with
+    delta=True the changed ways as osmChange <way> elements.
+    """
+    input_pbf, blobs, delta, way_section = task
+    handler = SurfaceUpdater(_worker_surface_map, None, show_progress=False, rules=_worker_rules)
+    phases = handler.phase_times
+    out = []
+    with open(input_pbf, 'rb') as src:
+        for blob in blobs:
+            if way_section and not way_section[0] <= blob.offset < way_section[1]:
+                if not delta:
+                    out.append(read_frame(src, blob))
+                continue
+            decode_start = time.perf_counter()
+            frame = read_frame(src, blob)
+            block_data = decode_frame(frame)
+            if GROUP_WAYS not in block_group_kinds(block_data):
+                if not delta:
+                    out.append(frame)
+                phases['decode'] += time.perf_counter() - decode_start
+                continue
+
+            block = PrimitiveBlock(block_data)
+            strings = block.strings
+            ways = [(way, way.tags(strings)) for way in block.ways()]
+
+            rules_start = time.perf_counter()
+            changes = []
+            for way, tags in ways:
+                new_surface = handler.surfaceForWay(way.id, tags)
+                if new_surface is not None:
+                    changes.append((way, tags, new_surface))
+
+            write_start = time.perf_counter()
+            for way, tags, new_surface in changes:
+                if delta:
+                    tags['surface'] = new_surface
+                    info = way.info(strings, block.date_granularity)
+                    out.append(format_osc_way(way.id, tags, way.refs(), **info).encode('utf-8'))
+                else:
+                    block.set_tag(way, 'surface', new_surface)
+            if not delta:
+                out.append(encode_frame(block.encode()) if changes else frame)
+
+            write_end = time.perf_counter()
+            phases['decode'] += rules_start - decode_start
+            phases['rules'] += write_start - rules_start
+            phases['write'] += write_end - write_start
+
+    input_bytes = sum(blob.size for blob in blobs)
+    return b''.join(out), handler.counters(), input_bytes
+
+
+def append_data_blobs(range_output, out):
+    """Append all data blobs of a rewritten range (without its header blob) to out"""
+    blobs = scan_blobs(range_output)
+    if len(blobs) < 2:
+        return
+    with open(range_output, 'rb') as src:
+        src.seek(blobs[1].offset)
+        shutil.copyfileobj(src, out, 16 * 1024 * 1024)
+
+
+def empty_counters():
+    """Counters in the format of SurfaceUpdater.counters(), all zero"""
+    counts = dict.fromkeys(COUNTER_NAMES, 0)
+    counts['rules'] = {}
+    counts['phases'] = dict.fromkeys(PHASES, 0.0)
+    counts['stats'] = {'original': {}, 'modified': {}}
+    return counts
+
+
+def merge_counters(total, part):
+    """Add the counters returned by SurfaceUpdater.counters() of part to total"""
+    for name in COUNTER_NAMES:
+        total[name] += part[name]
+    for rule, count in part['rules'].items():
+        total['rules'][rule] = total['rules'].get(rule, 0) + count
+    for phase, seconds in part['phases'].items():
+        total['phases'][phase] += seconds
+    for version in ('original', 'modified'):
+        merge_stats(total['stats'][version], part['stats'][version])
+    return total
+
+
+# ============================================================================
+# CHECKPOINTS
+# ============================================================================
+
+def checkpoint_path(output_pbf):
+    """Path of the checkpoint file belonging to an output file"""
+    return output_pbf + '.ckpt'
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def run_fingerprint(input_pbf, ids_file, rules_file, ways_only):
+    """
+    Describe the inputs of a run. A checkpoint is only resumed by a run with
+    the same fingerprint, i.e. unchanged input, ids file, rules and mode.
+    """
+    fingerprint = {'ways_only': bool(ways_only), 'input': file_fingerprint(input_pbf)}
+    fingerprint.update(rules_fingerprint(ids_file, rules_file))
+    return fingerprint
+
+
+def rules_fingerprint(ids_file, rules_file):
+    """Describe the ids file and rules an output is written with"""
+    return {'ids': file_fingerprint(ids_file), 'rules': file_fingerprint(rules_file or DEFAULT_RULES_FILE)}
+
+
+def rules_fingerprint_path(output_pbf):
+    """Path of the file recording the ids file and rules of an output file"""
+    return output_pbf + '.rules.json'
+
+
+def save_rules_fingerprint(output_pbf, ids_file, rules_file):
+    """Record the ids file and rules output_pbf was written with, for later --changes runs"""
+    fingerprint_file = rules_fingerprint_path(output_pbf)
+    tmp_file = fingerprint_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(rules_fingerprint(ids_file, rules_file), f)
+    os.replace(tmp_file, fingerprint_file)
+
+
+def remove_rules_fingerprint(output_pbf):
+    fingerprint_file = rules_fingerprint_path(output_pbf)
+    if os.path.exists(fingerprint_file):
+        os.remove(fingerprint_file)
+
+
+def check_rules_fingerprint(previous_pbf, ids_file, rules_file):
+    """
+    Raise ValueError unless previous_pbf was written with the current ids
+    file and rules, i.e. updating it with changes equals a full rewrite.
+    """
+    fingerprint_file = rules_fingerprint_path(previous_pbf)
+    try:
+        with open(fingerprint_file, 'r') as f:
+            fingerprint = json.load(f)
+    except (OSError, ValueError):
+        raise ValueError(f"'{fingerprint_file}' is missing or unreadable, the ids file and rules "
+                         f"'{previous_pbf}' was written with are unknown; rewrite the full extract")
+    if fingerprint != rules_fingerprint(ids_file, rules_file):
+        raise ValueError(f"The ids file or rules changed since '{previous_pbf}' was written; "
+                         f"rewrite the full extract")
+
+
+def save_checkpoint(output_pbf, state):
+    """Atomically write the checkpoint state (JSON) next to the output"""
+    ckpt_file = checkpoint_path(output_pbf)
+    tmp_file = ckpt_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, ckpt_file)
+
+
+def load_checkpoint(output_pbf, fingerprint):
+    """
+    Return the checkpoint state for output_pbf if it can be resumed by a run
+    with this fingerprint, otherwise None.
+    """
+    ckpt_file = checkpoint_path(output_pbf)
+    if not os.path.exists(ckpt_file):
+        return None
     try:
-        with open(ids_file, 'r') as f:
-            line_num = 0
-            for line in f:
-                line_num += 1
-                line = line.strip()
+        with open(ckpt_file, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Ignoring unreadable checkpoint '{ckpt_file}': {e}")
+        return None
+
+    if state.get('fingerprint') != fingerprint:
+        print(f"Ignoring checkpoint '{ckpt_file}': input, ids file, rules or mode changed")
+        return None
+    if not os.path.exists(output_pbf) or os.path.getsize(output_pbf) < state['output_size']:
+        print(f"Ignoring checkpoint '{ckpt_file}': output file is missing or shorter than checkpointed")
+        return None
+    return state
+
+
+def remove_checkpoint(output_pbf):
+    ckpt_file = checkpoint_path(output_pbf)
+    if os.path.exists(ckpt_file):
+        os.remove(ckpt_file)
+
 
-                # Skip empty lines and comments
-                if not line or line.startswith('#'):
-                    continue
+def process_pbf_parallel(input_pbf, output_pbf, surface_map, workers, ways_only=False, rules=None, delta=False,
+                         metrics=None, fingerprint=None, resume=None, pool=None, show_progress=True):
+    """
+    Rewrite input_pbf into output_pbf using `workers` processes.
+    The data blobs are split into ranges, every range is rewritten by a worker,
+    and the results are appended to the output in the original block order.
+    With ways_only=True ranges are rewritten in memory by rewrite_way_blocks(),
+    otherwise every range goes through osmium and SurfaceUpdater.
+    With delta=True (implies ways_only) output_pbf is an osmChange file with
+    only the changed ways.
+    With a fingerprint (see run_fingerprint()) a checkpoint is written at
+    range boundaries every CHECKPOINT_INTERVAL seconds. resume is a state
+    returned by load_checkpoint(): the output is truncated to the checkpointed
+    size and the rewrite continues at the checkpointed input offset.
+    pool is an already running worker pool (see ModifierPool) whose workers
+    were forked with surface_map and rules; otherwise a pool is created.
+    Returns the summed counters of all workers.
+    """
+    global _worker_surface_map, _worker_rules
+
+    blobs = scan_blobs(input_pbf)
+    if not blobs or blobs[0].blob_type != 'OSMHeader':
+        raise ValueError(f"'{input_pbf}' does not start with an OSMHeader blob")
+    header_blob, data_blobs = blobs[0], blobs[1:]
+    total_bytes = sum(blob.size for blob in data_blobs)
+
+    counters = empty_counters()
+    processed_bytes = 0
+    if resume:
+        # Blobs before the checkpointed offset are already in the output
+        data_blobs = [blob for blob in data_blobs if blob.offset >= resume['next_offset']]
+        counters = resume['counters']
+        processed_bytes = resume['processed_bytes']
+        if show_progress:
+            print(f"  Resuming at {processed_bytes * 100 / total_bytes if total_bytes else 100.0:.1f}% "
+                  f"({len(data_blobs):,} blobs left)")
+
+    tmp_dir = None
+    ways_only = ways_only or delta
+    if ways_only:
+        remaining_bytes = sum(blob.size for blob in data_blobs)
+        parts = max(workers * RANGES_PER_WORKER, remaining_bytes // WAYS_ONLY_RANGE_BYTES)
+        ranges = split_ranges(data_blobs, parts)
+        # In a file sorted by type the way blocks are found by bisection,
+        # node and relation blocks are then never decompressed
+        way_section = None
+        way_blobs = find_way_blobs(input_pbf, blobs)
+        if len(way_blobs) < sum(blob.blob_type == 'OSMData' for blob in blobs):
+            way_section = ((way_blobs[0].offset, way_blobs[-1].offset + way_blobs[-1].size)
+                           if way_blobs else (0, 0))
+        tasks = [(input_pbf, blob_range, delta, way_section) for blob_range in ranges]
+        worker = rewrite_way_blocks
+    else:
+        ranges = split_ranges(data_blobs, workers * RANGES_PER_WORKER)
+        # Temporary range files live next to the output (same disk, no /tmp limits)
+        output_dir = os.path.dirname(os.path.abspath(output_pbf))
+        tmp_dir = tempfile.mkdtemp(prefix='.modify-osm-ways-', dir=output_dir)
+        tasks = [(i, input_pbf, header_blob, blob_range, tmp_dir) for i, blob_range in enumerate(ranges)]
+        worker = process_blob_range
+    if show_progress:
+        print(f"  Split {len(data_blobs):,} blobs into {len(ranges)} ranges for {workers} workers")
+
+    last_checkpoint = time.time()
+    own_pool = pool is None
+    if own_pool:
+        _worker_surface_map = surface_map
+        _worker_rules = rules
+    try:
+        if own_pool:
+            pool = multiprocessing.get_context('fork').Pool(workers)
+        with open(input_pbf, 'rb') as src:
+            if delta:
+                out = OscWriter(output_pbf)
+            elif resume:
+                # Drop anything written after the checkpoint
+                out = open(output_pbf, 'r+b')
+                out.truncate(resume['output_size'])
+                out.seek(resume['output_size'])
+            else:
+                out = open(output_pbf, 'wb')
+                # The input header is still valid: content and block order are unchanged
+                out.write(read_frame(src, header_blob))
+
+            # Keep a bounded window of ranges in flight, so finished results
+            # never pile up in memory while the output is being written
+            pending = deque()
+            next_task = 0
+            for done in range(1, len(tasks) + 1):
+                while next_task < len(tasks) and len(pending) < workers * 2:
+                    pending.append(pool.apply_async(worker, (tasks[next_task],)))
+                    next_task += 1
+                range_output, range_counters, input_bytes = pending.popleft().get()
+
+                if delta:
+                    out.add_fragment(range_output.decode('utf-8'))
+                elif ways_only:
+                    out.write(range_output)
+                else:
+                    append_data_blobs(range_output, out)
+                    os.remove(range_output)
+
+                merge_counters(counters, range_counters)
+                processed_bytes += input_bytes
+
+                # Checkpoint only between ranges, so the output always ends at a block boundary
+                if fingerprint and done < len(tasks) and time.time() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    out.flush()
+                    os.fsync(out.fileno())
+                    save_checkpoint(output_pbf, {
+                        'fingerprint': fingerprint,
+                        'next_offset': ranges[done][0].offset,
+                        'output_size': out.tell(),
+                        'processed_bytes': processed_bytes,
+                        'counters': counters,
+                    })
+                    last_checkpoint = time.time()
+                if metrics:
+                    metrics.update(counters['way_count'], processed_bytes, counters['rules'], counters['phases'])
+                if show_progress:
+                    percent = processed_bytes * 100 / total_bytes if total_bytes else 100.0
+                    print(f"  Ranges: {done}/{len(ranges)} ({percent:.1f}%) | Processed: {counters['way_count']:,} ways "
+                          f"| Modified: {counters['modified_count']:,} | Skipped: {counters['skipped_count']:,} "
+                          f"| Inferred: {counters['inferred_count']:,}",
+                          end='\r', flush=True)
+            out.close()
+    finally:
+        if own_pool:
+            if pool is not None:
+                pool.terminate()
+            _worker_surface_map = None
+            _worker_rules = None
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return counters
+
+
+class ModifierPool:
+    """
+    Worker pool that keeps the surface map and the rules loaded across many
+    rewrites, e.g. one per country in analyze_countries.py. The workers are
+    forked once with the memory-mapped surface index, so a rewrite costs no
+    interpreter, import or index startup. rewrite() may be called from
+    several threads at once, the ranges of all calls share the workers.
+    """
 
-                # Parse line: way_id surface_value
-                parts = line.split(None, 1)  # Split on whitespace, max 2 parts
+    def __init__(self, ids_file, workers, rules_file=None):
+        global _worker_surface_map, _worker_rules
+        self.ids_file = ids_file
+        self.rules_file = rules_file
+        self.surface_map = open_surface_index(ids_file)
+        self.rules = load_rules(rules_file)
+        self.workers = max(1, workers)
 
-                if len(parts) != 2:
-                    print(f"Warning: Invalid format on line {line_num}: '{line}'")
-                    print(f"         Expected format: way_id surface_value")
-                    continue
+        # Create the pool before any other threads are started by the caller
+        _worker_surface_map = self.surface_map
+        _worker_rules = self.rules
+        self.pool = multiprocessing.get_context('fork').Pool(self.workers)
 
-                try:
-                    way_id = int(parts[0])
-                    surface_value = parts[1].strip()
+    def rewrite(self, input_pbf, output_pbf, ways_only=True, show_progress=False):
+        """Rewrite input_pbf into output_pbf, returns the counters (see process_pbf_parallel())"""
+        return process_pbf_parallel(input_pbf, output_pbf, self.surface_map, self.workers, ways_only, self.rules,
+                                    pool=self.pool, show_progress=show_progress)
 
-                    if not surface_value:
-                        print(f"Warning: Empty surface value on line {line_num}")
-                        continue
+    def close(self):
+        global _worker_surface_map, _worker_rules
+        self.pool.terminate()
+        self.pool.join()
+        _worker_surface_map = None
+        _worker_rules = None
 
-                    surface_map[way_id] = surface_value
+    def __enter__(self):
+        return self
 
-                except ValueError:
-                    print(f"Warning: Invalid way ID on line {line_num}: '{parts[0]}'")
-                    continue
+    def __exit__(self, *exc_info):
+        self.close()
 
-        return surface_map
 
-    except FileNotFoundError:
-        print(f"Error: File '{ids_file}' not found")
-        sys.exit(1)
-    except Exception as e:
-        print(f"Error reading file '{ids_file}': {e}")
-        sys.exit(1)
+# ============================================================================
+# INCREMENTAL UPDATE FROM CHANGE FILES
+# ============================================================================
+
+def apply_changes(previous_pbf, change_files, output_pbf, surface_map, ids_file, rules=None, rules_file=None):
+    """
+    Update a previous -modified.osm.pbf with OSM change files (.osc/.osc.gz).
+    Only the ways contained in the changes go through the surface rules and
+    the HeiGIT map; everything else is taken from the previous output, which
+    already has the rules applied. The result matches a full rewrite of the
+    updated extract as long as the ids file and the rules are unchanged, so
+    previous_pbf must have been written with the current ones (ValueError
+    otherwise, see check_rules_fingerprint()).
+    Returns the counters for the changed ways.
+    """
+    check_rules_fingerprint(previous_pbf, ids_file, rules_file)
+    output_dir = os.path.dirname(os.path.abspath(output_pbf))
+    tmp_dir = tempfile.mkdtemp(prefix='.modify-osm-ways-', dir=output_dir)
+    rewritten_changes = os.path.join(tmp_dir, 'changes-modified.osc')
+    try:
+        # Merge all change files (latest version of every object wins) and
+        # run the surface logic over the changed ways only
+        merger = osmium.MergeInputReader()
+        for change_file in change_files:
+            merger.add_file(change_file)
+        change_writer = osmium.SimpleWriter(rewritten_changes)
+        handler = SurfaceUpdater(surface_map, change_writer, rules=rules)
+        merger.apply(handler, simplify=True)
+        change_writer.close()
+        handler.finishOsmiumPass()
+        handler._print_progress(force=True)
+        print()
+
+        # Apply the rewritten changes on top of the previous output
+        print(f"  Applying changes to {previous_pbf}...")
+        merger = osmium.MergeInputReader()
+        merger.add_file(rewritten_changes)
+        reader = osmium.io.Reader(previous_pbf)
+        writer = osmium.io.Writer(output_pbf, reader.header())
+        merger.apply_to_reader(reader, writer, False)
+        writer.close()
+        reader.close()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return handler.counters()
+
+
+def write_stats_json(stats_file, input_pbf, output_pbf, counts):
+    """
+    Write the coverage stats counted during the rewrite as JSON:
+    {'input': ..., 'output': ..., 'original': stats, 'modified': stats}
+    with stats in the format of surface_stats.py.
+    """
+    tmp_file = stats_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump({
+            'input': input_pbf,
+            'output': output_pbf,
+            'original': counts['stats']['original'],
+            'modified': counts['stats']['modified'],
+        }, f, indent=2)
+    os.replace(tmp_file, stats_file)
 
 
 def format_time(seconds):
@@ -293,17 +813,72 @@ def main():
     total_start_time = time.time()
 
     # Check arguments
-    if len(sys.argv) != 3:
-        print("Usage: ./modify_osm_ways.py <input.pbf> <ids.txt>")
-        print("Example: ./modify_osm_ways.py cyprus-latest.osm.pbf ids.txt")
-        print()
-        print("Format of ids.txt (each line: way_id surface_value):")
-        print("  55678093 paved")
-        print("  12345678 asphalt")
+    parser = argparse.ArgumentParser(
+        description='Add surface tags to ways of an OSM PBF file',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Example: ./modify_osm_ways.py cyprus-latest.osm.pbf ids.txt
+
+Format of ids.txt (each line: way_id surface_value):
+  55678093 paved
+  12345678 asphalt
+        """)
+    parser.add_argument('input_pbf', help='Input .osm.pbf file')
+    parser.add_argument('ids_file', help='File with "way_id surface_value" lines')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes (default: 1, single osmium pass)')
+    parser.add_argument('--ways-only', action='store_true',
+                        help='Decode only way blocks, copy node and relation blobs unchanged')
+    parser.add_argument('--rules', default=None,
+                        help='Surface inference rules JSON (default: surface_rules.json next to this script)')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Output file (default: <input>-modified.osm.pbf, or <input>-surface.osc with --delta)')
+    parser.add_argument('--delta', action='store_true',
+                        help='Write only the modified and inferred ways as an osmChange file')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Serve live Prometheus metrics on this port at /metrics during the run')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='Write checkpoints while rewriting and resume from <output>.ckpt if it exists')
+    parser.add_argument('--stats-json', default=None, metavar='FILE',
+                        help='Write surface coverage per highway class before and after the rewrite to FILE')
+    parser.add_argument('--changes', action='append', default=None, metavar='OSC',
+                        help='Update a previous -modified.osm.pbf (the input) with this change file '
+                             '(repeat for several files)')
+    args = parser.parse_args()
+
+    input_pbf = args.input_pbf
+    ids_file = args.ids_file
+    workers = max(1, args.workers)
+    ways_only = args.ways_only
+    change_files = args.changes
+    delta = args.delta
+
+    if delta and change_files:
+        print("Error: --delta cannot be combined with --changes")
+        sys.exit(1)
+
+    if args.checkpoint and (change_files or delta):
+        print("Error: --checkpoint cannot be combined with --changes or --delta")
+        sys.exit(1)
+
+    if args.stats_json and change_files:
+        print("Error: --stats-json cannot be combined with --changes (only changed ways are read)")
         sys.exit(1)
 
-    input_pbf = sys.argv[1]
-    ids_file = sys.argv[2]
+    if change_files:
+        if not args.output:
+            print("Error: --output is required with --changes")
+            sys.exit(1)
+        for change_file in change_files:
+            if not os.path.isfile(change_file):
+                print(f"Error: Change file '{change_file}' not found")
+                sys.exit(1)
+
+    try:
+        rules = load_rules(args.rules)
+    except Exception as e:
+        print(f"Error loading surface rules: {e}")
+        sys.exit(1)
 
     # Check if input file exists
     if not os.path.isfile(input_pbf):
@@ -314,18 +889,48 @@ def main():
     input_size_mb = get_file_size_mb(input_pbf)
 
     # Generate output filename
-    if input_pbf.endswith('.osm.pbf'):
+    if args.output:
+        output_pbf = args.output
+    elif delta:
+        base = input_pbf[:-8] if input_pbf.endswith('.osm.pbf') else os.path.splitext(input_pbf)[0]
+        output_pbf = base + '-surface.osc'
+    elif input_pbf.endswith('.osm.pbf'):
         output_pbf = input_pbf[:-8] + '-modified.osm.pbf'
     elif input_pbf.endswith('.pbf'):
         output_pbf = input_pbf[:-4] + '-modified.osm.pbf'
     else:
         output_pbf = input_pbf + '-modified.osm.pbf'
 
+    if os.path.abspath(output_pbf) == os.path.abspath(input_pbf):
+        print(f"Error: Output file must differ from the input file")
+        sys.exit(1)
+
+    # Resume from a checkpoint of an interrupted run with the same inputs
+    fingerprint = None
+    resume = None
+    if args.checkpoint:
+        fingerprint = run_fingerprint(input_pbf, ids_file, args.rules, ways_only)
+        resume = load_checkpoint(output_pbf, fingerprint)
+        if resume:
+            print(f"Resuming from checkpoint: {checkpoint_path(output_pbf)}")
+            print()
+        else:
+            remove_checkpoint(output_pbf)
+
+    # Only an output written with the current ids file and rules can be updated with changes
+    if change_files:
+        try:
+            check_rules_fingerprint(input_pbf, ids_file, args.rules)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+
     # Remove existing output file if it exists
-    if os.path.exists(output_pbf):
+    if os.path.exists(output_pbf) and not resume:
         print(f"Removing existing output file: {output_pbf}")
         os.remove(output_pbf)
         print()
+    remove_rules_fingerprint(output_pbf)
 
     print("=" * 70)
     print("OSM Ways Surface Modifier")
@@ -349,26 +954,61 @@ def main():
     print("Step 2/3: Processing PBF file and updating surfaces...")
     print(f"Input:  {input_pbf} ({input_size_mb:.2f} MB)")
     print(f"Output: {output_pbf}")
+    if change_files:
+        print(f"Changes: {', '.join(change_files)}")
+    if delta:
+        print("Mode: delta (only modified and inferred ways are written)")
+    if not change_files and (workers > 1 or ways_only or args.checkpoint):
+        print(f"Workers: {workers}{' (ways-only)' if ways_only else ''}")
     print()
 
+    metrics = None
+    if args.metrics_port:
+        metrics = RewriteMetrics(os.path.basename(input_pbf), os.path.getsize(input_pbf))
+        start_metrics_server(metrics, args.metrics_port)
+        print(f"Metrics: http://localhost:{args.metrics_port}/metrics")
+        print()
+
     step2_start = time.time()
 
     try:
-        # Create writer for output file
-        writer = osmium.SimpleWriter(output_pbf)
+        if change_files:
+            counts = apply_changes(input_pbf, change_files, output_pbf, surface_map, ids_file, rules, args.rules)
+        elif workers > 1 or ways_only or args.checkpoint:
+            # Checkpoints need range boundaries, so --checkpoint always uses ranges
+            counts = process_pbf_parallel(input_pbf, output_pbf, surface_map, workers, ways_only, rules, delta,
+                                          metrics, fingerprint, resume)
+            print()  # New line after progress
+            if args.checkpoint:
+                remove_checkpoint(output_pbf)
+        else:
+            # Create writer for output file
+            writer = OscWriter(output_pbf) if delta else osmium.SimpleWriter(output_pbf)
 
-        # Create handler with surface map and writer
-        handler = SurfaceUpdater(surface_map, writer)
+            # Create handler with surface map and writer
+            handler = SurfaceUpdater(surface_map, writer, rules=rules, changed_only=delta, metrics=metrics)
 
-        # Process input file in one pass
-        handler.apply_file(input_pbf, locations=True)
+            # Process input file in one pass (no node location index needed,
+            # the surface logic only looks at way tags)
+            handler.apply_file(input_pbf)
 
-        # Print final progress
-        handler._print_progress(force=True)
-        print()  # New line after progress
+            # Print final progress
+            handler._print_progress(force=True)
+            print()  # New line after progress
 
-        # Close writer
-        writer.close()
+            # Close writer
+            writer.close()
+            handler.finishOsmiumPass()
+            counts = handler.counters()
+
+        if metrics:
+            metrics.update(counts['way_count'], os.path.getsize(input_pbf), counts['rules'], counts['phases'])
+            metrics.finish()
+
+        if args.stats_json:
+            write_stats_json(args.stats_json, input_pbf, output_pbf, counts)
+        if not delta:
+            save_rules_fingerprint(output_pbf, ids_file, args.rules)
 
         step2_time = time.time() - step2_start
         print(f"✓ Processing complete (took {format_time(step2_time)})")
@@ -383,19 +1023,25 @@ def main():
         step3_time = time.time() - step3_start
 
         print(f"Total elements processed:")
-        print(f"  Ways:      {handler.way_count:>15,}")
+        print(f"  Ways:      {counts['way_count']:>15,}{' (changed ways only)' if change_files else ''}")
         print()
         print(f"Modification results:")
-        print(f"  Ways modified (added surface from list):     {handler.modified_count:>10,}")
-        print(f"  Ways inferred (added surface from tags):     {handler.inferred_count:>10,}")
-        print(f"  Ways skipped (already have surface):         {handler.skipped_count:>10,}")
-        print(f"  Ways found from list:                        {handler.found_count:>10,}")
-        print(f"  Ways not found in PBF:                       {len(surface_map) - handler.found_count:>10,}")
-
-        if handler.found_count < len(surface_map):
+        print(f"  Ways modified (added surface from list):     {counts['modified_count']:>10,}")
+        print(f"  Ways inferred (added surface from tags):     {counts['inferred_count']:>10,}")
+        print(f"  Ways skipped (already have surface):         {counts['skipped_count']:>10,}")
+        print(f"  Ways found from list:                        {counts['found_count']:>10,}")
+        if not change_files:
+            print(f"  Ways not found in PBF:                       {len(surface_map) - counts['found_count']:>10,}")
+
+        if not change_files and counts['found_count'] < len(surface_map):
             print()
             print("  Note: Some way IDs from the input file were not found in the PBF.")
 
+        print()
+        print(f"Rules fired:")
+        for rule, count in sorted(counts['rules'].items(), key=lambda item: -item[1]):
+            print(f"  {rule:<44} {count:>10,}")
+
         print()
         print(f"File sizes:")
         print(f"  Input:  {input_size_mb:>10.2f} MB")
@@ -414,14 +1060,27 @@ def main():
         if step2_time > 0:
             throughput_mb_s = input_size_mb / step2_time
             print(f"  Throughput:            {throughput_mb_s:>10.2f} MB/s")
+            print(f"  Ways/s:                {counts['way_count'] / step2_time:>10,.0f}")
+
+        # Phase split (summed over all workers, so it can exceed wall time)
+        phase_total = sum(counts['phases'].values())
+        if phase_total > 0:
+            print("Phases (CPU time across workers):")
+            for phase in PHASES:
+                seconds = counts['phases'][phase]
+                print(f"  {phase.capitalize():<22} {format_time(seconds):>10} ({seconds * 100 / phase_total:.0f}%)")
 
         print()
         print("=" * 70)
         print(f"✓ Success! Output file: {output_pbf}")
         print("=" * 70)
         print()
-        print("To verify the changes, run:")
-        print(f"  osmium getid {output_pbf} w<WAY_ID> -f osm | grep '<tag'")
+        if delta:
+            print("To apply the changes, run:")
+            print(f"  osmium apply-changes {input_pbf} {output_pbf} -o <output.osm.pbf>")
+        else:
+            print("To verify the changes, run:")
+            print(f"  ./block_index.py get {output_pbf} w<WAY_ID>")
 
     except Exception as e:
         print(f"\n✗ Error processing PBF file: {e}")
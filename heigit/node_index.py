@@ -0,0 +1,202 @@
+"""
+Compact, memory-mapped node ID -> location index of a PBF file, for way lengths.
+
+The node blocks of a PBF are compiled once into a binary index next to it
+(<pbf_file>.nodes):
+
+  header   magic, node count, size and mtime of the source PBF
+  ids      sorted int64 node IDs
+  coords   int32 lon, lat pairs in 1e-7 degrees (OSM precision)
+
+The index costs 16 bytes per node on disk and nothing but page cache in
+memory, so it scales to planet files; its pages are shared between forked
+worker processes. It is reused across runs until the PBF's size or mtime
+change. Building it needs a file sorted by node ID, as all Geofabrik
+extracts are (see pbf_blocks.find_node_blobs()).
+"""
+
+import math
+import mmap
+import multiprocessing
+import os
+import shutil
+import struct
+from array import array
+from bisect import bisect_left
+
+from pbf_blocks import find_node_blobs, split_ranges, read_frame, decode_frame, iter_node_locations
+
+
+INDEX_MAGIC = b'NODIDX01'
+# magic, count, source size, source mtime_ns
+HEADER_FORMAT = '<8sQQq'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Blob ranges per worker while building
+RANGES_PER_WORKER = 4
+
+EARTH_RADIUS_KM = 6371.0088
+_E7_TO_RADIANS = math.pi / 180 / 1e7
+
+
+def index_path(pbf_file):
+    """Path of the node location index belonging to a PBF file"""
+    return pbf_file + '.nodes'
+
+
+def decode_node_range(task):
+    """Worker: (ids, interleaved lon/lat coords) of the nodes of a range of blobs"""
+    pbf_file, blobs = task
+    ids = array('q')
+    coords = array('i')
+    with open(pbf_file, 'rb') as f:
+        for blob in blobs:
+            for node_ids, lons, lats in iter_node_locations(decode_frame(read_frame(f, blob))):
+                ids.extend(node_ids)
+                for lon, lat in zip(lons, lats):
+                    coords.append(round(lon * 1e7))
+                    coords.append(round(lat * 1e7))
+    return ids, coords
+
+
+def build_node_index(pbf_file, output_file=None, workers=None, progress=None):
+    """
+    Compile the node locations of pbf_file into a binary index, decoding
+    node blobs with `workers` processes (default: all cores).
+    progress(done_ranges, total_ranges) is called after every range.
+    Returns the number of nodes written.
+    Raises ValueError if the nodes are not sorted by ID.
+    """
+    output_file = output_file or index_path(pbf_file)
+    workers = max(1, workers or os.cpu_count() or 1)
+    source = os.stat(pbf_file)
+    tasks = [(pbf_file, blob_range)
+             for blob_range in split_ranges(find_node_blobs(pbf_file), workers * RANGES_PER_WORKER)]
+
+    # Write to a temporary name first, so readers never see a partial index.
+    # IDs go straight into it, coordinates are appended after the last ID.
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    coords_file = tmp_file + '.coords'
+    count = 0
+    last_id = None
+    try:
+        with open(tmp_file, 'w+b') as out, open(coords_file, 'w+b') as coords_out:
+            out.write(b'\0' * HEADER_SIZE)
+
+            def add(done, result):
+                nonlocal count, last_id
+                ids, coords = result
+                if ids:
+                    if (last_id is not None and ids[0] <= last_id) or \
+                            any(a >= b for a, b in zip(ids, ids[1:])):
+                        raise ValueError(f"Nodes of '{pbf_file}' are not sorted by ID (run osmium sort first)")
+                    last_id = ids[-1]
+                    ids.tofile(out)
+                    coords.tofile(coords_out)
+                    count += len(ids)
+                if progress:
+                    progress(done, len(tasks))
+
+            if workers == 1 or len(tasks) <= 1:
+                for done, task in enumerate(tasks, 1):
+                    add(done, decode_node_range(task))
+            else:
+                with multiprocessing.get_context('fork').Pool(min(workers, len(tasks))) as pool:
+                    # Ordered, so the IDs stay sorted across ranges
+                    for done, result in enumerate(pool.imap(decode_node_range, tasks), 1):
+                        add(done, result)
+
+            coords_out.seek(0)
+            shutil.copyfileobj(coords_out, out, 16 * 1024 * 1024)
+            out.seek(0)
+            out.write(struct.pack(HEADER_FORMAT, INDEX_MAGIC, count, source.st_size, source.st_mtime_ns))
+        os.replace(tmp_file, output_file)
+    finally:
+        for path in (tmp_file, coords_file):
+            if os.path.exists(path):
+                os.remove(path)
+    return count
+
+
+def is_index_current(pbf_file, index_file=None):
+    """Check that the index exists and was built from the current PBF file"""
+    index_file = index_file or index_path(pbf_file)
+    try:
+        with open(index_file, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+    except FileNotFoundError:
+        return False
+    if len(header) != HEADER_SIZE:
+        return False
+    magic, _, source_size, source_mtime_ns = struct.unpack(HEADER_FORMAT, header)
+    source = os.stat(pbf_file)
+    return (magic == INDEX_MAGIC and source_size == source.st_size
+            and source_mtime_ns == source.st_mtime_ns)
+
+
+class NodeLocationIndex:
+    """
+    Read-only, memory-mapped node ID -> location mapping.
+    Lookups are binary searches over the sorted ID array.
+    """
+
+    def __init__(self, index_file):
+        with open(index_file, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, _, _ = struct.unpack_from(HEADER_FORMAT, self._mmap)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"'{index_file}' is not a node location index")
+
+        coords_offset = HEADER_SIZE + count * 8
+        view = memoryview(self._mmap)
+        self._ids = view[HEADER_SIZE:coords_offset].cast('q')
+        self._coords = view[coords_offset:coords_offset + count * 8].cast('i')
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def location(self, node_id):
+        """(lon, lat) of a node in 1e-7 degrees, or None if it is not in the file"""
+        pos = bisect_left(self._ids, node_id)
+        if pos < self._count and self._ids[pos] == node_id:
+            return self._coords[2 * pos], self._coords[2 * pos + 1]
+        return None
+
+    def way_length(self, refs):
+        """
+        Length in km of a way with these node refs (haversine).
+        Segments with a node missing from the file (cut at the extract
+        border) are left out.
+        """
+        length = 0.0
+        previous = None
+        for ref in refs:
+            location = self.location(ref)
+            if location is not None and previous is not None:
+                lon1, lat1 = previous[0] * _E7_TO_RADIANS, previous[1] * _E7_TO_RADIANS
+                lon2, lat2 = location[0] * _E7_TO_RADIANS, location[1] * _E7_TO_RADIANS
+                a = (math.sin((lat2 - lat1) / 2) ** 2
+                     + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+                length += 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+            previous = location
+        return length
+
+
+def ensure_node_index(pbf_file, workers=None):
+    """
+    Return the path of the node location index of a PBF file, (re)building
+    it first if it is missing or older than the file.
+    """
+    index_file = index_path(pbf_file)
+    if not is_index_current(pbf_file, index_file):
+        print(f"  Building node location index: {index_file}")
+        count = build_node_index(pbf_file, index_file, workers)
+        print(f"  Indexed {count:,} node locations")
+    return index_file
+
+
+def open_node_index(pbf_file, workers=None):
+    """Open the node location index of a PBF file (see ensure_node_index())"""
+    return NodeLocationIndex(ensure_node_index(pbf_file, workers))
@@ -0,0 +1,929 @@
+"""
+Low-level helpers for reading and writing OSM PBF files blob by blob.
+
+A PBF file is a plain sequence of framed blobs:
+  4-byte big-endian header length | BlobHeader (protobuf) | Blob (protobuf)
+The first blob is the OSMHeader, every following one is an OSMData block.
+
+These helpers only understand that framing, so blobs can be located, split
+into byte ranges and copied around without decompressing them.
+
+PrimitiveBlock decodes only what the surface tools need from a data block:
+the string table and the ways. Node, relation and changeset groups are kept
+as raw bytes, and unchanged ways are re-emitted byte for byte.
+iter_node_locations() reads only node IDs and coordinates, for tools that
+need to place ways on the map. find_frame_at() locates the frame around any
+byte offset without reading the file up to it, for sampling.
+"""
+
+import lzma
+import os
+import struct
+import zlib
+from collections import namedtuple
+from itertools import accumulate
+
+
+# Protobuf wire types
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH = 2
+WIRE_FIXED32 = 5
+
+# PrimitiveGroup field numbers
+GROUP_NODES = 1
+GROUP_DENSE = 2
+GROUP_WAYS = 3
+GROUP_RELATIONS = 4
+GROUP_CHANGESETS = 5
+
+# Largest uncompressed block allowed by the PBF specification
+MAX_BLOCK_SIZE = 32 * 1024 * 1024
+# Largest BlobHeader allowed by the PBF specification
+MAX_HEADER_SIZE = 64 * 1024
+
+# offset: start of the frame in the file, size: full frame size in bytes
+BlobInfo = namedtuple('BlobInfo', ['offset', 'size', 'blob_type'])
+
+
+def read_varint(buf, pos):
+    """Decode one protobuf varint from buf at pos. Returns (value, new_pos)"""
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_varint(value):
+    """Encode a non-negative int as protobuf varint bytes"""
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encode_field(field_number, value):
+    """Encode a length-delimited protobuf field"""
+    return encode_varint(field_number << 3 | WIRE_LENGTH) + encode_varint(len(value)) + value
+
+
+def encode_varint_field(field_number, value):
+    """Encode a varint protobuf field (value must be non-negative)"""
+    return encode_varint(field_number << 3 | WIRE_VARINT) + encode_varint(value)
+
+
+def decode_packed(buf):
+    """Decode a packed repeated varint field into a list of ints"""
+    values = []
+    append = values.append
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        b = buf[pos]
+        if b < 0x80:
+            # Single-byte varint (most string indices and ref deltas)
+            append(b)
+            pos += 1
+        else:
+            value, pos = read_varint(buf, pos)
+            append(value)
+    return values
+
+
+def encode_packed(values):
+    """Encode a list of non-negative ints as packed varint payload"""
+    return b''.join(encode_varint(v) for v in values)
+
+
+def zigzag_decode(value):
+    """Decode a zigzag-encoded sint64"""
+    return (value >> 1) ^ -(value & 1)
+
+
+def iter_fields(buf):
+    """
+    Iterate over the top-level fields of a protobuf message.
+    Yields (field_number, wire_type, value) where value is an int for
+    varint/fixed fields and a slice of buf for length-delimited fields.
+    """
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field_number = key >> 3
+        wire_type = key & 0x07
+        if wire_type == WIRE_VARINT:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == WIRE_LENGTH:
+            length, pos = read_varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == WIRE_FIXED64:
+            value = int.from_bytes(buf[pos:pos + 8], 'little')
+            pos += 8
+        elif wire_type == WIRE_FIXED32:
+            value = int.from_bytes(buf[pos:pos + 4], 'little')
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield field_number, wire_type, value
+
+
+def iter_field_spans(buf):
+    """
+    Like iter_fields(), but also yields the (start, end) span of every
+    encoded field so it can be copied unchanged.
+    Yields (field_number, wire_type, value, start, end).
+    """
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        start = pos
+        key, pos = read_varint(buf, pos)
+        field_number = key >> 3
+        wire_type = key & 0x07
+        if wire_type == WIRE_VARINT:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == WIRE_LENGTH:
+            length, pos = read_varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == WIRE_FIXED64:
+            value = int.from_bytes(buf[pos:pos + 8], 'little')
+            pos += 8
+        elif wire_type == WIRE_FIXED32:
+            value = int.from_bytes(buf[pos:pos + 4], 'little')
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield field_number, wire_type, value, start, pos
+
+
+def parse_blob_header(data):
+    """Parse a BlobHeader message. Returns (blob_type, datasize)"""
+    blob_type = None
+    datasize = None
+    for field_number, wire_type, value in iter_fields(data):
+        if field_number == 1 and wire_type == WIRE_LENGTH:
+            blob_type = bytes(value).decode('utf-8')
+        elif field_number == 3 and wire_type == WIRE_VARINT:
+            datasize = value
+    if blob_type is None or datasize is None:
+        raise ValueError("Invalid BlobHeader: missing type or datasize")
+    return blob_type, datasize
+
+
+def read_blob_info(f, offset):
+    """
+    Read the frame header at the given offset.
+    Returns BlobInfo, or None at end of file.
+    """
+    f.seek(offset)
+    prefix = f.read(4)
+    if not prefix:
+        return None
+    if len(prefix) != 4:
+        raise ValueError(f"Truncated blob frame at offset {offset}")
+    header_size = struct.unpack('>I', prefix)[0]
+    if header_size > MAX_HEADER_SIZE:
+        raise ValueError(f"BlobHeader of {header_size:,} bytes at offset {offset}")
+    header = f.read(header_size)
+    if len(header) != header_size:
+        raise ValueError(f"Truncated BlobHeader at offset {offset}")
+    blob_type, datasize = parse_blob_header(header)
+    return BlobInfo(offset, 4 + header_size + datasize, blob_type)
+
+
+def scan_blobs(pbf_file):
+    """
+    List all blobs of a PBF file by reading only the frame headers.
+    Blob data is skipped with seek(), so this is fast even for planet files.
+    """
+    blobs = []
+    with open(pbf_file, 'rb') as f:
+        offset = 0
+        while True:
+            info = read_blob_info(f, offset)
+            if info is None:
+                break
+            blobs.append(info)
+            offset += info.size
+    return blobs
+
+
+# BlobHeader type fields a frame starts with (after the 4 byte length)
+_FRAME_SIGNATURES = (b'\x0a\x07OSMData', b'\x0a\x09OSMHeader')
+# Bytes read per step of the backward search
+_SEARCH_WINDOW = 1024 * 1024
+
+
+def _valid_frame(f, offset, file_size):
+    """BlobInfo of a frame at offset whose successor frame parses as well, or None"""
+    def frame(position):
+        info = read_blob_info(f, position)
+        if info is None or info.blob_type not in ('OSMData', 'OSMHeader') or position + info.size > file_size:
+            return None
+        return info
+
+    try:
+        info = frame(offset)
+        if info is None:
+            return None
+        end = offset + info.size
+        if end < file_size and frame(end) is None:
+            return None
+        return info
+    except (ValueError, IndexError):
+        return None
+
+
+def find_frame_at(f, offset, file_size=None):
+    """
+    BlobInfo of the frame containing byte `offset` of an open PBF file,
+    found by searching backwards from it for a BlobHeader, without reading
+    the frames before it. A match inside compressed data is rejected unless
+    its frame reaches past offset and is followed by another valid frame.
+    """
+    if file_size is None:
+        file_size = os.fstat(f.fileno()).st_size
+    if not 0 <= offset < file_size:
+        raise ValueError(f"Offset {offset} outside the file")
+    # Candidate frame starts up to offset; the signature follows the length prefix
+    end = offset + 4 + max(len(signature) for signature in _FRAME_SIGNATURES)
+    lowest = max(0, offset - MAX_BLOCK_SIZE - 64 * 1024)
+    while end > lowest:
+        start = max(lowest, end - _SEARCH_WINDOW)
+        f.seek(start)
+        window = f.read(end - start)
+        candidates = sorted({start + pos - 4
+                             for signature in _FRAME_SIGNATURES
+                             for pos in _find_all(window, signature)
+                             if start + pos - 4 >= 0 and start + pos - 4 <= offset}, reverse=True)
+        for frame_offset in candidates:
+            info = _valid_frame(f, frame_offset, file_size)
+            if info is not None and frame_offset + info.size > offset:
+                return info
+        # Overlap by a signature, so one cut by the window border is found
+        end = start + 16
+        if start == lowest:
+            break
+    raise ValueError(f"No blob frame found around offset {offset}")
+
+
+def _find_all(data, pattern):
+    pos = data.find(pattern)
+    while pos != -1:
+        yield pos
+        pos = data.find(pattern, pos + 1)
+
+
+def _read_exactly(stream, size):
+    """Read exactly size bytes from a stream (e.g. an HTTP response); b'' at a clean end"""
+    chunks = []
+    remaining = size
+    while remaining:
+        data = stream.read(remaining)
+        if not data:
+            break
+        chunks.append(data)
+        remaining -= len(data)
+    data = b''.join(chunks)
+    if data and len(data) != size:
+        raise ValueError(f"Stream ended inside a blob frame ({len(data)} of {size} bytes)")
+    return data
+
+
+def iter_stream_frames(stream):
+    """
+    Read complete frames from a sequential stream, without seeking.
+    Yields (blob_type, frame) until the stream ends.
+    """
+    while True:
+        prefix = _read_exactly(stream, 4)
+        if not prefix:
+            return
+        header_size = struct.unpack('>I', prefix)[0]
+        header = _read_exactly(stream, header_size)
+        if len(header) != header_size:
+            raise ValueError("Stream ended inside a BlobHeader")
+        blob_type, datasize = parse_blob_header(header)
+        blob = _read_exactly(stream, datasize)
+        if len(blob) != datasize:
+            raise ValueError("Stream ended inside a Blob")
+        yield blob_type, prefix + header + blob
+
+
+def read_frame(f, info):
+    """Read the complete frame (length prefix, header and blob) of a blob"""
+    f.seek(info.offset)
+    data = f.read(info.size)
+    if len(data) != info.size:
+        raise ValueError(f"Truncated blob at offset {info.offset}")
+    return data
+
+
+def split_ranges(blobs, parts):
+    """
+    Split consecutive blobs into at most `parts` ranges of roughly equal
+    byte size. Returns a list of lists of BlobInfo, in file order.
+    """
+    if not blobs:
+        return []
+    total = sum(b.size for b in blobs)
+    target = max(1, total // max(1, parts))
+
+    ranges = []
+    current = []
+    current_size = 0
+    for blob in blobs:
+        current.append(blob)
+        current_size += blob.size
+        if current_size >= target and len(ranges) < parts - 1:
+            ranges.append(current)
+            current = []
+            current_size = 0
+    if current:
+        ranges.append(current)
+    return ranges
+
+
+# ============================================================================
+# BLOB (DE)COMPRESSION
+# ============================================================================
+
+def frame_payload(frame):
+    """Return the Blob message of a complete frame"""
+    header_size = struct.unpack('>I', frame[:4])[0]
+    return memoryview(frame)[4 + header_size:]
+
+
+def decode_blob(blob):
+    """Decompress a Blob message and return the contained block bytes"""
+    raw_size = None
+    data = None
+    for field_number, wire_type, value, _, end in iter_field_spans(blob):
+        if field_number in (1, 3, 4) and wire_type != WIRE_LENGTH or field_number == 2 and wire_type != WIRE_VARINT:
+            raise ValueError(f"Invalid Blob: field {field_number} has wire type {wire_type}")
+        if end > len(blob):
+            raise ValueError(f"Invalid Blob: field {field_number} ends {end - len(blob):,} bytes after the frame")
+        if field_number == 1:
+            return bytes(value)
+        elif field_number == 2:
+            if value > MAX_BLOCK_SIZE:
+                raise ValueError(f"Blob raw_size {value:,} exceeds the maximum block size")
+            raw_size = value
+        elif field_number == 3:
+            data = zlib.decompress(value, bufsize=raw_size or zlib.DEF_BUF_SIZE)
+        elif field_number == 4:
+            data = lzma.decompress(value)
+        elif field_number in (5, 6, 7):
+            raise ValueError(f"Unsupported blob compression (Blob field {field_number})")
+    if data is None:
+        raise ValueError("Blob contains no data")
+    if raw_size is not None and len(data) != raw_size:
+        raise ValueError(f"Blob raw_size mismatch: expected {raw_size}, got {len(data)}")
+    return data
+
+
+def decode_frame(frame):
+    """Decompress the block contained in a complete frame"""
+    return decode_blob(frame_payload(frame))
+
+
+def encode_frame(block, blob_type='OSMData', compression_level=zlib.Z_DEFAULT_COMPRESSION):
+    """Compress block bytes with zlib and return a complete frame"""
+    if len(block) > MAX_BLOCK_SIZE:
+        raise ValueError(f"Block of {len(block)} bytes exceeds the PBF block size limit")
+    blob = encode_varint_field(2, len(block)) + encode_field(3, zlib.compress(block, compression_level))
+    header = encode_field(1, blob_type.encode('utf-8')) + encode_varint_field(3, len(blob))
+    return struct.pack('>I', len(header)) + header + blob
+
+
+def block_group_kinds(block):
+    """
+    Return the set of PrimitiveGroup kinds (GROUP_* constants) in a block.
+    Only the first field of every group is looked at, nothing is decoded.
+    """
+    kinds = set()
+    for field_number, _, value in iter_fields(block):
+        if field_number == 2 and len(value):
+            key, _ = read_varint(value, 0)
+            kinds.add(key >> 3)
+    return kinds
+
+
+# ============================================================================
+# HEADER BLOCK
+# ============================================================================
+
+def parse_header_block(block):
+    """
+    Decode the fields of a HeaderBlock that describe the extract.
+    Returns a dict with bbox (left, bottom, right, top in degrees, or None),
+    required_features, optional_features, writingprogram,
+    replication_timestamp (epoch seconds or None),
+    replication_sequence_number and replication_base_url.
+    """
+    header = {
+        'bbox': None,
+        'required_features': [],
+        'optional_features': [],
+        'writingprogram': None,
+        'replication_timestamp': None,
+        'replication_sequence_number': None,
+        'replication_base_url': None,
+    }
+    for field_number, _, value in iter_fields(block):
+        if field_number == 1:
+            box = {n: zigzag_decode(v) / 1e9 for n, _, v in iter_fields(value)}
+            header['bbox'] = (box.get(1), box.get(4), box.get(2), box.get(3))
+        elif field_number == 4:
+            header['required_features'].append(bytes(value).decode('utf-8'))
+        elif field_number == 5:
+            header['optional_features'].append(bytes(value).decode('utf-8'))
+        elif field_number == 16:
+            header['writingprogram'] = bytes(value).decode('utf-8')
+        elif field_number == 32:
+            header['replication_timestamp'] = value
+        elif field_number == 33:
+            header['replication_sequence_number'] = value
+        elif field_number == 34:
+            header['replication_base_url'] = bytes(value).decode('utf-8')
+    return header
+
+
+def read_header(pbf_file):
+    """Read and decode the OSMHeader block of a PBF file (see parse_header_block())"""
+    with open(pbf_file, 'rb') as f:
+        info = read_blob_info(f, 0)
+        if info is None or info.blob_type != 'OSMHeader':
+            raise ValueError(f"'{pbf_file}' does not start with an OSMHeader blob")
+        return parse_header_block(decode_frame(read_frame(f, info)))
+
+
+def read_string_table(block):
+    """Return the string table of a PrimitiveBlock as a list of bytes"""
+    for field_number, _, value in iter_fields(block):
+        if field_number == 1:
+            return [bytes(string) for string_field, _, string in iter_fields(value) if string_field == 1]
+    return []
+
+
+def iter_way_tag_ids(block, refs=None):
+    """
+    Yield (keys, vals) string table indices of every way in a PrimitiveBlock.
+    Lighter than PrimitiveBlock.ways() for read-only tag scans: other way
+    fields are skipped without being decoded or copied.
+    With refs='first', (keys, vals, ID of the first node or None) is yielded;
+    with refs='packed', (keys, vals, packed refs field) for decode_deltas().
+    """
+    for field_number, _, group in iter_fields(block):
+        if field_number != 2:
+            continue
+        for kind, _, way in iter_fields(group):
+            if kind != GROUP_WAYS:
+                continue
+            keys = []
+            vals = []
+            way_refs = None
+            pos = 0
+            end = len(way)
+            while pos < end:
+                key, pos = read_varint(way, pos)
+                wire_type = key & 0x07
+                if wire_type == WIRE_LENGTH:
+                    length, pos = read_varint(way, pos)
+                    if key == (2 << 3 | WIRE_LENGTH):
+                        keys = decode_packed(way[pos:pos + length])
+                    elif key == (3 << 3 | WIRE_LENGTH):
+                        vals = decode_packed(way[pos:pos + length])
+                    elif key == (8 << 3 | WIRE_LENGTH) and refs and length:
+                        if refs == 'packed':
+                            way_refs = way[pos:pos + length]
+                        else:
+                            # Refs are delta coded, the first delta is the first node ID
+                            way_refs = zigzag_decode(read_varint(way, pos)[0])
+                    pos += length
+                elif wire_type == WIRE_VARINT:
+                    value, pos = read_varint(way, pos)
+                    if key >> 3 == 2:
+                        keys.append(value)
+                    elif key >> 3 == 3:
+                        vals.append(value)
+                elif wire_type == WIRE_FIXED64:
+                    pos += 8
+                elif wire_type == WIRE_FIXED32:
+                    pos += 4
+                else:
+                    raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+            yield (keys, vals, way_refs) if refs else (keys, vals)
+
+
+def read_element_id(item):
+    """ID (field 1, plain int64) of an encoded Way or Relation message"""
+    for field_number, _, value in iter_fields(item):
+        if field_number == 1:
+            return value - (1 << 64) if value >= 1 << 63 else value
+    return 0
+
+
+def decode_deltas(buf):
+    """Decode a packed, delta coded sint64 field into absolute values"""
+    return list(accumulate((v >> 1) ^ -(v & 1) for v in decode_packed(buf)))
+
+
+def iter_node_locations(block):
+    """
+    Yield (ids, lons, lats) of the node groups of a PrimitiveBlock, dense or
+    not, with coordinates in degrees. Tags and metadata are not decoded.
+    """
+    granularity = 100
+    lat_offset = lon_offset = 0
+    groups = []
+    for field_number, _, value in iter_fields(block):
+        if field_number == 2:
+            groups.append(value)
+        elif field_number == 17:
+            granularity = value
+        elif field_number == 19:
+            lat_offset = zigzag_decode(value)
+        elif field_number == 20:
+            lon_offset = zigzag_decode(value)
+
+    for group in groups:
+        plain = ([], [], [])
+        for kind, _, item in iter_fields(group):
+            if kind == GROUP_DENSE:
+                ids = lats = lons = []
+                for field_number, _, value in iter_fields(item):
+                    if field_number == 1:
+                        ids = decode_deltas(value)
+                    elif field_number == 8:
+                        lats = decode_deltas(value)
+                    elif field_number == 9:
+                        lons = decode_deltas(value)
+                yield (ids, [(lon_offset + granularity * lon) / 1e9 for lon in lons],
+                       [(lat_offset + granularity * lat) / 1e9 for lat in lats])
+            elif kind == GROUP_NODES:
+                node = {field_number: value for field_number, _, value in iter_fields(item)}
+                plain[0].append(zigzag_decode(node.get(1, 0)))
+                plain[1].append((lon_offset + granularity * zigzag_decode(node.get(9, 0))) / 1e9)
+                plain[2].append((lat_offset + granularity * zigzag_decode(node.get(8, 0))) / 1e9)
+        if plain[0]:
+            yield plain
+
+
+def find_way_blobs(pbf_file, blobs=None):
+    """
+    Return the data blobs that can contain ways.
+    If the header declares Sort.Type_then_ID (nodes, then ways, then
+    relations), the way blobs are found by binary search, decompressing only
+    O(log n) blobs; otherwise all data blobs are returned.
+    """
+    blobs = blobs if blobs is not None else scan_blobs(pbf_file)
+    if not blobs or blobs[0].blob_type != 'OSMHeader':
+        raise ValueError(f"'{pbf_file}' does not start with an OSMHeader blob")
+    data_blobs = [blob for blob in blobs if blob.blob_type == 'OSMData']
+
+    with open(pbf_file, 'rb') as f:
+        header = parse_header_block(decode_frame(read_frame(f, blobs[0])))
+        if 'Sort.Type_then_ID' not in header['optional_features']:
+            return data_blobs
+
+        kinds_cache = {}
+
+        def kinds(i):
+            if i not in kinds_cache:
+                kinds_cache[i] = block_group_kinds(decode_frame(read_frame(f, data_blobs[i]))) or {0}
+            return kinds_cache[i]
+
+        def first(predicate):
+            lo, hi = 0, len(data_blobs)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if predicate(kinds(mid)):
+                    hi = mid
+                else:
+                    lo = mid + 1
+            return lo
+
+        # First blob with ways or anything after them, first blob with only relations or later
+        start = first(lambda k: max(k) >= GROUP_WAYS)
+        end = first(lambda k: min(k) > GROUP_WAYS)
+    return data_blobs[start:max(start, end)]
+
+
+def find_node_blobs(pbf_file, blobs=None):
+    """
+    Return the data blobs that can contain nodes: in a Sort.Type_then_ID
+    file the blobs up to and including the first way blob, otherwise all
+    data blobs.
+    """
+    blobs = blobs if blobs is not None else scan_blobs(pbf_file)
+    data_blobs = [blob for blob in blobs if blob.blob_type == 'OSMData']
+    way_blobs = find_way_blobs(pbf_file, blobs)
+    if not way_blobs or 'Sort.Type_then_ID' not in read_header(pbf_file)['optional_features']:
+        return data_blobs
+    return data_blobs[:data_blobs.index(way_blobs[0]) + 1]
+
+
+# ============================================================================
+# PRIMITIVE BLOCK WITH DECODED WAYS
+# ============================================================================
+
+class Way:
+    """A way of a PrimitiveBlock: id and tag indices decoded, everything else raw"""
+
+    __slots__ = ('id', 'keys', 'vals', 'raw', 'rest', 'modified')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.id = 0
+        self.keys = []
+        self.vals = []
+        self.rest = []  # Encoded fields other than id/keys/vals (info, refs, ...)
+        self.modified = False
+        for field_number, wire_type, value, start, end in iter_field_spans(raw):
+            if field_number == 1:
+                self.id = value - (1 << 64) if value >= 1 << 63 else value
+            elif field_number == 2:
+                if wire_type == WIRE_LENGTH:
+                    self.keys.extend(decode_packed(value))
+                else:
+                    self.keys.append(value)
+            elif field_number == 3:
+                if wire_type == WIRE_LENGTH:
+                    self.vals.extend(decode_packed(value))
+                else:
+                    self.vals.append(value)
+            else:
+                self.rest.append(raw[start:end])
+
+    def tags(self, strings):
+        """Return the tags as a dict, using the decoded string table of the block"""
+        return {strings[k]: strings[v] for k, v in zip(self.keys, self.vals)}
+
+    def refs(self):
+        """Decode the node references of the way"""
+        refs = []
+        ref = 0
+        for field_number, wire_type, value in iter_fields(b''.join(self.rest)):
+            if field_number == 8:
+                deltas = decode_packed(value) if wire_type == WIRE_LENGTH else [value]
+                for delta in deltas:
+                    ref += zigzag_decode(delta)
+                    refs.append(ref)
+        return refs
+
+    def info(self, strings, date_granularity=1000):
+        """
+        Decode the Info message of the way.
+        Returns a dict with version, timestamp (epoch seconds), changeset, uid
+        and user; missing fields are left out.
+        """
+        info = {}
+        for field_number, _, value in iter_fields(b''.join(self.rest)):
+            if field_number != 4:
+                continue
+            for info_field, _, info_value in iter_fields(value):
+                if info_field == 1:
+                    info['version'] = info_value
+                elif info_field == 2:
+                    info['timestamp'] = info_value * date_granularity // 1000
+                elif info_field == 3:
+                    info['changeset'] = info_value
+                elif info_field == 4:
+                    info['uid'] = info_value
+                elif info_field == 5:
+                    info['user'] = strings[info_value]
+        return info
+
+    def encode(self):
+        """Encode the way, reusing the original bytes when unchanged"""
+        if not self.modified:
+            return self.raw
+        # Way ids are plain (non-zigzag) int64; negative ids take 10 varint bytes
+        parts = [encode_varint_field(1, self.id & 0xffffffffffffffff)]
+        if self.keys:
+            parts.append(encode_field(2, encode_packed(self.keys)))
+            parts.append(encode_field(3, encode_packed(self.vals)))
+        parts.extend(bytes(r) for r in self.rest)
+        return b''.join(parts)
+
+
+class PrimitiveBlock:
+    """
+    A decoded PrimitiveBlock. Ways are decoded into Way objects, all other
+    groups and block fields are kept as raw bytes. New strings are appended
+    to the end of the string table so existing indices stay valid.
+    """
+
+    def __init__(self, block):
+        self.raw_strings = []
+        self.groups = []  # (kind, raw group bytes or list of Way)
+        self.other_fields = []  # Raw encoded fields (granularity, offsets, ...)
+        self._string_index = None
+        self._strings = None
+        self.date_granularity = 1000  # Milliseconds per timestamp unit
+
+        for field_number, _, value, start, end in iter_field_spans(block):
+            if field_number == 1:
+                for string_field, _, string in iter_fields(value):
+                    if string_field == 1:
+                        self.raw_strings.append(bytes(string))
+            elif field_number == 2:
+                kinds = {f for f, _, _ in iter_fields(value)}
+                if kinds == {GROUP_WAYS}:
+                    ways = [Way(item) for _, _, item in iter_fields(value)]
+                    self.groups.append((GROUP_WAYS, ways))
+                else:
+                    kind = min(kinds) if kinds else None
+                    self.groups.append((kind, bytes(value)))
+            else:
+                if field_number == 18:
+                    self.date_granularity = value
+                self.other_fields.append(bytes(block[start:end]))
+
+    @property
+    def strings(self):
+        """The string table decoded to str"""
+        if self._strings is None:
+            self._strings = [s.decode('utf-8', 'replace') for s in self.raw_strings]
+        return self._strings
+
+    def ways(self):
+        """Iterate over all ways of the block"""
+        for kind, group in self.groups:
+            if kind == GROUP_WAYS:
+                yield from group
+
+    def string_id(self, value):
+        """Return the string table index of value, appending it if missing"""
+        if self._string_index is None:
+            self._string_index = {}
+            for i, s in enumerate(self.raw_strings):
+                self._string_index.setdefault(s, i)
+        raw = value.encode('utf-8')
+        index = self._string_index.get(raw)
+        if index is None or index == 0:
+            # Index 0 is reserved as delimiter in dense nodes
+            index = len(self.raw_strings)
+            self.raw_strings.append(raw)
+            self._string_index[raw] = index
+            if self._strings is not None:
+                self._strings.append(value)
+        return index
+
+    def set_tag(self, way, key, value):
+        """Set a tag on a way, replacing an existing value of the same key"""
+        key_id = self.string_id(key)
+        value_id = self.string_id(value)
+        for i, k in enumerate(way.keys):
+            if k == key_id:
+                way.vals[i] = value_id
+                break
+        else:
+            way.keys.append(key_id)
+            way.vals.append(value_id)
+        way.modified = True
+
+    def encode(self):
+        """Encode the block back to PrimitiveBlock bytes"""
+        string_table = b''.join(encode_field(1, s) for s in self.raw_strings)
+        parts = [encode_field(1, string_table)]
+        for kind, group in self.groups:
+            if kind == GROUP_WAYS:
+                group = b''.join(encode_field(GROUP_WAYS, way.encode()) for way in group)
+            parts.append(encode_field(2, group))
+        parts.extend(self.other_fields)
+        return b''.join(parts)
+
+
+# ============================================================================
+# ENCODING NEW BLOCKS
+# ============================================================================
+
+def zigzag_encode(value):
+    """Encode a sint64 with zigzag encoding"""
+    return (value << 1) ^ (value >> 63)
+
+
+def _encode_deltas(values):
+    """Delta + zigzag encode a list of ints as packed varint payload"""
+    out = []
+    previous = 0
+    for value in values:
+        out.append(zigzag_encode(value - previous))
+        previous = value
+    return encode_packed(out)
+
+
+class StringTable:
+    """Builds the string table of a new block; index 0 is the empty string"""
+
+    def __init__(self):
+        self.strings = [b'']
+        self.index = {b'': 0}
+
+    def id(self, value):
+        raw = value.encode('utf-8')
+        index = self.index.get(raw)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(raw)
+            self.index[raw] = index
+        return index
+
+    def encode(self):
+        return encode_field(1, b''.join(encode_field(1, s) for s in self.strings))
+
+
+def encode_header_block(bbox=None, writingprogram='AutoRouteServices',
+                        required_features=('OsmSchema-V0.6', 'DenseNodes'),
+                        optional_features=('Sort.Type_then_ID',), replication_timestamp=None):
+    """
+    Encode a HeaderBlock. bbox is (left, bottom, right, top) in degrees.
+    replication_timestamp is in epoch seconds.
+    """
+    parts = []
+    if bbox:
+        left, bottom, right, top = (round(v * 1e9) for v in bbox)
+        parts.append(encode_field(1, b''.join(encode_varint_field(n, zigzag_encode(v)) for n, v in
+                                              ((1, left), (2, right), (3, top), (4, bottom)))))
+    parts.extend(encode_field(4, f.encode('utf-8')) for f in required_features)
+    parts.extend(encode_field(5, f.encode('utf-8')) for f in optional_features)
+    parts.append(encode_field(16, writingprogram.encode('utf-8')))
+    if replication_timestamp is not None:
+        parts.append(encode_varint_field(32, replication_timestamp))
+    return b''.join(parts)
+
+
+def encode_dense_nodes_block(nodes):
+    """
+    Encode a PrimitiveBlock of dense nodes (default granularity of 100 nanodegrees).
+    nodes: list of (id, lat, lon, tags dict), sorted by id.
+    """
+    table = StringTable()
+    keys_vals = []
+    for _, _, _, tags in nodes:
+        for k, v in tags.items():
+            keys_vals.append(table.id(k))
+            keys_vals.append(table.id(v))
+        keys_vals.append(0)
+
+    dense = (encode_field(1, _encode_deltas([n[0] for n in nodes]))
+             + encode_field(8, _encode_deltas([round(n[1] * 1e7) for n in nodes]))
+             + encode_field(9, _encode_deltas([round(n[2] * 1e7) for n in nodes])))
+    if any(n[3] for n in nodes):
+        dense += encode_field(10, encode_packed(keys_vals))
+    return table.encode() + encode_field(2, encode_field(GROUP_DENSE, dense))
+
+
+def encode_ways_block(ways):
+    """
+    Encode a PrimitiveBlock of ways.
+    ways: list of (id, tags dict, refs list), sorted by id.
+    """
+    table = StringTable()
+    messages = []
+    for way_id, tags, refs in ways:
+        message = encode_varint_field(1, way_id)
+        if tags:
+            message += encode_field(2, encode_packed([table.id(k) for k in tags]))
+            message += encode_field(3, encode_packed([table.id(v) for v in tags.values()]))
+        message += encode_field(8, _encode_deltas(refs))
+        messages.append(encode_field(GROUP_WAYS, message))
+    return table.encode() + encode_field(2, b''.join(messages))
+
+
+# Relation member types
+MEMBER_NODE = 0
+MEMBER_WAY = 1
+MEMBER_RELATION = 2
+
+
+def encode_relations_block(relations):
+    """
+    Encode a PrimitiveBlock of relations.
+    relations: list of (id, tags dict, members) with members as
+    (MEMBER_* type, ref, role) tuples, sorted by id.
+    """
+    table = StringTable()
+    messages = []
+    for relation_id, tags, members in relations:
+        message = encode_varint_field(1, relation_id)
+        if tags:
+            message += encode_field(2, encode_packed([table.id(k) for k in tags]))
+            message += encode_field(3, encode_packed([table.id(v) for v in tags.values()]))
+        message += encode_field(8, encode_packed([table.id(role) for _, _, role in members]))
+        message += encode_field(9, _encode_deltas([ref for _, ref, _ in members]))
+        message += encode_field(10, encode_packed([member_type for member_type, _, _ in members]))
+        messages.append(encode_field(GROUP_RELATIONS, message))
+    return table.encode() + encode_field(2, b''.join(messages))
@@ -0,0 +1,136 @@
+"""
+Disk-budgeted LRU cache of the country PBFs in the data directory.
+
+Downloaded extracts (<country>-latest.osm.pbf) and modified outputs
+(<country>-latest-modified.osm.pbf) stay on disk after a country is done,
+so the next run reuses them instead of downloading and rewriting again.
+When the files together exceed the byte budget, the least recently used
+ones are deleted, together with the files derived from them
+(COMPANION_SUFFIXES: rewrite stats, rules fingerprint, node location index).
+
+Files used by running stages are pinned and never evicted. What is present
+and when it was last used is kept in <data_dir>/.pbf_cache.json; files that
+appear or vanish behind the cache's back are picked up on start.
+"""
+
+import json
+import os
+import threading
+import time
+
+
+INDEX_FILE = '.pbf_cache.json'
+
+# Cached files
+PBF_SUFFIXES = ('-latest.osm.pbf', '-latest-modified.osm.pbf')
+# Files derived from a cached PBF, evicted with it
+COMPANION_SUFFIXES = ('.stats.json', '.rules.json', '.nodes')
+
+
+class PbfCache:
+    """
+    LRU cache over the PBF files of data_dir, at most budget bytes
+    (None: no limit, files are only tracked). Thread-safe.
+    """
+
+    def __init__(self, data_dir, budget=None):
+        self.data_dir = data_dir
+        self.budget = budget
+        self.index_file = os.path.join(data_dir, INDEX_FILE)
+        self.lock = threading.Lock()
+        self.pins = {}  # name -> pin count
+        self.files = {}  # name -> {'size': bytes incl. companions, 'last_used': epoch seconds}
+
+        try:
+            with open(self.index_file, 'r') as f:
+                self.files = json.load(f).get('files', {})
+        except (OSError, ValueError):
+            pass
+        # Reconcile with what is actually on disk
+        present = {name for name in os.listdir(data_dir) if name.endswith(PBF_SUFFIXES)}
+        for name in list(self.files):
+            if name not in present:
+                del self.files[name]
+        for name in present:
+            if name in self.files:
+                self.files[name]['size'] = self._size(name)
+            else:
+                path = os.path.join(data_dir, name)
+                self.files[name] = {'size': self._size(name), 'last_used': os.path.getmtime(path)}
+        self._save()
+
+    def _size(self, name):
+        size = 0
+        for path in [os.path.join(self.data_dir, name)] + \
+                [os.path.join(self.data_dir, name + suffix) for suffix in COMPANION_SUFFIXES]:
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return size
+
+    def _save(self):
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'files': self.files}, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.index_file)
+
+    def _name(self, path):
+        """Cache key of a path, or None for files the cache does not manage"""
+        if not path or os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.data_dir):
+            return None
+        name = os.path.basename(path)
+        return name if name.endswith(PBF_SUFFIXES) else None
+
+    def total(self):
+        with self.lock:
+            return sum(entry['size'] for entry in self.files.values())
+
+    def touch(self, path):
+        """Record a use of path (adding it if it is new), e.g. after a download, rewrite or analysis"""
+        name = self._name(path)
+        if name is None or not os.path.exists(path):
+            return
+        with self.lock:
+            self.files[name] = {'size': self._size(name), 'last_used': time.time()}
+            self._save()
+
+    def pin(self, path):
+        """Protect path from eviction until unpin(); pins are counted"""
+        name = self._name(path)
+        if name is not None:
+            with self.lock:
+                self.pins[name] = self.pins.get(name, 0) + 1
+
+    def unpin(self, path):
+        name = self._name(path)
+        if name is not None:
+            with self.lock:
+                if self.pins.get(name, 0) > 1:
+                    self.pins[name] -= 1
+                else:
+                    self.pins.pop(name, None)
+
+    def make_room(self, needed=0):
+        """
+        Evict least recently used, unpinned files until needed more bytes fit
+        in the budget. Returns the list of evicted file names.
+        """
+        if self.budget is None:
+            return []
+        evicted = []
+        with self.lock:
+            total = sum(entry['size'] for entry in self.files.values())
+            for name, entry in sorted(self.files.items(), key=lambda item: item[1]['last_used']):
+                if total + needed <= self.budget:
+                    break
+                if name in self.pins:
+                    continue
+                for path in [os.path.join(self.data_dir, name)] + \
+                        [os.path.join(self.data_dir, name + suffix) for suffix in COMPANION_SUFFIXES]:
+                    if os.path.exists(path):
+                        os.remove(path)
+                total -= entry['size']
+                del self.files[name]
+                evicted.append(name)
+            if evicted:
+                self._save()
+        return evicted
@@ -0,0 +1,278 @@
+"""
+Parallel, resumable HTTP downloader for Geofabrik extracts.
+
+download_file() fetches a file with several HTTP range requests at once and
+writes the chunks into <path>.part at their offsets. Finished chunks are
+recorded in <path>.part.json, so an interrupted download continues where it
+stopped, as long as the remote file is unchanged (same size, ETag and
+Last-Modified). Once all chunks are there, the size and the published MD5
+(<url>.md5, as on download.geofabrik.de) are checked and the file is renamed
+to <path>. A partial or corrupt download never appears under the final name.
+
+Servers without range support are downloaded with a single connection.
+
+StreamDownload reads a remote file sequentially for consumers that process
+it on the fly (see surface_stats.stream_stats()), optionally saving the
+bytes to <path> at the same time with the same .part/MD5/rename handling.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+
+CONNECTIONS = 4
+CHUNK_SIZE = 32 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+RETRIES = 3
+TIMEOUT = 60
+
+
+class DownloadError(Exception):
+    pass
+
+
+def part_path(path):
+    return path + '.part'
+
+
+def state_path(path):
+    return path + '.part.json'
+
+
+def remote_info(url):
+    """
+    HEAD the url and return (size, accepts_ranges, validator), where
+    validator identifies the remote version (ETag and Last-Modified).
+    """
+    with urlopen(Request(url, method='HEAD'), timeout=TIMEOUT) as response:
+        headers = response.headers
+        size = int(headers.get('Content-Length') or 0)
+        accepts_ranges = headers.get('Accept-Ranges', '').lower() == 'bytes'
+        validator = [headers.get('ETag'), headers.get('Last-Modified')]
+    return size, accepts_ranges, validator
+
+
+def published_md5(url):
+    """MD5 published next to the file (<url>.md5), or None if there is none"""
+    try:
+        with urlopen(url + '.md5', timeout=TIMEOUT) as response:
+            text = response.read(4096).decode('ascii', 'replace')
+    except (HTTPError, URLError, OSError):
+        return None
+    fields = text.split()
+    if fields and len(fields[0]) == 32:
+        return fields[0].lower()
+    return None
+
+
+def file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(16 * 1024 * 1024), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def load_state(path, size, validator):
+    """Chunks already downloaded into <path>.part, if it belongs to the same remote file"""
+    try:
+        with open(state_path(path), 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    if (state.get('size') != size or state.get('validator') != validator
+            or not os.path.exists(part_path(path)) or os.path.getsize(part_path(path)) != size):
+        return set()
+    return set(state.get('done', []))
+
+
+def save_state(path, size, validator, done):
+    tmp_file = state_path(path) + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump({'size': size, 'validator': validator, 'done': sorted(done)}, f)
+    os.replace(tmp_file, state_path(path))
+
+
+def fetch_range(url, fd, start, end, progress):
+    """Download bytes start..end (inclusive) of url into fd at the same offset"""
+    request = Request(url, headers={'Range': f'bytes={start}-{end}'})
+    with urlopen(request, timeout=TIMEOUT) as response:
+        if response.status != 206:
+            raise DownloadError(f"Server ignored the range request (HTTP {response.status})")
+        offset = start
+        while offset <= end:
+            data = response.read(min(READ_SIZE, end + 1 - offset))
+            if not data:
+                raise DownloadError(f"Connection closed at byte {offset:,} of range {start:,}-{end:,}")
+            os.pwrite(fd, data, offset)
+            offset += len(data)
+            progress(len(data))
+
+
+def fetch_single(url, part_file, progress):
+    """Download url with one connection (no resume)"""
+    with urlopen(url, timeout=TIMEOUT) as response, open(part_file, 'wb') as f:
+        for data in iter(lambda: response.read(READ_SIZE), b''):
+            f.write(data)
+            progress(len(data))
+
+
+def download_file(url, path, connections=CONNECTIONS, chunk_size=CHUNK_SIZE, verify_md5=True,
+                  progress_callback=None):
+    """
+    Download url to path with `connections` parallel range requests.
+    Resumes a previous partial download of the same remote file.
+    progress_callback(downloaded_bytes, total_bytes) is called as data arrives.
+    Raises DownloadError if the download fails or does not verify.
+    """
+    try:
+        size, accepts_ranges, validator = remote_info(url)
+    except (HTTPError, URLError, OSError) as e:
+        raise DownloadError(f"Cannot reach {url}: {e}")
+
+    part_file = part_path(path)
+    lock = threading.Lock()
+    downloaded = 0
+
+    def progress(count):
+        nonlocal downloaded
+        with lock:
+            downloaded += count
+            if progress_callback:
+                progress_callback(downloaded, size)
+
+    if not accepts_ranges or size == 0:
+        try:
+            fetch_single(url, part_file, progress)
+        except (HTTPError, URLError, OSError) as e:
+            raise DownloadError(f"Download of {url} failed: {e}")
+        if size and os.path.getsize(part_file) != size:
+            raise DownloadError(f"Size mismatch: got {os.path.getsize(part_file):,} bytes, expected {size:,}")
+    else:
+        chunks = [(i, start, min(start + chunk_size, size) - 1)
+                  for i, start in enumerate(range(0, size, chunk_size))]
+        done = load_state(path, size, validator)
+        if not done:
+            # Fresh start: allocate the full file, chunks are written at their offsets
+            with open(part_file, 'wb') as f:
+                f.truncate(size)
+            save_state(path, size, validator, done)
+        downloaded = sum(end + 1 - start for i, start, end in chunks if i in done)
+
+        fd = os.open(part_file, os.O_WRONLY)
+        try:
+            def fetch_chunk(chunk):
+                index, start, end = chunk
+                for attempt in range(1, RETRIES + 1):
+                    fetched = 0
+
+                    def chunk_progress(count):
+                        nonlocal fetched
+                        fetched += count
+                        progress(count)
+
+                    try:
+                        fetch_range(url, fd, start, end, chunk_progress)
+                        break
+                    except (HTTPError, URLError, OSError, DownloadError) as e:
+                        # The chunk is retried from its start
+                        progress(-fetched)
+                        if attempt == RETRIES:
+                            raise DownloadError(f"Range {start:,}-{end:,} failed after {RETRIES} attempts: {e}")
+                        time.sleep(2 ** attempt)
+                with lock:
+                    done.add(index)
+                    save_state(path, size, validator, done)
+
+            with ThreadPoolExecutor(max(1, connections)) as pool:
+                # list() re-raises the first failure
+                list(pool.map(fetch_chunk, [chunk for chunk in chunks if chunk[0] not in done]))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    if verify_md5:
+        expected = published_md5(url)
+        if expected and file_md5(part_file) != expected:
+            os.remove(part_file)
+            if os.path.exists(state_path(path)):
+                os.remove(state_path(path))
+            raise DownloadError(f"MD5 mismatch for {url}, partial file removed")
+
+    os.replace(part_file, path)
+    if os.path.exists(state_path(path)):
+        os.remove(state_path(path))
+    return path
+
+
+class StreamDownload:
+    """
+    File-like sequential reader over a remote file. With a path, everything
+    read is also written to <path>.part; finish() reads the remainder,
+    verifies size and MD5 and renames it to path. Without a path nothing
+    touches the disk and close() may be called before the end of the file.
+    """
+
+    def __init__(self, url, path=None, progress_callback=None):
+        self.url = url
+        self.path = path
+        self.progress_callback = progress_callback
+        try:
+            self.response = urlopen(url, timeout=TIMEOUT)
+        except (HTTPError, URLError, OSError) as e:
+            raise DownloadError(f"Cannot reach {url}: {e}")
+        self.size = int(self.response.headers.get('Content-Length') or 0)
+        self.downloaded = 0
+        self.md5 = hashlib.md5() if path else None
+        self.out = open(part_path(path), 'wb') if path else None
+
+    def read(self, size=-1):
+        try:
+            data = self.response.read(size)
+        except (URLError, OSError) as e:
+            raise DownloadError(f"Download of {self.url} failed: {e}")
+        if data and self.out:
+            self.out.write(data)
+            self.md5.update(data)
+        self.downloaded += len(data)
+        if self.progress_callback:
+            self.progress_callback(self.downloaded, self.size)
+        return data
+
+    def finish(self, verify_md5=True):
+        """Read the rest of the file and move the saved copy into place. Returns path"""
+        while self.read(READ_SIZE):
+            pass
+        self.out.close()
+        self.out = None
+        self.response.close()
+        if self.size and self.downloaded != self.size:
+            os.remove(part_path(self.path))
+            raise DownloadError(f"Size mismatch: got {self.downloaded:,} bytes, expected {self.size:,}")
+        if verify_md5:
+            expected = published_md5(self.url)
+            if expected and self.md5.hexdigest() != expected:
+                os.remove(part_path(self.path))
+                raise DownloadError(f"MD5 mismatch for {self.url}, partial file removed")
+        os.replace(part_path(self.path), self.path)
+        return self.path
+
+    def close(self):
+        """Stop reading; an unfinished saved copy is removed"""
+        self.response.close()
+        if self.out:
+            self.out.close()
+            self.out = None
+            os.remove(part_path(self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,136 @@
+"""
+SQLite store for per-country surface statistics.
+
+Every analysis result is one row in `results`, keyed by
+(country, variant, extract_timestamp):
+
+  country            lowercase country name as in COUNTRIES
+  variant            'original' or 'modified'
+  extract_timestamp  replication timestamp of the analyzed PBF (0 if unknown)
+
+with one `counts` row (with_surface, total, and km_with_surface, km_total
+for length-weighted results, NULL otherwise) per highway class. Storing a
+result again for the same key replaces it; a newer extract of a country is
+a new row, and latest() returns the newest one per country and variant.
+
+The database runs in WAL mode and every store call uses its own short
+connection and transaction, so threads and worker processes can write to it
+at the same time. CSV files are exports of the store (see
+analyze_countries.export_csv()), they are never read back.
+"""
+
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+
+# Seconds a writer waits for another one to commit
+BUSY_TIMEOUT = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    country TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    extract_timestamp INTEGER NOT NULL,
+    filename TEXT,
+    updated TEXT NOT NULL,
+    UNIQUE (country, variant, extract_timestamp)
+);
+CREATE TABLE IF NOT EXISTS counts (
+    result_id INTEGER NOT NULL REFERENCES results(id) ON DELETE CASCADE,
+    highway_type TEXT NOT NULL,
+    with_surface INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    km_with_surface REAL,
+    km_total REAL,
+    PRIMARY KEY (result_id, highway_type)
+);
+"""
+
+# Columns added after the first version of the schema
+ADDED_COLUMNS = {'counts': [('km_with_surface', 'REAL'), ('km_total', 'REAL')]}
+
+
+class ResultsStore:
+    """Surface statistics per (country, variant, extract timestamp) in an SQLite file"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            with db:
+                db.executescript(SCHEMA)
+                for table, columns in ADDED_COLUMNS.items():
+                    existing = {row[1] for row in db.execute(f'PRAGMA table_info({table})')}
+                    for column, column_type in columns:
+                        if column not in existing:
+                            db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        db.execute('PRAGMA foreign_keys=ON')
+        return db
+
+    def put(self, country, variant, stats, extract_timestamp=0, filename=None):
+        """Insert or replace the stats of one country, variant and extract"""
+        country = country.lower()
+        extract_timestamp = extract_timestamp or 0
+        with closing(self._connect()) as db, db:
+            # Take the write lock up front, so concurrent writers queue instead of failing
+            db.execute('BEGIN IMMEDIATE')
+            db.execute(
+                'INSERT INTO results (country, variant, extract_timestamp, filename, updated) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (country, variant, extract_timestamp) '
+                'DO UPDATE SET filename = excluded.filename, updated = excluded.updated',
+                (country, variant, extract_timestamp, filename, time.strftime('%Y-%m-%dT%H:%M:%S')))
+            result_id = db.execute(
+                'SELECT id FROM results WHERE country = ? AND variant = ? AND extract_timestamp = ?',
+                (country, variant, extract_timestamp)).fetchone()[0]
+            db.execute('DELETE FROM counts WHERE result_id = ?', (result_id,))
+            db.executemany(
+                'INSERT INTO counts (result_id, highway_type, with_surface, total, km_with_surface, km_total) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(result_id, highway_type, entry['with_surface'], entry['total'],
+                  entry.get('km_with_surface'), entry.get('km_total'))
+                 for highway_type, entry in stats.items()])
+
+    def existing(self):
+        """Countries with stored results: {'original': set(), 'modified': set()} of lowercase names"""
+        existing = {'original': set(), 'modified': set()}
+        with closing(self._connect()) as db:
+            for country, variant in db.execute('SELECT DISTINCT country, variant FROM results'):
+                existing.setdefault(variant, set()).add(country)
+        return existing
+
+    def latest(self, variant):
+        """
+        Newest result of every country for a variant, ordered by country.
+        Returns a list of dicts with country, extract_timestamp, filename and stats.
+        """
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                'SELECT r.id, r.country, r.extract_timestamp, r.filename FROM results r '
+                'WHERE r.variant = ? AND r.extract_timestamp = '
+                '(SELECT MAX(extract_timestamp) FROM results WHERE country = r.country AND variant = r.variant) '
+                'ORDER BY r.country', (variant,)).fetchall()
+            results = []
+            for result_id, country, extract_timestamp, filename in rows:
+                stats = {}
+                for highway_type, with_surface, total, km_with_surface, km_total in db.execute(
+                        'SELECT highway_type, with_surface, total, km_with_surface, km_total '
+                        'FROM counts WHERE result_id = ?', (result_id,)):
+                    entry = stats[highway_type] = {'with_surface': with_surface, 'total': total}
+                    if km_total is not None:
+                        entry['km_with_surface'] = km_with_surface
+                        entry['km_total'] = km_total
+                results.append({'country': country, 'extract_timestamp': extract_timestamp,
+                                'filename': filename, 'stats': stats})
+        return results
+
+    def is_empty(self):
+        with closing(self._connect()) as db:
+            return db.execute('SELECT 1 FROM results LIMIT 1').fetchone() is None
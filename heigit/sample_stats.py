@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+"""
+Approximate surface statistics from a random sample of way blocks.
+
+Instead of decoding every way block, random byte offsets are drawn in the
+part of the file that holds the ways and the frame around each offset is
+found by seeking there and searching backwards for its BlobHeader
+(pbf_blocks.find_frame_at()). Nothing before a sampled frame is read, so a
+planet estimate costs a few hundred block decodes. In a Sort.Type_then_ID
+file the way section is found by bisection over byte offsets first (about
+log2(frames) decodes); other files are sampled over all data blocks.
+
+A frame is drawn with probability p = frame size / section size, with
+replacement, and per class totals are estimated with the Hansen-Hurwitz
+estimator mean(y / p). The share of ways without a surface is the ratio of
+two such totals; its variance is estimated by linearization, giving normal
+approximation confidence intervals for every class and for the headline
+figure over MAIN_ROAD_TYPES (as analyze_countries.calculate_percentage_without_surface()).
+
+With refine, the sample is doubled until the headline interval is narrow
+enough. Once half of the way section has been decoded anyway, the rest is
+not sampled: the file is scanned exactly (surface_stats.collect_stats_parallel()).
+
+Usage: ./sample_stats.py europe-latest.osm.pbf [--samples 200] [--refine [--target 0.5]] [--seed N]
+"""
+
+import argparse
+import math
+import multiprocessing
+import os
+import random
+import time
+
+from pbf_blocks import GROUP_WAYS, read_blob_info, read_frame, decode_frame, block_group_kinds, \
+    parse_header_block, find_frame_at
+from surface_stats import HIGHWAY_TYPES, MAIN_ROAD_TYPES, count_block_stats, collect_stats_parallel
+
+
+DEFAULT_SAMPLES = 200
+# Two-sided 95% normal quantile
+Z_95 = 1.959963984540054
+# Refinement switches to an exact scan once this share of the way section is decoded
+EXACT_FRACTION = 0.5
+
+
+def way_section(pbf_file):
+    """
+    Byte range (start, end) of the frames that can contain ways: in a
+    Sort.Type_then_ID file from the first frame with ways to the first
+    relation-only frame, found by bisection; otherwise all data frames.
+    """
+    file_size = os.path.getsize(pbf_file)
+    with open(pbf_file, 'rb') as f:
+        header_info = read_blob_info(f, 0)
+        if header_info is None or header_info.blob_type != 'OSMHeader':
+            raise ValueError(f"'{pbf_file}' does not start with an OSMHeader blob")
+        header = parse_header_block(decode_frame(read_frame(f, header_info)))
+        if 'Sort.Type_then_ID' not in header['optional_features']:
+            return header_info.size, file_size
+
+        kinds_cache = {}
+
+        def kinds(info):
+            if info.offset not in kinds_cache:
+                kinds_cache[info.offset] = block_group_kinds(decode_frame(read_frame(f, info))) or {0}
+            return kinds_cache[info.offset]
+
+        def first(predicate):
+            """Start of the first frame matching predicate (frames are ordered by kind)"""
+            lo, hi = header_info.size, file_size
+            while lo < hi:
+                info = find_frame_at(f, (lo + hi) // 2, file_size)
+                if predicate(kinds(info)):
+                    hi = info.offset
+                else:
+                    lo = info.offset + info.size
+            return lo
+
+        start = first(lambda k: max(k) >= GROUP_WAYS)
+        end = first(lambda k: min(k) > GROUP_WAYS)
+    return start, max(start, end)
+
+
+def count_sample_frame(task):
+    """Worker: stats of one sampled frame. Returns (stats, way_count, highway_way_count)"""
+    pbf_file, info = task
+    stats = {}
+    with open(pbf_file, 'rb') as f:
+        block = decode_frame(read_frame(f, info))
+    if GROUP_WAYS not in block_group_kinds(block):
+        return stats, 0, 0
+    way_count, highway_way_count = count_block_stats(block, stats)
+    return stats, way_count, highway_way_count
+
+
+def ratio_estimate(draws, span, classes):
+    """
+    Hansen-Hurwitz estimate of the share of ways without a surface over
+    classes. draws are (frame size, frame stats), one per draw.
+    Returns (percent, confidence interval half-width in percent points,
+    estimated total, estimated with_surface); the percent is None without ways.
+    """
+    n = len(draws)
+    if not n:
+        return None, None, 0.0, 0.0
+    ys = []
+    for size, stats in draws:
+        p = size / span
+        total = sum(stats[c]['total'] for c in classes if c in stats)
+        with_surface = sum(stats[c]['with_surface'] for c in classes if c in stats)
+        ys.append((total / p, with_surface / p))
+    total = sum(t for t, _ in ys) / n
+    with_surface = sum(w for _, w in ys) / n
+    if not total:
+        return None, None, 0.0, 0.0
+    ratio = with_surface / total
+    half_width = None
+    if n > 1:
+        z = [w - ratio * t for t, w in ys]
+        mean = sum(z) / n
+        variance = sum((v - mean) ** 2 for v in z) / (n * (n - 1)) / total ** 2
+        half_width = Z_95 * math.sqrt(variance) * 100
+    return (1 - ratio) * 100, half_width, total, with_surface
+
+
+class BlockSample:
+    """A growing with-replacement sample of the way frames of a PBF file"""
+
+    def __init__(self, pbf_file, seed=None):
+        self.pbf_file = pbf_file
+        self.file_size = os.path.getsize(pbf_file)
+        self.start, self.end = way_section(pbf_file)
+        self.rng = random.Random(seed)
+        self.draws = []  # frame offset per draw
+        self.frames = {}  # frame offset -> (BlobInfo, (stats, way_count, highway_way_count))
+
+    @property
+    def span(self):
+        return self.end - self.start
+
+    @property
+    def decoded_bytes(self):
+        return sum(info.size for info, _ in self.frames.values())
+
+    def draw(self, count, pool=None):
+        """Draw count more frames, decoding the ones not decoded before"""
+        if self.span <= 0:
+            return
+        new = {}
+        with open(self.pbf_file, 'rb') as f:
+            for _ in range(count):
+                # The section borders are frame borders, so whole frames are drawn
+                info = find_frame_at(f, self.rng.randrange(self.start, self.end), self.file_size)
+                self.draws.append(info.offset)
+                if info.offset not in self.frames:
+                    new[info.offset] = info
+        tasks = [(self.pbf_file, info) for info in new.values()]
+        results = pool.map(count_sample_frame, tasks) if pool else map(count_sample_frame, tasks)
+        for (_, info), result in zip(tasks, results):
+            self.frames[info.offset] = (info, result)
+
+    def estimate(self):
+        """
+        Estimated stats of the whole file. Returns a dict with 'stats'
+        (rounded estimated counts), 'percent' ({class: (percent without
+        surface, 95% half-width)}), 'main' (the same over MAIN_ROAD_TYPES),
+        'draws', 'frames' and 'decoded_bytes'.
+        """
+        draws = [(self.frames[offset][0].size, self.frames[offset][1][0]) for offset in self.draws]
+        stats = {}
+        percent = {}
+        for highway_type in HIGHWAY_TYPES:
+            pct, half_width, total, with_surface = ratio_estimate(draws, self.span, [highway_type])
+            if pct is None:
+                continue
+            stats[highway_type] = {'with_surface': round(with_surface), 'total': round(total)}
+            percent[highway_type] = (pct, half_width)
+        main, main_half_width, _, _ = ratio_estimate(draws, self.span, MAIN_ROAD_TYPES)
+        return {'stats': stats, 'percent': percent, 'main': (main, main_half_width),
+                'draws': len(self.draws), 'frames': len(self.frames), 'decoded_bytes': self.decoded_bytes,
+                'exact': False}
+
+
+def exact_result(pbf_file, workers=None):
+    """Exact stats in the format of BlockSample.estimate() (zero-width intervals)"""
+    stats, _, _ = collect_stats_parallel(pbf_file, workers)
+    percent = {}
+    for highway_type, entry in stats.items():
+        if entry['total']:
+            percent[highway_type] = ((1 - entry['with_surface'] / entry['total']) * 100, 0.0)
+    main_total = sum(stats[c]['total'] for c in MAIN_ROAD_TYPES if c in stats)
+    main_with = sum(stats[c]['with_surface'] for c in MAIN_ROAD_TYPES if c in stats)
+    main = ((1 - main_with / main_total) * 100, 0.0) if main_total else (None, None)
+    return {'stats': stats, 'percent': percent, 'main': main, 'exact': True}
+
+
+def print_estimate(result):
+    def interval(pct, half_width):
+        if pct is None:
+            return 'n/a'
+        if half_width is None:
+            return f"{pct:5.1f}%"
+        return f"{pct:5.1f}% ± {half_width:.1f}"
+
+    if result['exact']:
+        print("Exact (full scan):")
+    else:
+        print(f"Estimate from {result['draws']:,} draws ({result['frames']:,} frames, "
+              f"{result['decoded_bytes'] / 1024**2:.1f} MB decoded), 95% intervals:")
+    print(f"  {'Class':<15} {'est. ways':>12}  without surface")
+    for highway_type in HIGHWAY_TYPES:
+        if highway_type in result['percent']:
+            print(f"  {highway_type:<15} {result['stats'][highway_type]['total']:>12,}  "
+                  f"{interval(*result['percent'][highway_type])}")
+    print(f"  {'main roads':<15} {'':>12}  {interval(*result['main'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Estimate surface coverage from a random sample of way blocks')
+    parser.add_argument('pbf_file', help='Input .osm.pbf file')
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES,
+                        help=f'Frames to draw (default: {DEFAULT_SAMPLES})')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed, for repeatable samples')
+    parser.add_argument('--refine', action='store_true',
+                        help='Double the sample until the main roads interval is within --target, '
+                             'scanning exactly once half of the ways are decoded')
+    parser.add_argument('--target', type=float, default=0.5,
+                        help='Main roads 95%% half-width in percent points to refine to (default: 0.5; '
+                             '0 refines to the exact answer)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    args = parser.parse_args()
+
+    workers = max(1, args.workers or os.cpu_count() or 1)
+    start_time = time.time()
+    sample = BlockSample(args.pbf_file, args.seed)
+    print(f"Way section: {sample.span / 1024**2:.1f} MB of {sample.file_size / 1024**2:.1f} MB")
+
+    pool = multiprocessing.get_context('fork').Pool(workers) if workers > 1 else None
+    try:
+        samples = max(2, args.samples)
+        while True:
+            sample.draw(samples - len(sample.draws), pool)
+            result = sample.estimate()
+            print()
+            print_estimate(result)
+            print(f"  ({time.time() - start_time:.1f}s)")
+            _, half_width = result['main']
+            if not args.refine or (half_width is not None and half_width <= args.target and args.target > 0):
+                break
+            if sample.decoded_bytes >= EXACT_FRACTION * sample.span:
+                print()
+                print_estimate(exact_result(args.pbf_file, workers))
+                print(f"  ({time.time() - start_time:.1f}s)")
+                break
+            samples *= 2
+    finally:
+        if pool:
+            pool.terminate()
+
+
+if __name__ == '__main__':
+    main()
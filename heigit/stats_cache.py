@@ -0,0 +1,91 @@
+"""
+Content-addressed cache for per-highway surface statistics of PBF files.
+
+Entries are keyed by the replication timestamp from the PBF header and a
+fast fingerprint of the file content (file size, the header blob and a few
+evenly spaced samples), not by file name. A re-downloaded extract with new
+data gets a new key and is rescanned; an unchanged file, renamed or not, is
+a cache hit.
+
+Every entry is a small JSON file in the cache directory, written atomically,
+so analysis processes can read and fill the cache concurrently.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from pbf_blocks import read_blob_info, read_frame, decode_frame, parse_header_block
+
+
+# Bump when the way statistics are counted differently, to invalidate old entries
+CACHE_VERSION = 1
+
+# Content samples hashed for the fingerprint
+SAMPLE_COUNT = 16
+SAMPLE_SIZE = 64 * 1024
+
+
+def pbf_fingerprint(pbf_file):
+    """
+    Return (replication_timestamp, digest) of a PBF file. Reads the header
+    blob and SAMPLE_COUNT samples, a few MB at most regardless of file size.
+    """
+    size = os.path.getsize(pbf_file)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(size).encode('ascii'))
+    replication_timestamp = None
+
+    with open(pbf_file, 'rb') as f:
+        info = read_blob_info(f, 0)
+        if info is not None and info.blob_type == 'OSMHeader':
+            frame = read_frame(f, info)
+            digest.update(frame)
+            replication_timestamp = parse_header_block(decode_frame(frame))['replication_timestamp']
+
+        step = max(1, size // SAMPLE_COUNT)
+        for offset in range(0, size, step):
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_SIZE))
+        # The tail always changes when blocks are added or removed
+        f.seek(max(0, size - SAMPLE_SIZE))
+        digest.update(f.read(SAMPLE_SIZE))
+
+    return replication_timestamp, digest.hexdigest()
+
+
+class StatsCache:
+    """Surface statistics keyed by PBF content, stored in cache_dir"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, pbf_file):
+        """Cache key of a PBF file"""
+        replication_timestamp, digest = pbf_fingerprint(pbf_file)
+        return f"v{CACHE_VERSION}-{replication_timestamp or 0}-{digest}"
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def get(self, key):
+        """Return the cached entry ({'stats': ..., ...}) or None"""
+        try:
+            with open(self._path(key), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, pbf_file, stats, **extra):
+        """Store stats (and extra fields such as way counts) for a key"""
+        entry = dict(extra)
+        entry['stats'] = stats
+        entry['file'] = os.path.basename(pbf_file)
+        entry['created'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        path = self._path(key)
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_file, path)
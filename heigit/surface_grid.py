@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+
+"""
+Surface coverage per map tile: where the untagged roads are.
+
+Every counted highway way is binned into a fixed lat/lon tile grid by the
+location of its first node, counting ways with and without a surface per
+highway class. The file is read in the two phases of country_stats.py
+(way blobs, then node blobs), every blob is decompressed once and no node
+location index is needed.
+
+Workers count into flat slot arrays that are run-length encoded before
+they are returned, the parent adds them into one dense uint32 array. The
+grid is written as a NumPy .npy file (readable with numpy.load(), written
+without NumPy) of shape
+
+  (len(HIGHWAY_TYPES), 2, rows, cols)   [class, without/with surface, row, col]
+
+with row 0 at the north edge, plus a JSON sidecar (<grid>.json) with the
+tile size, the position of the grid on the global tile lattice and the
+source PBF. Grids cover the header bbox of the PBF, snapped to whole tiles,
+so a country stays small; a planet grid of 0.1 degree tiles (1801 x 3601)
+is about 470 MB. Grids with the same tile size can be diffed (diff_grids()),
+e.g. the original against the modified file of a country: both grids are
+read and compared row by row, unchanged rows are skipped with one bytes
+comparison and no dense difference grid is built, so a planet diff needs
+only a few MB.
+
+Usage: ./surface_grid.py build country-latest.osm.pbf [-o grid.npy] [--tile-size 0.1]
+       ./surface_grid.py diff original.npy modified.npy [-o diff.npy] [--top 20]
+"""
+
+import argparse
+import ast
+import json
+import math
+import os
+import struct
+import sys
+import heapq
+import operator
+from array import array
+from itertools import groupby
+
+from country_stats import collect_way_refs, iter_first_node_ways, run_blob_ranges
+from pbf_blocks import scan_blobs, find_way_blobs, find_node_blobs, read_header
+from surface_stats import HIGHWAY_TYPES
+
+
+DEFAULT_TILE_SIZE = 0.1
+
+NPY_MAGIC = b'\x93NUMPY'
+_NPY_TYPES = {'I': 'u4', 'i': 'i4', 'q': 'i8'}
+
+
+# ============================================================================
+# .NPY FILES
+# ============================================================================
+
+def npy_header(typecode, shape):
+    """.npy header of a C-ordered array of the given array typecode and shape"""
+    byteorder = '<' if sys.byteorder == 'little' else '>'
+    header = repr({'descr': byteorder + _NPY_TYPES[typecode], 'fortran_order': False,
+                   'shape': tuple(shape)}).encode('latin1')
+    # Magic, version, header length and header are padded to 64 bytes
+    padding = 64 - (len(NPY_MAGIC) + 4 + len(header) + 1) % 64
+    header += b' ' * (padding % 64) + b'\n'
+    return NPY_MAGIC + b'\x01\x00' + struct.pack('<H', len(header)) + header
+
+
+def write_npy(path, values, shape):
+    """Write a flat array as a C-ordered .npy file of the given shape (atomically)"""
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(npy_header(values.typecode, shape))
+        values.tofile(f)
+    os.replace(tmp_file, path)
+
+
+def read_npy_header(f, path):
+    """
+    Read the header of an open .npy file written by write_npy().
+    Returns (array typecode, shape, swapped), the file positioned at the data;
+    swapped is True if the data is not in native byte order.
+    """
+    if f.read(len(NPY_MAGIC)) != NPY_MAGIC:
+        raise ValueError(f"'{path}' is not a .npy file")
+    major, _ = f.read(2)
+    size_format = '<H' if major == 1 else '<I'
+    header_size, = struct.unpack(size_format, f.read(struct.calcsize(size_format)))
+    header = ast.literal_eval(f.read(header_size).decode('latin1'))
+    descr, shape = header['descr'], header['shape']
+    typecode = {'u4': 'I', 'i4': 'i', 'i8': 'q'}.get(descr[1:])
+    if typecode is None or header['fortran_order']:
+        raise ValueError(f"Unsupported .npy layout in '{path}': {header}")
+    return typecode, shape, descr[0] != ('<' if sys.byteorder == 'little' else '>')
+
+
+def read_npy(path):
+    """Read a .npy file written by write_npy(). Returns (flat array, shape)"""
+    with open(path, 'rb') as f:
+        typecode, shape, swapped = read_npy_header(f, path)
+        values = array(typecode)
+        values.frombytes(f.read())
+    if swapped:
+        values.byteswap()
+    if len(values) != math.prod(shape):
+        raise ValueError(f"'{path}' is truncated")
+    return values, shape
+
+
+# ============================================================================
+# GRID GEOMETRY
+# ============================================================================
+
+def grid_extent(tile_size, bbox=None):
+    """
+    Tile lattice position of a grid covering bbox (left, bottom, right, top),
+    default the whole world. Returns (col_offset, row_offset, rows, cols):
+    the global tile column of the first column and tile row of the top row.
+    """
+    left, bottom, right, top = bbox or (-180.0, -90.0, 180.0, 90.0)
+    col_offset = math.floor(left / tile_size)
+    row_offset = math.floor(top / tile_size)
+    cols = math.floor(right / tile_size) - col_offset + 1
+    rows = row_offset - math.floor(bottom / tile_size) + 1
+    return col_offset, row_offset, rows, cols
+
+
+def grid_path(pbf_file):
+    """Default path of the grid of a PBF file"""
+    name = os.path.basename(pbf_file)
+    for suffix in ('.osm.pbf', '.pbf'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return os.path.join(os.path.dirname(pbf_file), name + '.grid.npy')
+
+
+def meta_path(grid_file):
+    return grid_file + '.json'
+
+
+def read_grid(grid_file):
+    """Returns (flat uint32 counts, metadata dict)"""
+    values, _ = read_npy(grid_file)
+    with open(meta_path(grid_file), 'r') as f:
+        return values, json.load(f)
+
+
+def is_grid_current(pbf_file, grid_file, tile_size):
+    """Check that the grid exists and was built from the current PBF with this tile size"""
+    try:
+        with open(meta_path(grid_file), 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    source = os.stat(pbf_file)
+    return (os.path.exists(grid_file) and meta.get('tile_size') == tile_size
+            and meta.get('source_size') == source.st_size and meta.get('source_mtime_ns') == source.st_mtime_ns)
+
+
+# ============================================================================
+# GRID ENGINE
+# ============================================================================
+
+# Set in the parent before the node phase pool is forked
+_worker_grid = None
+_worker_runs = None
+
+
+def count_tile_range(task):
+    """
+    Worker: bin the ways whose first node is in a range of blobs into grid
+    slots ((code * rows + row) * cols + col, code being class << 1 | surface).
+    Returns (sorted slot array, way count per slot, ways outside the grid).
+    """
+    pbf_file, blobs = task
+    tile_size, col_offset, row_offset, rows, cols = _worker_grid
+    slots = array('q')
+    outside = 0
+    for lon, lat, codes in iter_first_node_ways(pbf_file, blobs, _worker_runs):
+        row = row_offset - math.floor(lat / tile_size)
+        col = math.floor(lon / tile_size) - col_offset
+        if not (0 <= row < rows and 0 <= col < cols):
+            outside += len(codes)
+            continue
+        cell = row * cols + col
+        slots.extend((code * rows * cols) + cell for code in codes)
+
+    unique = array('q')
+    counts = array('I')
+    for slot, group in groupby(sorted(slots)):
+        unique.append(slot)
+        counts.append(sum(1 for _ in group))
+    return unique, counts, outside
+
+
+def collect_surface_grid(pbf_file, tile_size=DEFAULT_TILE_SIZE, workers=None, progress=None):
+    """
+    Bin the counted highway ways of pbf_file into tiles of tile_size degrees,
+    with `workers` processes (default: all cores).
+    progress(phase, done_ranges, total_ranges) is called after every range,
+    phase being 'ways' or 'nodes'.
+    Returns (flat uint32 counts, metadata dict), see the module docstring.
+    """
+    global _worker_grid, _worker_runs
+    workers = max(1, workers or os.cpu_count() or 1)
+    blobs = scan_blobs(pbf_file)
+    header = read_header(pbf_file)
+    col_offset, row_offset, rows, cols = grid_extent(tile_size, header['bbox'])
+
+    runs = []
+    highway_way_count = 0
+    for values, _, highway_ways in run_blob_ranges(pbf_file, collect_way_refs, find_way_blobs(pbf_file, blobs),
+                                                   workers, 'ways', progress):
+        if values:
+            runs.append(values)
+        highway_way_count += highway_ways
+
+    grid = array('I', bytes(4 * len(HIGHWAY_TYPES) * 2 * rows * cols))
+    outside = 0
+    _worker_grid = (tile_size, col_offset, row_offset, rows, cols)
+    _worker_runs = runs
+    try:
+        for slots, counts, outside_count in run_blob_ranges(pbf_file, count_tile_range,
+                                                            find_node_blobs(pbf_file, blobs),
+                                                            workers, 'nodes', progress):
+            for slot, count in zip(slots, counts):
+                grid[slot] += count
+            outside += outside_count
+    finally:
+        _worker_grid = _worker_runs = None
+
+    source = os.stat(pbf_file)
+    meta = {
+        'tile_size': tile_size,
+        'col_offset': col_offset,
+        'row_offset': row_offset,
+        'rows': rows,
+        'cols': cols,
+        'classes': HIGHWAY_TYPES,
+        'source': os.path.basename(pbf_file),
+        'source_size': source.st_size,
+        'source_mtime_ns': source.st_mtime_ns,
+        'replication_timestamp': header['replication_timestamp'],
+        'highway_ways': highway_way_count,
+        'binned_ways': sum(grid),
+        'outside_ways': outside,
+    }
+    return grid, meta
+
+
+def write_grid(grid_file, grid, meta):
+    write_npy(grid_file, grid, (len(meta['classes']), 2, meta['rows'], meta['cols']))
+    tmp_file = meta_path(grid_file) + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_file, meta_path(grid_file))
+
+
+def ensure_surface_grid(pbf_file, grid_file=None, tile_size=DEFAULT_TILE_SIZE, workers=None):
+    """
+    Return the path of the grid of a PBF file, (re)building it first if it
+    is missing, older than the file or of another tile size.
+    """
+    grid_file = grid_file or grid_path(pbf_file)
+    if not is_grid_current(pbf_file, grid_file, tile_size):
+        grid, meta = collect_surface_grid(pbf_file, tile_size, workers)
+        write_grid(grid_file, grid, meta)
+    return grid_file
+
+
+# ============================================================================
+# DIFF
+# ============================================================================
+
+class GridRows:
+    """A grid file opened for reading single rows, see diff_grids()"""
+
+    def __init__(self, grid_file):
+        with open(meta_path(grid_file), 'r') as f:
+            self.meta = json.load(f)
+        self.f = open(grid_file, 'rb')
+        typecode, shape, self.swapped = read_npy_header(self.f, grid_file)
+        self.offset = self.f.tell()
+        size = os.fstat(self.f.fileno()).st_size
+        if typecode != 'I' or shape != (len(self.meta['classes']), 2, self.meta['rows'], self.meta['cols']):
+            raise ValueError(f"'{grid_file}' is not a grid of its metadata: {typecode} {shape}")
+        if size - self.offset != 4 * math.prod(shape):
+            self.f.close()
+            raise ValueError(f"'{grid_file}' is truncated")
+
+    def row_bytes(self, layer, row):
+        """Raw counts of one row of a layer (class * 2 + with surface)"""
+        start = self.offset + 4 * (layer * self.meta['rows'] + row) * self.meta['cols']
+        return os.pread(self.f.fileno(), 4 * self.meta['cols'], start)
+
+    def close(self):
+        self.f.close()
+
+
+def diff_grids(old_file, new_file):
+    """
+    Per-tile change from the grid old_file to new_file (same tile size, the
+    extents may differ). Returns (metadata dict of the difference grid over
+    the union of both extents, iterator of (row, {layer: int32 row of
+    differences new - old})) over the rows with a change, top to bottom.
+    Layers are class * 2 + with surface, as in the grid files.
+    """
+    grids = [GridRows(old_file), GridRows(new_file)]
+    old_meta, new_meta = (grid.meta for grid in grids)
+    if old_meta['tile_size'] != new_meta['tile_size'] or old_meta['classes'] != new_meta['classes']:
+        for grid in grids:
+            grid.close()
+        raise ValueError(f"'{old_file}' and '{new_file}' have different tile sizes or classes")
+
+    col_offset = min(grid.meta['col_offset'] for grid in grids)
+    row_offset = max(grid.meta['row_offset'] for grid in grids)
+    cols = max(grid.meta['col_offset'] + grid.meta['cols'] for grid in grids) - col_offset
+    rows = row_offset - min(grid.meta['row_offset'] - grid.meta['rows'] for grid in grids)
+    layers = len(old_meta['classes']) * 2
+
+    meta = dict(old_meta, col_offset=col_offset, row_offset=row_offset, rows=rows, cols=cols,
+                source=old_meta['source'], compared_to=new_meta['source'])
+    for key in ('source_size', 'source_mtime_ns', 'replication_timestamp', 'highway_ways',
+                'binned_ways', 'outside_ways'):
+        meta.pop(key, None)
+
+    def union_row(grid, layer, row, raw):
+        """A row of grid as uint32 counts over the union columns"""
+        values = array('I')
+        values.frombytes(raw)
+        if grid.swapped:
+            values.byteswap()
+        if grid.meta['cols'] == cols:
+            return values
+        full = array('I', bytes(4 * cols))
+        shift = grid.meta['col_offset'] - col_offset
+        full[shift:shift + grid.meta['cols']] = values
+        return full
+
+    def changes():
+        same_columns = (old_meta['col_offset'], old_meta['cols']) == (new_meta['col_offset'], new_meta['cols'])
+        zero_rows = [bytes(4 * grid.meta['cols']) for grid in grids]
+        try:
+            for row in range(rows):
+                changed = {}
+                for layer in range(layers):
+                    raws = []
+                    for grid in grids:
+                        grid_row = row - (row_offset - grid.meta['row_offset'])
+                        raws.append(grid.row_bytes(layer, grid_row) if 0 <= grid_row < grid.meta['rows'] else None)
+                    old_raw, new_raw = raws
+                    # Unchanged and empty rows cost a bytes comparison
+                    if same_columns and old_raw == new_raw:
+                        continue
+                    if all(raw is None or raw == zero for raw, zero in zip(raws, zero_rows)):
+                        continue
+                    old, new = (union_row(grid, layer, row, raw) if raw is not None else array('I', bytes(4 * cols))
+                                for grid, raw in zip(grids, raws))
+                    changed[layer] = array('i', map(operator.sub, new, old))
+                if changed:
+                    yield row, changed
+        finally:
+            for grid in grids:
+                grid.close()
+
+    return meta, changes()
+
+
+def top_tiles(changes, meta, count=20):
+    """
+    Tiles with the most ways that gained a surface (without surface count
+    dropped the most), as (left, top, ways, per class changes) tuples.
+    changes are the changed rows of diff_grids().
+    """
+    cols, tile_size, classes = meta['cols'], meta['tile_size'], meta['classes']
+
+    def gains():
+        for row, layers in changes:
+            per_cell = {}
+            for i, highway_type in enumerate(classes):
+                values = layers.get(i * 2)
+                if values is None or min(values) >= 0:
+                    continue
+                for col, change in enumerate(values):
+                    if change < 0:
+                        per_cell.setdefault(col, {})[highway_type] = -change
+            for col, per_class in per_cell.items():
+                yield sum(per_class.values()), row, col, per_class
+
+    return [((meta['col_offset'] + col) * tile_size, (meta['row_offset'] - row + 1) * tile_size, ways, per_class)
+            for ways, row, col, per_class in heapq.nlargest(count, gains(), key=lambda item: item[:3])]
+
+
+def write_diff_rows(diff_file, meta, changes):
+    """
+    Write the changed rows of diff_grids() as an int32 grid file (zeros
+    elsewhere, left sparse on disk) while passing them on.
+    """
+    rows, cols = meta['rows'], meta['cols']
+    shape = (len(meta['classes']), 2, rows, cols)
+    header = npy_header('i', shape)
+    tmp_file = diff_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(header)
+        f.truncate(len(header) + 4 * math.prod(shape))
+        for row, layers in changes:
+            for layer, values in layers.items():
+                f.seek(len(header) + 4 * (layer * rows + row) * cols)
+                values.tofile(f)
+            yield row, layers
+    os.replace(tmp_file, diff_file)
+    tmp_file = meta_path(diff_file) + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_file, meta_path(diff_file))
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Surface coverage per map tile')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='Bin the highway ways of a PBF file into a tile grid')
+    build.add_argument('pbf_file', help='Input .osm.pbf file')
+    build.add_argument('-o', '--output', default=None,
+                       help='Grid file (default: <name>.grid.npy next to the PBF)')
+    build.add_argument('--tile-size', type=float, default=DEFAULT_TILE_SIZE,
+                       help=f'Tile size in degrees (default: {DEFAULT_TILE_SIZE})')
+    build.add_argument('--workers', type=int, default=None,
+                       help='Worker processes (default: all cores)')
+    diff = commands.add_parser('diff', help='Compare two grids, e.g. original and modified')
+    diff.add_argument('old_grid')
+    diff.add_argument('new_grid')
+    diff.add_argument('-o', '--output', default=None, help='Write the difference grid (int32 .npy)')
+    diff.add_argument('--top', type=int, default=20, help='Tiles to list (default: 20)')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        grid_file = args.output or grid_path(args.pbf_file)
+
+        def progress(phase, done, total):
+            print(f"  {phase}: {done}/{total} ranges", end='\r')
+
+        print(f"Binning {args.pbf_file} into {args.tile_size:g}° tiles...")
+        grid, meta = collect_surface_grid(args.pbf_file, args.tile_size, args.workers, progress)
+        write_grid(grid_file, grid, meta)
+        print(f"\n✓ {grid_file}: {meta['rows']} x {meta['cols']} tiles, "
+              f"{meta['binned_ways']:,} of {meta['highway_ways']:,} highway ways binned "
+              f"({meta['outside_ways']:,} outside the bbox)")
+        return
+
+    try:
+        meta, changes = diff_grids(args.old_grid, args.new_grid)
+    except ValueError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+
+    # One pass over the changed rows: totals, the optional output and the top tiles
+    totals = [0] * (len(meta['classes']) * 2)
+
+    def add_totals(changes):
+        for row, layers in changes:
+            for layer, values in layers.items():
+                totals[layer] += sum(values)
+            yield row, layers
+
+    changes = add_totals(changes)
+    if args.output:
+        changes = write_diff_rows(args.output, meta, changes)
+    top = top_tiles(changes, meta, args.top)
+    if args.output:
+        print(f"✓ Wrote {args.output}")
+
+    print(f"{'Class':<15} {'Δ with surface':>15} {'Δ without':>15}")
+    for i, highway_type in enumerate(meta['classes']):
+        print(f"{highway_type:<15} {totals[i * 2 + 1]:>+15,} {totals[i * 2]:>+15,}")
+    print()
+    print(f"Top {args.top} tiles by ways that gained a surface:")
+    for left, top_edge, ways, per_class in top:
+        details = ', '.join(f"{highway_type} {count:,}" for highway_type, count in
+                            sorted(per_class.items(), key=lambda item: item[1], reverse=True))
+        print(f"  lat {top_edge - meta['tile_size']:8.3f}..{top_edge:<8.3f} lon {left:8.3f}..{left + meta['tile_size']:<8.3f}"
+              f" {ways:>8,}  ({details})")
+
+
+if __name__ == '__main__':
+    main()
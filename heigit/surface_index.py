@@ -0,0 +1,225 @@
+"""
+Compact, memory-mapped way ID -> surface index for HeiGIT surface data.
+
+The text file (one "way_id surface_value" per line) is compiled once into a
+binary index next to it (<ids_file>.idx):
+
+  header   magic, entry count, size and mtime of the source text file,
+           surface table size
+  surfaces interned surface values, '\n' separated (at most 256)
+  ids      sorted int64 way IDs (8-byte aligned)
+  codes    uint8 surface code per way ID
+
+The index is memory-mapped, so opening it is near instant, it costs 9 bytes
+per entry and its pages are shared between forked worker processes.
+It is rebuilt automatically whenever the text file's size or mtime change.
+"""
+
+import heapq
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+
+
+INDEX_MAGIC = b'SRFIDX01'
+# magic, count, source size, source mtime_ns, surface table bytes
+HEADER_FORMAT = '<8sQQqI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Number of entries sorted in memory at once while building the index
+BUILD_CHUNK_SIZE = 4_000_000
+
+# Way IDs are packed together with their surface code for sorting
+CODE_BITS = 8
+CODE_MASK = (1 << CODE_BITS) - 1
+
+
+def _packed_way_id(packed):
+    return packed >> CODE_BITS
+
+
+def index_path(ids_file):
+    """Path of the binary index belonging to an ids text file"""
+    return ids_file + '.idx'
+
+
+def iter_surface_entries(ids_file):
+    """
+    Parse an ids text file and yield (way_id, surface_value) tuples.
+    Invalid lines are reported and skipped.
+    """
+    with open(ids_file, 'r') as f:
+        line_num = 0
+        for line in f:
+            line_num += 1
+            line = line.strip()
+
+            # Skip empty lines and comments
+            if not line or line.startswith('#'):
+                continue
+
+            # Parse line: way_id surface_value
+            parts = line.split(None, 1)  # Split on whitespace, max 2 parts
+
+            if len(parts) != 2:
+                print(f"Warning: Invalid format on line {line_num}: '{line}'")
+                print(f"         Expected format: way_id surface_value")
+                continue
+
+            try:
+                way_id = int(parts[0])
+            except ValueError:
+                print(f"Warning: Invalid way ID on line {line_num}: '{parts[0]}'")
+                continue
+
+            surface_value = parts[1].strip()
+            if not surface_value:
+                print(f"Warning: Empty surface value on line {line_num}")
+                continue
+
+            yield way_id, surface_value
+
+
+def build_index(ids_file, output_file=None):
+    """
+    Compile an ids text file into a binary index.
+    Entries are sorted in chunks and merged, so memory stays at a few bytes
+    per entry even for tens of millions of IDs. If a way ID is listed more
+    than once, its last line wins, as with a dict built from the file.
+    Returns the number of entries written.
+    """
+    output_file = output_file or index_path(ids_file)
+    source = os.stat(ids_file)
+
+    surfaces = {}
+    chunks = []
+    chunk = array('q')
+    for way_id, surface_value in iter_surface_entries(ids_file):
+        code = surfaces.get(surface_value)
+        if code is None:
+            code = len(surfaces)
+            if code > CODE_MASK:
+                raise ValueError(f"More than {CODE_MASK + 1} distinct surface values in '{ids_file}'")
+            surfaces[surface_value] = code
+        chunk.append(way_id << CODE_BITS | code)
+        if len(chunk) >= BUILD_CHUNK_SIZE:
+            chunks.append(array('q', sorted(chunk, key=_packed_way_id)))
+            chunk = array('q')
+    if chunk:
+        chunks.append(array('q', sorted(chunk, key=_packed_way_id)))
+
+    ids = array('q')
+    codes = array('B')
+    duplicates = 0
+    # Sorting and merging by way ID only are both stable, so the entries of
+    # a way ID come in file order and the last one is kept
+    for packed in heapq.merge(*chunks, key=_packed_way_id):
+        way_id = packed >> CODE_BITS
+        if ids and ids[-1] == way_id:
+            duplicates += 1
+            codes[-1] = packed & CODE_MASK
+            continue
+        ids.append(way_id)
+        codes.append(packed & CODE_MASK)
+    del chunks
+    if duplicates:
+        print(f"Warning: {duplicates:,} duplicate way IDs in '{ids_file}', kept the last entry each")
+
+    surface_table = '\n'.join(sorted(surfaces, key=surfaces.get)).encode('utf-8')
+    header = struct.pack(HEADER_FORMAT, INDEX_MAGIC, len(ids), source.st_size,
+                         source.st_mtime_ns, len(surface_table))
+    padding = b'\0' * (-(HEADER_SIZE + len(surface_table)) % 8)
+
+    # Write to a temporary name first, so readers never see a partial index
+    tmp_file = output_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(header)
+        f.write(surface_table)
+        f.write(padding)
+        ids.tofile(f)
+        codes.tofile(f)
+    os.replace(tmp_file, output_file)
+    return len(ids)
+
+
+def is_index_current(ids_file, index_file=None):
+    """Check that the index exists and was built from the current text file"""
+    index_file = index_file or index_path(ids_file)
+    try:
+        with open(index_file, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+    except FileNotFoundError:
+        return False
+    if len(header) != HEADER_SIZE:
+        return False
+    magic, _, source_size, source_mtime_ns, _ = struct.unpack(HEADER_FORMAT, header)
+    source = os.stat(ids_file)
+    return (magic == INDEX_MAGIC and source_size == source.st_size
+            and source_mtime_ns == source.st_mtime_ns)
+
+
+class SurfaceIndex:
+    """
+    Read-only, memory-mapped way ID -> surface value mapping.
+    Supports the dict operations the surface tools use: len(), `in`,
+    [] and get(). Lookups are binary searches over the sorted ID array.
+    """
+
+    def __init__(self, index_file):
+        with open(index_file, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, _, _, table_size = struct.unpack_from(HEADER_FORMAT, self._mmap)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"'{index_file}' is not a surface index")
+
+        table_end = HEADER_SIZE + table_size
+        table = self._mmap[HEADER_SIZE:table_end].decode('utf-8')
+        self.surfaces = table.split('\n') if table else []
+
+        ids_offset = table_end + (-table_end % 8)
+        codes_offset = ids_offset + count * 8
+        view = memoryview(self._mmap)
+        self._ids = view[ids_offset:codes_offset].cast('q')
+        self._codes = view[codes_offset:codes_offset + count]
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def _find(self, way_id):
+        """Return the position of way_id in the ID array, or -1"""
+        pos = bisect_left(self._ids, way_id)
+        if pos < self._count and self._ids[pos] == way_id:
+            return pos
+        return -1
+
+    def get(self, way_id, default=None):
+        pos = self._find(way_id)
+        if pos < 0:
+            return default
+        return self.surfaces[self._codes[pos]]
+
+    def __contains__(self, way_id):
+        return self._find(way_id) >= 0
+
+    def __getitem__(self, way_id):
+        pos = self._find(way_id)
+        if pos < 0:
+            raise KeyError(way_id)
+        return self.surfaces[self._codes[pos]]
+
+
+def open_surface_index(ids_file):
+    """
+    Open the binary index for an ids text file, (re)building it first if it
+    is missing or older than the text file.
+    """
+    index_file = index_path(ids_file)
+    if not is_index_current(ids_file, index_file):
+        print(f"  Building surface index: {index_file}")
+        count = build_index(ids_file, index_file)
+        print(f"  Indexed {count:,} way IDs")
+    return SurfaceIndex(index_file)
@@ -0,0 +1,133 @@
+"""
+Live metrics for long surface rewrites, served in Prometheus text format.
+
+modify_osm_ways.py --metrics-port 9877 starts a small HTTP server thread
+that serves /metrics for the duration of the run. To scrape it, add a job
+to prometheus/prometheus.yml:
+
+  - job_name: 'modify_osm_ways'
+    scrape_interval: 15s
+    static_configs:
+      - targets: ['localhost:9877']
+
+Exported series (all prefixed with surface_rewrite_):
+  ways_total, input_bytes_total         processed ways and input bytes
+  rule_total{rule=...}                  ways per fired rule (skips included)
+  phase_seconds_total{phase=...}        time spent in decode / rules / write
+  ways_per_second, mb_per_second        throughput over the last update interval
+  input_size_bytes                      size of the input file
+  last_progress_timestamp_seconds       for stall alerts, e.g.
+                                        time() - surface_rewrite_last_progress_timestamp_seconds > 600
+  done                                  1 once the run has finished
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+PHASES = ('decode', 'rules', 'write')
+
+
+class RewriteMetrics:
+    """Thread-safe snapshot of the rewrite progress, updated by the main loop"""
+
+    def __init__(self, input_name, input_size):
+        self.input_name = input_name
+        self.input_size = input_size
+        self.lock = threading.Lock()
+        self.ways = 0
+        self.input_bytes = 0
+        self.rules = {}
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.ways_per_second = 0.0
+        self.mb_per_second = 0.0
+        self.last_update = time.time()
+        self.done = False
+
+    def update(self, ways, input_bytes, rules, phases):
+        """Publish new totals; throughput is computed against the previous update"""
+        now = time.time()
+        with self.lock:
+            elapsed = now - self.last_update
+            if elapsed > 0:
+                self.ways_per_second = (ways - self.ways) / elapsed
+                self.mb_per_second = (input_bytes - self.input_bytes) / elapsed / (1024 * 1024)
+            self.ways = ways
+            self.input_bytes = input_bytes
+            self.rules = dict(rules)
+            self.phases = dict(phases)
+            self.last_update = now
+
+    def finish(self):
+        with self.lock:
+            self.done = True
+            self.ways_per_second = 0.0
+            self.mb_per_second = 0.0
+
+    def render(self):
+        """Render all metrics in Prometheus text exposition format"""
+        label = f'input="{self.input_name}"'
+        with self.lock:
+            lines = [
+                '# HELP surface_rewrite_ways_total Ways processed',
+                '# TYPE surface_rewrite_ways_total counter',
+                f'surface_rewrite_ways_total{{{label}}} {self.ways}',
+                '# HELP surface_rewrite_input_bytes_total Input bytes processed',
+                '# TYPE surface_rewrite_input_bytes_total counter',
+                f'surface_rewrite_input_bytes_total{{{label}}} {self.input_bytes}',
+                '# HELP surface_rewrite_input_size_bytes Size of the input file',
+                '# TYPE surface_rewrite_input_size_bytes gauge',
+                f'surface_rewrite_input_size_bytes{{{label}}} {self.input_size}',
+                '# HELP surface_rewrite_rule_total Ways per fired surface rule',
+                '# TYPE surface_rewrite_rule_total counter',
+            ]
+            for rule, count in sorted(self.rules.items()):
+                lines.append(f'surface_rewrite_rule_total{{{label},rule="{rule}"}} {count}')
+            lines += [
+                '# HELP surface_rewrite_phase_seconds_total Time spent per processing phase',
+                '# TYPE surface_rewrite_phase_seconds_total counter',
+            ]
+            for phase in PHASES:
+                lines.append(f'surface_rewrite_phase_seconds_total{{{label},phase="{phase}"}} '
+                             f'{self.phases.get(phase, 0.0):.3f}')
+            lines += [
+                '# HELP surface_rewrite_ways_per_second Ways per second over the last update interval',
+                '# TYPE surface_rewrite_ways_per_second gauge',
+                f'surface_rewrite_ways_per_second{{{label}}} {self.ways_per_second:.1f}',
+                '# HELP surface_rewrite_mb_per_second Input MB per second over the last update interval',
+                '# TYPE surface_rewrite_mb_per_second gauge',
+                f'surface_rewrite_mb_per_second{{{label}}} {self.mb_per_second:.3f}',
+                '# HELP surface_rewrite_last_progress_timestamp_seconds Time of the last progress update',
+                '# TYPE surface_rewrite_last_progress_timestamp_seconds gauge',
+                f'surface_rewrite_last_progress_timestamp_seconds{{{label}}} {self.last_update:.0f}',
+                '# HELP surface_rewrite_done 1 once the rewrite has finished',
+                '# TYPE surface_rewrite_done gauge',
+                f'surface_rewrite_done{{{label}}} {int(self.done)}',
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+def start_metrics_server(metrics, port):
+    """Serve metrics.render() on http://0.0.0.0:<port>/metrics from a daemon thread"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Keep scrape requests out of the progress output
+            pass
+
+    server = ThreadingHTTPServer(('', port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
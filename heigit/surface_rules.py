@@ -0,0 +1,155 @@
+"""
+Declarative surface inference rules for highway ways.
+
+The rules live in surface_rules.json (or any file passed as --rules) and are
+compiled into a per-key lookup table, so a way is classified in a single pass
+over its own tags instead of one lookup per configured key.
+
+Rule sections, evaluated in this order:
+  smoothness         'bad' values skip the way, 'good' values mark it paved
+                     (before the HeiGIT lookup)
+  road_classes       only 'paved' highway classes can get an inferred surface,
+                     'always_paved' classes are paved without further checks
+  veto_tags          tag=value pairs that block inference (e.g. tracktype=grade3)
+  strong_indicators  tag=value pairs that mark a way paved, first match wins
+  indicator_tags     tags whose mere presence marks a way paved
+                     (maxspeed, lanes, ref, name, ...)
+
+Ways that already have a surface tag, or no highway tag, are always skipped.
+"""
+
+import json
+import os
+
+
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'surface_rules.json')
+
+RULE_SECTIONS = {'paved_value', 'smoothness', 'road_classes', 'veto_tags',
+                 'strong_indicators', 'indicator_tags'}
+
+# Results of SurfaceRules.classify()
+SKIP = 0        # Leave the way unchanged, count as skipped
+INFER = 1       # Add paved_value (decided before the HeiGIT lookup)
+CANDIDATE = 2   # Use the HeiGIT surface if listed, otherwise the returned rule (if any)
+
+# Rule names reported by classify()
+RULE_HAS_SURFACE = 'has_surface'
+RULE_NO_HIGHWAY = 'no_highway'
+RULE_BAD_SMOOTHNESS = 'bad_smoothness'
+RULE_SMOOTHNESS = 'smoothness'
+RULE_ROAD_CLASS = 'road_class'
+RULE_INDICATOR = 'indicator_tag'
+
+# Per-key action kinds in the compiled lookup table
+_SURFACE = 0
+_HIGHWAY = 1
+_SMOOTHNESS = 2
+_VETO = 3
+_STRONG = 4
+_INDICATOR = 5
+
+
+class SurfaceRules:
+    """Surface inference rules compiled from a rules config dict"""
+
+    def __init__(self, config):
+        unknown = set(config) - RULE_SECTIONS
+        if unknown:
+            raise ValueError(f"Unknown surface rule sections: {', '.join(sorted(unknown))}")
+
+        self.paved_value = config.get('paved_value', 'paved')
+
+        smoothness = config.get('smoothness', {})
+        self.good_smoothness = frozenset(smoothness.get('good', ()))
+        self.bad_smoothness = frozenset(smoothness.get('bad', ()))
+
+        road_classes = config.get('road_classes', {})
+        self.paved_highway_types = frozenset(road_classes.get('paved', ()))
+        self.always_paved_highway_types = frozenset(road_classes.get('always_paved', ()))
+
+        self.veto_tags = {k: frozenset(v) for k, v in config.get('veto_tags', {}).items()}
+        # Order matters: the first matching strong indicator is the reported rule
+        self.strong_indicators = [(k, frozenset(v)) for k, v in config.get('strong_indicators', {}).items()]
+        self.indicator_tags = frozenset(config.get('indicator_tags', ()))
+
+        # key -> tuple of (action kind, argument)
+        table = {}
+
+        def add(key, action):
+            table[key] = table.get(key, ()) + (action,)
+
+        add('surface', (_SURFACE, None))
+        add('highway', (_HIGHWAY, None))
+        add('smoothness', (_SMOOTHNESS, None))
+        for key, values in self.veto_tags.items():
+            add(key, (_VETO, values))
+        for rank, (key, values) in enumerate(self.strong_indicators):
+            add(key, (_STRONG, (rank, values)))
+        for key in self.indicator_tags:
+            add(key, (_INDICATOR, None))
+        self._table = table
+
+    def classify(self, tags):
+        """
+        Classify a way in one pass over its tags.
+        tags can be a dict or an osmium TagList.
+        Returns (action, rule) where action is SKIP, INFER or CANDIDATE.
+        For CANDIDATE, rule is the tag-based rule that would mark the way
+        paved if it is not in the HeiGIT list, or None.
+        """
+        items = tags.items() if isinstance(tags, dict) else ((tag.k, tag.v) for tag in tags)
+        table = self._table
+
+        has_surface = False
+        highway = None
+        smoothness = None
+        vetoed = False
+        strong_rank = None
+        has_indicator = False
+
+        for key, value in items:
+            actions = table.get(key)
+            if actions is None:
+                continue
+            for kind, arg in actions:
+                if kind == _INDICATOR:
+                    has_indicator = True
+                elif kind == _STRONG:
+                    rank, values = arg
+                    if value in values and (strong_rank is None or rank < strong_rank):
+                        strong_rank = rank
+                elif kind == _VETO:
+                    if value in arg:
+                        vetoed = True
+                elif kind == _HIGHWAY:
+                    highway = value
+                elif kind == _SURFACE:
+                    has_surface = bool(value)
+                else:
+                    smoothness = value
+
+        if has_surface:
+            return SKIP, RULE_HAS_SURFACE
+        if not highway:
+            return SKIP, RULE_NO_HIGHWAY
+        if smoothness in self.bad_smoothness:
+            return SKIP, RULE_BAD_SMOOTHNESS
+        if smoothness in self.good_smoothness:
+            return INFER, RULE_SMOOTHNESS
+
+        if highway not in self.paved_highway_types or vetoed:
+            return CANDIDATE, None
+        if highway in self.always_paved_highway_types:
+            return CANDIDATE, RULE_ROAD_CLASS
+        if strong_rank is not None:
+            return CANDIDATE, self.strong_indicators[strong_rank][0]
+        if has_indicator:
+            return CANDIDATE, RULE_INDICATOR
+        return CANDIDATE, None
+
+
+def load_rules(rules_file=None):
+    """Load and compile surface rules from a JSON file (default: surface_rules.json)"""
+    rules_file = rules_file or DEFAULT_RULES_FILE
+    with open(rules_file, 'r') as f:
+        return SurfaceRules(json.load(f))
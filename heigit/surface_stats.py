@@ -0,0 +1,276 @@
+"""
+Surface coverage statistics per highway class.
+
+Shared by analyze_countries.py (reading a PBF) and modify_osm_ways.py, which
+counts the coverage before and after the rewrite in the same pass that writes
+the modified file.
+
+Stats are plain dicts, so they can be summed over workers and stored as JSON:
+
+  {'residential': {'with_surface': 120, 'total': 800}, ...}
+
+Only the classes in HIGHWAY_TYPES are counted; '_link' roads count towards
+their main class.
+
+collect_stats_parallel() counts the stats of a whole PBF with worker
+processes that decode only way blocks (see pbf_blocks.find_way_blobs()),
+optionally summing way lengths from a node location index (node_index.py):
+entries then also hold 'km_with_surface' and 'km_total'.
+stream_stats() counts them from a sequential stream, e.g. an HTTP download,
+without the file ever being on disk.
+"""
+
+import multiprocessing
+import os
+from collections import deque
+
+from node_index import NodeLocationIndex
+from pbf_blocks import GROUP_WAYS, scan_blobs, find_way_blobs, read_frame, decode_frame, block_group_kinds, \
+    split_ranges, read_string_table, iter_way_tag_ids, iter_stream_frames, parse_header_block, decode_deltas
+
+
+HIGHWAY_TYPES = ['primary', 'trunk', 'secondary', 'tertiary',
+                 'residential', 'unclassified', 'service', 'track', 'cycleway']
+
+_HIGHWAY_TYPES = frozenset(HIGHWAY_TYPES)
+
+# Classes behind the headline figure (analyze_countries.calculate_percentage_without_surface())
+MAIN_ROAD_TYPES = ['secondary', 'tertiary', 'unclassified', 'cycleway']
+
+
+def highway_class(highway):
+    """Return the counted highway class of a highway value, or None"""
+    if not highway:
+        return None
+    if highway.endswith('_link'):
+        highway = highway[:-5]
+    return highway if highway in _HIGHWAY_TYPES else None
+
+
+def count_way(stats, highway_type, has_surface, length_km=None):
+    """
+    Count one way of a highway class (as returned by highway_class()).
+    With a length, the entry also sums 'km_with_surface' and 'km_total'.
+    """
+    entry = stats.get(highway_type)
+    if entry is None:
+        entry = stats[highway_type] = {'with_surface': 0, 'total': 0}
+    entry['total'] += 1
+    if has_surface:
+        entry['with_surface'] += 1
+    if length_km is not None:
+        entry['km_total'] = entry.get('km_total', 0.0) + length_km
+        if has_surface:
+            entry['km_with_surface'] = entry.get('km_with_surface', 0.0) + length_km
+        else:
+            entry.setdefault('km_with_surface', 0.0)
+
+
+def merge_stats(total, part):
+    """Add the stats of part to total"""
+    for highway_type, entry in part.items():
+        target = total.setdefault(highway_type, {'with_surface': 0, 'total': 0})
+        for key, value in entry.items():
+            target[key] = target.get(key, 0) + value
+    return total
+
+
+def has_lengths(stats):
+    """True if stats were counted with way lengths (see count_way())"""
+    return all('km_total' in entry for entry in stats.values())
+
+
+# ============================================================================
+# PARALLEL STATS ENGINE
+# ============================================================================
+
+# Blob ranges per worker, for load balancing
+RANGES_PER_WORKER = 4
+
+
+def iter_highway_ways(block, refs=None):
+    """
+    Yield (highway class or None, has_surface) of every way with a highway
+    tag in a decoded PrimitiveBlock, plus the node refs as requested by refs
+    (see pbf_blocks.iter_way_tag_ids()). Tags are matched on string table
+    indices, no tag dicts are built.
+    """
+    highway_keys = set()
+    surface_keys = set()
+    classes = {}
+    for i, raw in enumerate(read_string_table(block)):
+        if raw == b'highway':
+            highway_keys.add(i)
+        elif raw == b'surface':
+            surface_keys.add(i)
+        else:
+            highway_type = highway_class(raw.decode('utf-8', 'replace'))
+            if highway_type:
+                classes[i] = highway_type
+
+    for way in iter_way_tag_ids(block, refs):
+        highway = None
+        has_surface = False
+        for k, v in zip(way[0], way[1]):
+            if k in highway_keys:
+                highway = v
+            elif k in surface_keys:
+                has_surface = True
+        if highway is None:
+            continue
+        if refs:
+            yield classes.get(highway), has_surface, way[2]
+        else:
+            yield classes.get(highway), has_surface
+
+
+def count_block_stats(block, stats, nodes=None):
+    """
+    Count the highway ways of one decoded PrimitiveBlock into stats.
+    With nodes (a node_index.NodeLocationIndex) way lengths are summed too.
+    Returns (ways with a highway tag, counted highway ways).
+    """
+    way_count = 0
+    highway_way_count = 0
+    if nodes is None:
+        for highway_type, has_surface in iter_highway_ways(block):
+            way_count += 1
+            if highway_type:
+                highway_way_count += 1
+                count_way(stats, highway_type, has_surface)
+        return way_count, highway_way_count
+
+    for highway_type, has_surface, refs in iter_highway_ways(block, refs='packed'):
+        way_count += 1
+        if highway_type:
+            highway_way_count += 1
+            length_km = nodes.way_length(decode_deltas(refs)) if refs is not None else 0.0
+            count_way(stats, highway_type, has_surface, length_km)
+    return way_count, highway_way_count
+
+
+def count_range_stats(task):
+    """
+    Worker: count the stats of a range of blobs, with way lengths if a node
+    index file is given. Returns (stats, way_count, highway_way_count)
+    """
+    pbf_file, blobs, node_index_file = task
+    nodes = NodeLocationIndex(node_index_file) if node_index_file else None
+    stats = {}
+    way_count = 0
+    highway_way_count = 0
+    with open(pbf_file, 'rb') as f:
+        for blob in blobs:
+            block = decode_frame(read_frame(f, blob))
+            if GROUP_WAYS not in block_group_kinds(block):
+                continue
+            ways, highway_ways = count_block_stats(block, stats, nodes)
+            way_count += ways
+            highway_way_count += highway_ways
+    return stats, way_count, highway_way_count
+
+
+def collect_stats_parallel(pbf_file, workers=None, progress=None, node_index_file=None):
+    """
+    Count surface stats of all highway ways in pbf_file with `workers`
+    processes (default: all cores). With a node_index_file (see
+    node_index.py) the km per highway class are summed as well.
+    progress(done_ranges, total_ranges, way_count, highway_way_count) is
+    called after every finished range.
+    Returns (stats, way_count, highway_way_count) like
+    analyze_countries.collect_surface_stats().
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    way_blobs = find_way_blobs(pbf_file, scan_blobs(pbf_file))
+    ranges = split_ranges(way_blobs, workers * RANGES_PER_WORKER)
+    tasks = [(pbf_file, blob_range, node_index_file) for blob_range in ranges]
+
+    stats = {}
+    way_count = 0
+    highway_way_count = 0
+
+    def add(result, done):
+        nonlocal way_count, highway_way_count
+        range_stats, ways, highway_ways = result
+        merge_stats(stats, range_stats)
+        way_count += ways
+        highway_way_count += highway_ways
+        if progress:
+            progress(done, len(tasks), way_count, highway_way_count)
+
+    if workers == 1 or len(tasks) <= 1:
+        for done, task in enumerate(tasks, 1):
+            add(count_range_stats(task), done)
+    else:
+        with multiprocessing.get_context('fork').Pool(min(workers, len(tasks))) as pool:
+            for done, result in enumerate(pool.imap_unordered(count_range_stats, tasks), 1):
+                add(result, done)
+    return stats, way_count, highway_way_count
+
+
+def count_frame_stats(frame):
+    """
+    Worker: count the stats of one complete frame.
+    Returns (stats, way_count, highway_way_count, group kinds of the block).
+    """
+    block = decode_frame(frame)
+    kinds = block_group_kinds(block)
+    stats = {}
+    way_count = highway_way_count = 0
+    if GROUP_WAYS in kinds:
+        way_count, highway_way_count = count_block_stats(block, stats)
+    return stats, way_count, highway_way_count, kinds
+
+
+def stream_stats(stream, pool=None, window=16, stop_after_ways=False, progress=None):
+    """
+    Count surface stats from a PBF stream while it is read.
+    Frames are decoded by the worker pool (or inline without one), with at
+    most `window` frames in flight. With stop_after_ways=True reading stops
+    at the first relation-only block of a Sort.Type_then_ID file, so the
+    rest of the stream is never transferred.
+    progress(frames, way_count, highway_way_count) is called per frame.
+    Returns (stats, way_count, highway_way_count, replication_timestamp),
+    the timestamp taken from the OSMHeader (None if it has none).
+    """
+    stats = {}
+    totals = [0, 0, 0]  # frames, ways, highway ways
+    pending = deque()
+    sorted_by_type = False
+    replication_timestamp = None
+    past_ways = False
+
+    def collect(result):
+        nonlocal past_ways
+        frame_stats, ways, highway_ways, kinds = result
+        merge_stats(stats, frame_stats)
+        totals[0] += 1
+        totals[1] += ways
+        totals[2] += highway_ways
+        if sorted_by_type and kinds and min(kinds) > GROUP_WAYS:
+            past_ways = True
+        if progress:
+            progress(*totals)
+
+    for blob_type, frame in iter_stream_frames(stream):
+        if blob_type == 'OSMHeader':
+            header = parse_header_block(decode_frame(frame))
+            sorted_by_type = 'Sort.Type_then_ID' in header['optional_features']
+            replication_timestamp = header['replication_timestamp']
+            continue
+        if blob_type != 'OSMData':
+            continue
+        if pool is None:
+            collect(count_frame_stats(frame))
+        else:
+            pending.append(pool.apply_async(count_frame_stats, (frame,)))
+            while len(pending) >= window:
+                collect(pending.popleft().get())
+        if stop_after_ways and past_ways:
+            break
+
+    # Results are collected in stream order, so nothing after the first
+    # relation-only block is needed once past_ways is set
+    while pending and not (stop_after_ways and past_ways):
+        collect(pending.popleft().get())
+    return stats, totals[1], totals[2], replication_timestamp
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+"""
+Many group-by/count metrics over way tags in one pass over a PBF file.
+
+The metrics live in tag_metrics.json (or any file passed as --config), one
+entry per metric:
+
+  where     tag conditions a way must meet: a list of values, true (the tag
+            is present) or false (the tag is absent)
+  group_by  tag keys whose values the ways are grouped by (missing: null)
+  present   tag keys whose presence is counted per group
+
+A string value "@section.key" in where or present refers to a list in the
+surface rules (surface_rules.json, see surface_rules.py), e.g.
+"@indicator_tags", so the metrics follow the rules the modifier applies.
+
+Only way blocks are decoded, by worker processes (see
+pbf_blocks.find_way_blobs()). Every way's tags are looked at once: keys used
+by any metric are matched on string table indices, and each metric only adds
+its own condition checks and counter updates. Values are decoded once per
+block and group, not per way.
+
+The report is one JSON document:
+
+  {"source": ..., "ways": all ways, "metrics": {name: {
+      "ways": matching ways, "group_by": [...], "present": [...],
+      "groups": [{"values": {key: value}, "ways": n, "present": {key: n}}, ...]}}}
+
+with the groups of each metric ordered by way count.
+
+Usage: ./tag_metrics.py country-latest.osm.pbf [--config tag_metrics.json] [-o report.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from country_stats import run_blob_ranges
+from pbf_blocks import GROUP_WAYS, scan_blobs, find_way_blobs, read_frame, decode_frame, block_group_kinds, \
+    read_string_table, iter_way_tag_ids
+from surface_rules import DEFAULT_RULES_FILE
+
+
+DEFAULT_CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tag_metrics.json')
+
+METRIC_FIELDS = {'where', 'group_by', 'present'}
+
+# Groups listed per metric in the printed summary
+SUMMARY_GROUPS = 10
+
+
+class TagMetrics:
+    """Metrics compiled from a metrics config dict (references already resolved)"""
+
+    def __init__(self, config):
+        self.names = list(config)
+        self.metrics = []  # (where [(key, True/False/frozenset)], group_by keys, present keys)
+        keys = set()
+        for name, metric in config.items():
+            unknown = set(metric) - METRIC_FIELDS
+            if unknown:
+                raise ValueError(f"Unknown fields in metric '{name}': {', '.join(sorted(unknown))}")
+            where = []
+            for key, condition in metric.get('where', {}).items():
+                if not isinstance(condition, bool):
+                    condition = frozenset(condition)
+                where.append((key, condition))
+            group_by = tuple(metric.get('group_by', ()))
+            present = tuple(metric.get('present', ()))
+            self.metrics.append((where, group_by, present))
+            keys.update(key for key, _ in where)
+            keys.update(group_by)
+            keys.update(present)
+        self._keys = {key.encode('utf-8'): key for key in keys}
+
+    def new_counts(self):
+        """Empty counters: per metric {group values tuple: [ways, present counts...]}"""
+        return [{} for _ in self.metrics]
+
+    def count_block(self, block, counts):
+        """Count the ways of one decoded PrimitiveBlock into counts. Returns the number of ways"""
+        strings = read_string_table(block)
+        key_ids = {}
+        string_ids = {}
+        for i, raw in enumerate(strings):
+            key = self._keys.get(raw)
+            if key is not None:
+                key_ids[i] = key
+            string_ids.setdefault(raw, i)
+
+        # Value conditions as string table indices of this block
+        metrics = []
+        for where, group_by, present in self.metrics:
+            conditions = []
+            for key, condition in where:
+                if not isinstance(condition, bool):
+                    condition = frozenset(string_ids[value.encode('utf-8')] for value in condition
+                                          if value.encode('utf-8') in string_ids)
+                conditions.append((key, condition))
+            metrics.append((conditions, group_by, present, {}))
+
+        ways = 0
+        for keys, vals in iter_way_tag_ids(block):
+            ways += 1
+            tags = {key_ids[k]: v for k, v in zip(keys, vals) if k in key_ids}
+            for conditions, group_by, present, groups in metrics:
+                for key, condition in conditions:
+                    value = tags.get(key)
+                    if condition is True:
+                        if value is None:
+                            break
+                    elif condition is False:
+                        if value is not None:
+                            break
+                    elif value not in condition:
+                        break
+                else:
+                    group = tuple(tags.get(key, -1) for key in group_by)
+                    entry = groups.get(group)
+                    if entry is None:
+                        entry = groups[group] = [0] * (1 + len(present))
+                    entry[0] += 1
+                    for j, key in enumerate(present, 1):
+                        if key in tags:
+                            entry[j] += 1
+
+        for (_, _, _, groups), metric_counts in zip(metrics, counts):
+            for group, entry in groups.items():
+                values = tuple(strings[v].decode('utf-8', 'replace') if v >= 0 else None for v in group)
+                merge_entry(metric_counts, values, entry)
+        return ways
+
+    def report(self, counts, ways, source=None):
+        """Structured report of merged counters (see the module docstring)"""
+        metrics = {}
+        for name, (_, group_by, present), groups in zip(self.names, self.metrics, counts):
+            metrics[name] = {
+                'ways': sum(entry[0] for entry in groups.values()),
+                'group_by': list(group_by),
+                'present': list(present),
+                'groups': [{'values': dict(zip(group_by, values)), 'ways': entry[0],
+                            'present': dict(zip(present, entry[1:]))}
+                           for values, entry in sorted(groups.items(), key=lambda item: (-item[1][0], str(item[0])))],
+            }
+        return {'source': source, 'ways': ways, 'metrics': metrics}
+
+
+def merge_entry(groups, values, entry):
+    total = groups.get(values)
+    if total is None:
+        groups[values] = list(entry)
+    else:
+        for i, count in enumerate(entry):
+            total[i] += count
+
+
+def merge_counts(total, part):
+    """Add the counters of part to total"""
+    for total_groups, part_groups in zip(total, part):
+        for values, entry in part_groups.items():
+            merge_entry(total_groups, values, entry)
+
+
+def resolve_references(config, rules_config):
+    """Replace "@section.key" strings of a metrics config with lists from the surface rules config"""
+    def resolve(value):
+        if not (isinstance(value, str) and value.startswith('@')):
+            return value
+        target = rules_config
+        for part in value[1:].split('.'):
+            if not isinstance(target, dict) or part not in target:
+                raise ValueError(f"Unknown surface rules reference: {value}")
+            target = target[part]
+        if isinstance(target, dict):
+            # e.g. a tag -> values section: its keys
+            target = list(target)
+        return target
+
+    return {name: {field: ({key: resolve(condition) for key, condition in value.items()}
+                           if field == 'where' else resolve(value))
+                   for field, value in metric.items()}
+            for name, metric in config.items()}
+
+
+def load_metrics(config_file=None, rules_file=None):
+    """Load and compile metrics from a JSON file (default: tag_metrics.json)"""
+    with open(config_file or DEFAULT_CONFIG_FILE, 'r') as f:
+        config = json.load(f)
+    with open(rules_file or DEFAULT_RULES_FILE, 'r') as f:
+        rules_config = json.load(f)
+    return TagMetrics(resolve_references(config, rules_config))
+
+
+# ============================================================================
+# PARALLEL ENGINE
+# ============================================================================
+
+# Set in the parent before the pool is forked
+_worker_metrics = None
+
+
+def count_metrics_range(task):
+    """Worker: count the metrics of a range of blobs. Returns (counts, way_count)"""
+    pbf_file, blobs = task
+    metrics = _worker_metrics
+    counts = metrics.new_counts()
+    ways = 0
+    with open(pbf_file, 'rb') as f:
+        for blob in blobs:
+            block = decode_frame(read_frame(f, blob))
+            if GROUP_WAYS in block_group_kinds(block):
+                ways += metrics.count_block(block, counts)
+    return counts, ways
+
+
+def collect_tag_metrics(pbf_file, metrics, workers=None, progress=None):
+    """
+    Evaluate all metrics (a TagMetrics) over the ways of pbf_file with
+    `workers` processes (default: all cores).
+    progress(done_ranges, total_ranges) is called after every range.
+    Returns the report dict.
+    """
+    global _worker_metrics
+    workers = max(1, workers or os.cpu_count() or 1)
+    way_blobs = find_way_blobs(pbf_file, scan_blobs(pbf_file))
+
+    counts = metrics.new_counts()
+    ways = 0
+    _worker_metrics = metrics
+    try:
+        def range_progress(_, done, total):
+            if progress:
+                progress(done, total)
+
+        for part, part_ways in run_blob_ranges(pbf_file, count_metrics_range, way_blobs, workers, 'ways',
+                                               range_progress):
+            merge_counts(counts, part)
+            ways += part_ways
+    finally:
+        _worker_metrics = None
+    return metrics.report(counts, ways, os.path.basename(pbf_file))
+
+
+def print_report(report, groups=SUMMARY_GROUPS):
+    for name, metric in report['metrics'].items():
+        print()
+        print(f"{name}: {metric['ways']:,} ways" + (f" by {', '.join(metric['group_by'])}" if metric['group_by'] else ''))
+        for group in metric['groups'][:groups]:
+            label = ', '.join(f"{key}={value}" for key, value in group['values'].items() if value is not None)
+            if group['values'] and not label:
+                label = '(none)'
+            present = sorted(group['present'].items(), key=lambda item: item[1], reverse=True)
+            details = ', '.join(f"{key} {count / group['ways'] * 100:.1f}%" for key, count in present[:groups]
+                                if count)
+            print(f"  {label or 'all':<30} {group['ways']:>12,}  {details}")
+        if len(metric['groups']) > groups:
+            print(f"  ... {len(metric['groups']) - groups:,} more groups")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Count tag metrics over the ways of a PBF file in one pass')
+    parser.add_argument('pbf_file', help='Input .osm.pbf file')
+    parser.add_argument('--config', default=None,
+                        help='Metrics JSON (default: tag_metrics.json next to this script)')
+    parser.add_argument('--rules', default=None,
+                        help='Surface rules JSON for "@" references (default: surface_rules.json)')
+    parser.add_argument('-o', '--output', default=None, help='Write the report as JSON to this file')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    args = parser.parse_args()
+
+    try:
+        metrics = load_metrics(args.config, args.rules)
+    except (OSError, ValueError) as e:
+        print(f"✗ Cannot load metrics: {e}")
+        sys.exit(1)
+
+    start = time.time()
+    report = collect_tag_metrics(args.pbf_file, metrics, args.workers,
+                                 lambda done, total: print(f"  {done}/{total} ranges", end='\r'))
+    print(f"✓ {len(metrics.names)} metrics over {report['ways']:,} ways in {time.time() - start:.1f}s")
+    print_report(report)
+
+    if args.output:
+        tmp_file = args.output + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_file, args.output)
+        print(f"\n✓ Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -56,6 +56,24 @@ check_pbf_size() {
     echo "OK: $file size check passed (> ${min_gb}GB)"
 }
 
+# Verify the structure of a .pbf file: framing, blocks, ID order, and with an
+# input file the same counts, ID ranges and bbox (see heigit/check_pbf.py)
+# Usage: check_pbf_structure <file> [input_file]
+check_pbf_structure() {
+    local file=$1
+    local input=$2
+    local args=("$file" --workers "$(nproc)")
+    if [ -n "$input" ]; then
+        args+=(--input "$input")
+    fi
+    if ! python3 /home/$USER/data/AutoRouteServices/heigit/check_pbf.py "${args[@]}"; then
+        echo "Error: $file failed the structure check"
+        telegram-send "pbf check failed: $file structure $(hostname)"
+        exit 1
+    fi
+    echo "OK: $file structure check passed"
+}
+
 DO_PART1=false
 DO_PART2=false
 if [ "$PART" = "part1" ] || [ "$PART" = "both" ]; then
@@ -130,9 +148,11 @@ if [ "$FULL_MODE" = "full" ]; then
         echo "Merging Part 1 regions..."
 #        osmium merge --overwrite europe-latest.osm.pbf asia-latest.osm.pbf africa-latest.osm.pbf -o ~/disk/planet-part1.osm.pbf || { echo "osmium merge part1 failed"; telegram-send "osmium merge part1 failed $(hostname)"; exit 1; }
         check_pbf_size ~/disk/planet-part1.osm.pbf 50
+        check_pbf_structure ~/disk/planet-part1.osm.pbf
         cd ~/disk/AutoRoute
         MAVEN_OPTS="-XX:+UseParallelGC -Xmx150g" mvn exec:java -Dexec.mainClass="com.autoroute.osm.ModifyOsmWays" -Dexec.args="/home/$USER/disk/planet-part1.osm.pbf /home/$USER/data/AutoRouteServices/heigit/heygit_ids.txt" || { telegram-send "ModifyOsmWays part1 failed $(hostname)"; exit 1; }
         check_pbf_size ~/disk/planet-part1-modified.osm.pbf 70
+        check_pbf_structure ~/disk/planet-part1-modified.osm.pbf ~/disk/planet-part1.osm.pbf
     fi
 
     if [ "$DO_PART2" = true ]; then
@@ -145,9 +165,11 @@ if [ "$FULL_MODE" = "full" ]; then
         echo "Merging Part 2 regions..."
         osmium merge --overwrite north-america-latest.osm.pbf south-america-latest.osm.pbf australia-oceania-latest.osm.pbf -o ~/disk/planet-part2.osm.pbf || { echo "osmium merge part2 failed"; telegram-send "osmium merge part2 failed $(hostname)"; exit 1; }
         check_pbf_size ~/disk/planet-part2.osm.pbf 20
+        check_pbf_structure ~/disk/planet-part2.osm.pbf
         cd ~/disk/AutoRoute
         MAVEN_OPTS="-XX:+UseParallelGC -Xmx150g" mvn exec:java -Dexec.mainClass="com.autoroute.osm.ModifyOsmWays" -Dexec.args="/home/$USER/disk/planet-part2.osm.pbf /home/$USER/data/AutoRouteServices/heigit/heygit_ids.txt" || { telegram-send "ModifyOsmWays part2 failed $(hostname)"; exit 1; }
         check_pbf_size ~/disk/planet-part2-modified.osm.pbf 30
+        check_pbf_structure ~/disk/planet-part2-modified.osm.pbf ~/disk/planet-part2.osm.pbf
     fi
 else
     echo "Skipping download and osmium merge (not in full mode)"